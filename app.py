@@ -7,20 +7,31 @@ include slates, chyrons and credits.
 """
 
 import argparse
+import atexit
+import itertools
 import logging
 import math
+import threading
 import time
 import warnings
 from collections import namedtuple
-from typing import Union
+from typing import List, Union
 
 from clams import ClamsApp, Restifier
+from flask import jsonify
 from mmif import Mmif, AnnotationTypes, DocumentTypes, Document
 from mmif.utils import video_document_helper as vdh
 from mmif.utils import sequence_helper as sqh
 
 from metadata import default_model_storage
 from modeling.config import bins
+from modeling.registry import ClassifierRegistry
+
+
+# classification results of the sampled frames of a video: (positional model flag, labels, model name) of each 
+# model head, the precision used, positions (in milliseconds) of the TimePoints, a tensor of probabilities for each 
+# head, and classification stats to record in the view metadata
+TimePointResults = namedtuple('TimePointResults', ['heads', 'precision', 'positions', 'predictions', 'stats'])
 
 
 class SwtDetection(ClamsApp):
@@ -31,6 +42,17 @@ class SwtDetection(ClamsApp):
             fh = logging.FileHandler(f'{self.__class__.__name__}.log')
             fh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
             self.logger.addHandler(fh)
+        # keeps constructed classifiers in memory across requests
+        self.classifiers = ClassifierRegistry(default_model_storage, logger_name=self.logger.name)
+        # persistent cache of backbone features (`modeling.feature_cache.FeatureCache`), disabled unless set
+        self.feature_cache = None
+        # directory to checkpoint classification results of each finished batch in, disabled unless set
+        self.checkpoint_dir = None
+        # (number of workers, executor) of the process pool to classify shards of a video in parallel
+        self._shard_pool = None
+        # held while the pool is looked up (and possibly replaced) and shards are submitted to it, so that 
+        # concurrent requests never submit to a pool that another request is shutting down
+        self._shard_pool_lock = threading.Lock()
 
     def _appmetadata(self):
         # using metadata.py
@@ -72,72 +94,505 @@ class SwtDetection(ClamsApp):
             return mmif
         
         # isolate this import so that when running in stitcher mode, we don't need to import torch
-        from modeling import classify
         import torch
+        from modeling import cascade
+        from modeling import checkpoint
+        from modeling import feature_cache
+        from modeling import memory
+        from modeling import threads
 
-        batch_size = 2000
         vdh.capture(video)
         total_ms = int(vdh.framenum_to_millisecond(video, video.get_property(vdh.FRAMECOUNT_DOCPROP_KEY)))
         start_ms = max(0, parameters['tpStartAt'])
         final_ms = min(total_ms, parameters['tpStopAt'])
-        seek_time = 0
-        clss_time = 0
         sframe, eframe = [vdh.millisecond_to_framenum(video, p) for p in [start_ms, final_ms]]
         sampled = vdh.sample_frames(sframe, eframe, parameters['tpSampleRate'] / 1000 * video.get_property('fps'))
         self.logger.info(f'Sampled {len(sampled)} frames ' +
                          f'btw {start_ms} - {final_ms} ms (every {parameters["tpSampleRate"]} ms)')
-        all_preds = None
-        all_positions = []
+        # the results of each finished batch are checkpointed, so that an interrupted run with the same video and
+        # parameters resumes from the last finished batch
+        run_checkpoint = escalation_checkpoint = None
+        if self.checkpoint_dir is not None:
+            # parameters that only affect the speed are not part of the key
+            run_key = checkpoint.checkpoint_key(
+                feature_cache.content_hash(video.location_path(nonexist_ok=False)),
+                {k: v for k, v in parameters.items() if k.startswith('tp') and k not in
+                 ('tpDecodeMode', 'tpBatchSize', 'tpQueueDepth', 'tpPreprocessWorkers', 'tpShards',
+                  'tpMemoryBudget')})
+            run_checkpoint = checkpoint.Checkpoint(self.checkpoint_dir, run_key, logger_name=self.logger.name)
+            if parameters['tpCascade']:
+                escalation_checkpoint = checkpoint.Checkpoint(self.checkpoint_dir, f'{run_key}.escalated',
+                                                              logger_name=self.logger.name)
+
+        def classify(framenums, frames_checkpoint, **overrides):
+            classify_parameters = {**parameters, **overrides}
+            if classify_parameters['tpShards'] > 1:
+                return self._classify_sharded(video, framenums, frames_checkpoint, **classify_parameters)
+            return self._classify_timepoints(video, framenums, frames_checkpoint, **classify_parameters)
+
+        # name of the model that produced the scores of each TimePoint, and the model files of both stages for 
+        # each head, only recorded in cascade mode
+        classified_by = cascade_models = None
+        memory.reset_peak_rss()
+        if parameters['tpCascade']:
+            # all frames are classified by the cheap model first, and only those it is not certain about are 
+            # classified again by the `tpModelName` model
+            results = classify(sampled, run_checkpoint, tpModelName=parameters['tpCascadeModelName'])
+            classified_by = [parameters['tpCascadeModelName']] * len(results.positions)
+            uncertain = cascade.uncertain(results.predictions[0], parameters['tpCascadeMinConfidence'],
+                                          parameters['tpCascadeMaxEntropy'])
+            frame_at = {int(vdh.framenum_to_millisecond(video, framenum)): framenum for framenum in sampled}
+            escalated = [frame_at[position] for position, escalate in zip(results.positions, uncertain) if escalate]
+            self.logger.info(f"Escalating {len(escalated)} of {len(results.positions)} frames "
+                             f"from {parameters['tpCascadeModelName']} to {parameters['tpModelName']}")
+            cheap_heads = results.heads
+            if escalated:
+                # escalated frames are scattered, hence classified as they are, without sparse sampling
+                escalated_results = classify(escalated, escalation_checkpoint, tpAdaptiveStride=0, tpSceneStride=0)
+                if any(labels != cheap_labels for (_, labels, _), (_, cheap_labels, _)
+                       in zip(escalated_results.heads, results.heads)):
+                    raise ValueError("Models of a cascade must be trained with the same labels")
+                row_of = {position: i for i, position in enumerate(results.positions)}
+                rows = [row_of[position] for position in escalated_results.positions]
+                predictions = []
+                for cheap, expensive in zip(results.predictions, escalated_results.predictions):
+                    cheap = cheap.clone()
+                    cheap[rows] = expensive
+                    predictions.append(cheap)
+                for row in rows:
+                    classified_by[row] = parameters['tpModelName']
+                # frames that went through a backbone (or skipped it) count in both passes
+                results = results._replace(heads=escalated_results.heads, predictions=predictions, stats={
+                    **results.stats,
+                    'classifiedFrames': results.stats['classifiedFrames'] + escalated_results.stats['classifiedFrames'],
+                    'skippedFrames': results.stats['skippedFrames'] + escalated_results.stats['skippedFrames'],
+                    'peakRssBytes': max(results.stats.get('peakRssBytes', 0),
+                                        escalated_results.stats.get('peakRssBytes', 0))})
+                escalation_heads = [model_stem for _, _, model_stem in escalated_results.heads]
+            else:
+                escalation_heads = [self.classifiers.find_model_stem(parameters['tpModelName'], use_pos_model).name
+                                    for use_pos_model, _, _ in cheap_heads]
+            cascade_models = [{parameters['tpCascadeModelName']: cheap_model_stem, parameters['tpModelName']: stem}
+                              for (_, _, cheap_model_stem), stem in zip(cheap_heads, escalation_heads)]
+            # counted over the final TimePoints, rather than over the frames sent to the second stage
+            results = results._replace(stats={**results.stats, 'escalatedFrames': sum(
+                1 for model_name in classified_by if model_name == parameters['tpModelName'])})
+        else:
+            results = classify(sampled, run_checkpoint)
+        # peak memory of this process, plus that of the shard workers (which report their own), if any
+        peak_rss = memory.peak_rss() + results.stats.get('peakRssBytes', 0)
+        self.logger.info(f"Peak RSS while classifying: {peak_rss / 2 ** 20:.0f} MiB")
+        results = results._replace(stats={**results.stats, 'peakRssBytes': peak_rss})
+
+        def add_view(labelset, predictions, properties=None, **configuration):
+            v = mmif.new_view()
+            self.sign_view(v, parameters)
+            # the effective values of parameters that were overridden or fell back go to the app configuration,
+            # what the run measured and other non-parameter information to additional properties
+            v.metadata.add_app_configuration('tpPrecision', results.precision)
+            for key, value in configuration.items():
+                v.metadata.add_app_configuration(key, value)
+            v.metadata.set_additional_property('runStatistics', {**results.stats, **threads.current_settings()})
+            for key, value in (properties or {}).items():
+                v.metadata.set_additional_property(key, value)
+            v.new_contain(
+                AnnotationTypes.TimePoint,
+                document=video.id, timeUnit='milliseconds', labelset=labelset)
+            # add classifier results to view
+            for i, (position, prediction) in enumerate(zip(results.positions, predictions)):
+                timepoint_annotation = v.new_annotation(AnnotationTypes.TimePoint)
+                classification = {lbl: prob.item() for lbl, prob in zip(labelset, prediction)}
+                label = max(classification, key=classification.get)
+                timepoint_annotation.add_property('timePoint', position)
+                timepoint_annotation.add_property('label', label)
+                timepoint_annotation.add_property('classification', classification)
+                if classified_by is not None:
+                    timepoint_annotation.add_property('classifiedBy', classified_by[i])
+
+        def cascade_properties(head_indices):
+            # model files of both stages of the cascade, for each head whose scores are in a view
+            if cascade_models is None:
+                return {}
+            return {'cascadeModels': [cascade_models[h] for h in head_indices]}
+
+        if parameters['tpMultiHead'] == 'ensemble':
+            labelset = results.heads[0][1]
+            if any(labels != labelset for _, labels, _ in results.heads):
+                raise ValueError("Models to ensemble must be trained with the same labels")
+            add_view(labelset, torch.stack(results.predictions).mean(dim=0),
+                     properties={'ensembleModels': [model_name for _, _, model_name in results.heads],
+                                 **cascade_properties(range(len(results.heads)))})
+        else:
+            # the view of the requested model is added last, as the stitcher uses the last TimePoint view
+            for h in reversed(range(len(results.heads))):
+                use_pos_model, labels, _ = results.heads[h]
+                add_view(labels, results.predictions[h], properties=cascade_properties([h]),
+                         tpUsePosModel=use_pos_model)
+        for finished_checkpoint in (run_checkpoint, escalation_checkpoint):
+            if finished_checkpoint is not None:
+                finished_checkpoint.remove()
+
+    def _classify_timepoints(self, video: Document, sampled: List[int], run_checkpoint=None, cuts=None,
+                             **parameters) -> 'TimePointResults':
+        """
+        Classifies the sampled frames of the video (with all model heads requested by the parameters).
+
+        :param video: the video document, with its frame count and frame rate captured
+        :param sampled: sorted frame numbers of the uniform sampling grid
+        :param run_checkpoint: a `modeling.checkpoint.Checkpoint` to save the results of each finished batch in, 
+                               and to resume from
+        :param cuts: frame numbers of the scene cuts of the whole video, when already detected (see 
+                     `_detect_cuts`), only used for scene-change sampling
+        """
+        import numpy
+        import torch
+        from modeling import feature_cache
+        from modeling import jobs
+        from modeling import memory
+        from modeling import pipeline
+        from modeling import sampling
+        from modeling import video as video_frames
+
+        # number of frames classified between two checkpoints
+        checkpoint_interval = 2000
+        total_ms = int(vdh.framenum_to_millisecond(video, video.get_property(vdh.FRAMECOUNT_DOCPROP_KEY)))
         t = time.perf_counter()
-        # in the following, the .glob() should always return only one, otherwise we have a problem
-        ## naming convention from train.py + gridsearch.py = {timestamp}.{backbonename}.{prebinname}.pos{T/F}.pt
-        ## right now, `prebinname` is fixed to `nomap` as we don't use prebinning
-        model_filestem = next(default_model_storage.glob(
-            f"*.{parameters['tpModelName']}.*.pos{'T' if parameters['tpUsePosModel'] else 'F'}.pt")).stem
-        self.logger.info(f"Initiating classifier with {model_filestem}")
-        classifier = classify.Classifier(default_model_storage / model_filestem,
-                                         self.logger.name if self.logger.isEnabledFor(logging.DEBUG) else None)
+        classifier = self.classifiers.get(parameters['tpModelName'], parameters['tpUsePosModel'],
+                                          self.logger.name if self.logger.isEnabledFor(logging.DEBUG) else None)
         if self.logger.isEnabledFor(logging.DEBUG):
             self.logger.debug(f"Classifier initiation took {time.perf_counter() - t:.2f} seconds")
-        for i, batch in enumerate(range(0, len(sampled), batch_size)):
-            self.logger.info(f"Extracting batch {i + 1} of size {batch_size} from {batch} to {min(batch + batch_size, len(sampled))}")
-            batched_sampled = sampled[batch:batch + batch_size]
-            positions = [int(vdh.framenum_to_millisecond(video, sample)) for sample in batched_sampled]
-            # extract images
-            t = time.perf_counter()
-            extracted = vdh.extract_frames_as_images(video, batched_sampled, as_PIL=True)
-            if not extracted:
-                # in a rare case, where the difference between 29.97 and 29.97002997002997 actually matters, we might 
-                # get 1+final_frame as the last sample, which will result in an empty list
-                continue
-            seek_time += time.perf_counter() - t
+        self.logger.info(f"Classifier registry stats: {self.classifiers.stats()}")
+        # bf16 falls back to fp32 on devices without native support
+        precision = classifier.resolve_precision(parameters['tpPrecision'])
+        # (positional model flag, classifier) pairs of the heads to apply to the backbone features, the other
+        # model of the same backbone shares the backbone with the requested one (see `ClassifierRegistry`)
+        heads = [(parameters['tpUsePosModel'], classifier)]
+        if parameters['tpMultiHead'] != 'single':
+            heads.append((not parameters['tpUsePosModel'],
+                          self.classifiers.get(parameters['tpModelName'], not parameters['tpUsePosModel'],
+                                               self.logger.name if self.logger.isEnabledFor(logging.DEBUG) else None)))
+            if parameters['tpBackend'] != 'eager':
+                self.logger.warning(f"Multiple heads need backbone features, which the fused graph of "
+                                    f"{parameters['tpBackend']} backend doesn't expose, using eager backend instead")
+
+        # backbone features of the frames seen before (e.g. with another model head) are read from the feature 
+        # cache, and those frames are not decoded at all. Fused graphs of other backends don't expose features.
+        use_feature_cache = self.feature_cache is not None and (
+                parameters['tpBackend'] == 'eager' or parameters['tpMultiHead'] != 'single')
+        # the classification stage only runs the backbone, and heads are applied after all frames are featurized
+        extract_only = use_feature_cache or len(heads) > 1
+        if use_feature_cache:
+            cache_key = self.feature_cache.key(
+                feature_cache.content_hash(video.location_path(nonexist_ok=False)),
+                f"{classifier.featurizer.img_encoder.name}.{precision}."
+                f"{'resized' if parameters['tpDecodeResize'] else 'full'}")
+
+        reader = video_frames.FrameReader(
+            video.location_path(nonexist_ok=False), video.get_property('fps'),
+            # frames are scaled down to the backbone input size already during decoding
+            short_side=classifier.input_size() if parameters['tpDecodeResize'] else None)
+        minibatch_size = parameters['tpBatchSize']
+        if parameters['tpMemoryBudget'] > 0:
+            # each stage and queue of the pipeline can hold a mini-batch, see `pipeline.run`
+            per_frame = memory.frame_bytes(
+                reader.frame_shape(), classifier.featurizer.img_encoder.preprocess.crop_size[0],
+                classifier.featurizer.feature_vector_dim(),
+                2 * parameters['tpQueueDepth'] + parameters['tpPreprocessWorkers'] + 2)
+            minibatch_size = memory.batch_size_for_budget(parameters['tpMemoryBudget'], per_frame, minibatch_size)
+            self.logger.info(f"Using mini-batches of {minibatch_size} frames for a memory budget of "
+                             f"{parameters['tpMemoryBudget']} bytes ({per_frame} bytes per frame)")
 
-            # classify images
-            t = time.perf_counter()
-            predictions = classifier.classify_images(extracted, positions, total_ms)
-            if all_preds is None:
-                all_preds = predictions
+        def to_millisecond(framenum):
+            return int(vdh.framenum_to_millisecond(video, framenum))
+
+        duplicate_threshold = parameters['tpDuplicateThreshold']
+        # frames that went through the backbone, and near-duplicate frames that didn't
+        classified_count = skipped_count = 0
+        # number of frames with results so far, for the progress of asynchronous jobs
+        frames_done = 0
+
+        def classify_frames(framenums):
+            """
+            Classifies the given (sorted) frames with all heads, returns the frame numbers that could be 
+            classified and a tensor of probabilities for each head.
+            """
+            nonlocal skipped_count, frames_done
+            to_decode = framenums
+            cached_frames = []
+            cached_features = numpy.zeros((0, 0), numpy.float32)
+            new_frames = []
+            # frame number of a near-duplicate frame -> frame number of the classified frame it duplicates
+            duplicates = {}
+            if use_feature_cache:
+                found, cached_features = self.feature_cache.get(cache_key, framenums)
+                cached_frames = [framenum for framenum, hit in zip(framenums, found) if hit]
+                to_decode = [framenum for framenum, hit in zip(framenums, found) if not hit]
+                self.logger.info(f"Found features of {len(cached_frames)} of {len(framenums)} frames "
+                                 f"in the feature cache")
+                frames_done += len(cached_frames)
+            # every decoded frame gets a row, either with the results of the frame or with those of the frame it 
+            # duplicates, so that results don't need to be concatenated
+            output_dim = classifier.featurizer.img_encoder.dim if extract_only else len(classifier.training_labels)
+            outputs = torch.empty(len(to_decode), output_dim)
+            # mini-batches of decoded frames are copied into reused arrays, which are released after preprocessing
+            batch_buffers = None
+
+            def decode():
+                nonlocal batch_buffers
+                frames = reader.read_frames(to_decode, parameters['tpDecodeMode'])
+                last_thumbnail = last_kept = None
+                self.logger.info(f"Extracting {len(to_decode)} frames in mini-batches of {minibatch_size}")
+                # hand over the images in mini-batches, so that the downstream stages can start early
+                # in a rare case, where the difference between 29.97 and 29.97002997002997 actually matters, we 
+                # might get 1+final_frame as the last sample, which can't be read and won't be yielded by the reader
+                for _ in range(0, len(to_decode), minibatch_size):
+                    extracted = list(itertools.islice(frames, minibatch_size))
+                    if not extracted:
+                        return
+                    if duplicate_threshold > 0:
+                        # frames are compared to the last kept frame (not just the previous one), so that 
+                        # slow fades don't accumulate into skipping frames that are actually different
+                        kept = []
+                        for framenum, image in extracted:
+                            thumbnail = video_frames.thumbnail(image)
+                            if last_thumbnail is not None and video_frames.thumbnail_distance(
+                                    thumbnail, last_thumbnail) < duplicate_threshold:
+                                duplicates[framenum] = last_kept
+                            else:
+                                kept.append((framenum, image))
+                                last_thumbnail, last_kept = thumbnail, framenum
+                        extracted = kept
+                        if not extracted:
+                            continue
+                    frame_shape = extracted[0][1].shape
+                    if batch_buffers is None:
+                        batch_buffers = pipeline.BufferPool(
+                            lambda: numpy.empty((minibatch_size, *frame_shape), numpy.uint8))
+                    buffer = batch_buffers.acquire()
+                    if buffer.shape[1:] != frame_shape:  # frame size changed mid-stream
+                        buffer = numpy.empty((minibatch_size, *frame_shape), numpy.uint8)
+                    batch_frames = [framenum for framenum, _ in extracted]
+                    for row, (_, image) in enumerate(extracted):
+                        buffer[row] = image
+                    # the decoded frames are not held while the generator is suspended, only their copies
+                    extracted = kept = image = None
+                    yield batch_frames, buffer
+
+            def preprocess(item):
+                framenums, buffer = item
+                # the preprocessed batch is a new tensor, not a view of the buffer, which can be reused right away
+                inputs = classifier.preprocess_images(buffer[:len(framenums)])
+                batch_buffers.release(buffer)
+                return framenums, inputs
+
+            def classify(item):
+                nonlocal classified_count, frames_done
+                framenums, inputs = item
+                row = len(new_frames)
+                new_frames.extend(framenums)
+                if extract_only:
+                    outputs[row:row + len(framenums)] = classifier.extract_features(
+                        inputs, preprocessed=True, precision=precision, channels_last=parameters['tpChannelsLast'])
+                else:
+                    outputs[row:row + len(framenums)] = classifier.classify_images(
+                        inputs, [to_millisecond(framenum) for framenum in framenums], total_ms, preprocessed=True,
+                        backend=parameters['tpBackend'], precision=precision,
+                        channels_last=parameters['tpChannelsLast'])
+                classified_count += len(framenums)
+                frames_done += len(framenums)
+                jobs.report_progress(frames_done / len(sampled))
+
+            # decoding, preprocessing and classification run concurrently in a pipeline of bounded queues
+            stage_stats = pipeline.run(decode(), preprocess, classify, queue_depth=parameters['tpQueueDepth'],
+                                       preprocess_workers=parameters['tpPreprocessWorkers'])
+            seek_time = stage_stats['decode']['busyTime']
+            prep_time = stage_stats['preprocess']['busyTime']
+            clss_time = stage_stats['inference']['busyTime']
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(f"Image extraction took: {seek_time:.2f} seconds\n")
+                self.logger.debug(f"Image preprocessing took: {prep_time:.2f} seconds\n")
+                self.logger.debug(f"Classification took {clss_time:.2f} seconds")
+            self.logger.info(f"Pipeline finished in {stage_stats['wallTime']:.2f} seconds, stage utilisation: " +
+                             ', '.join(f"{stage} {stage_stats[stage]['utilisation']:.0%}"
+                                       for stage in ('decode', 'preprocess', 'inference')))
+            if batch_buffers is not None:
+                self.logger.debug(f"Allocated {batch_buffers.created} frame batch buffers")
+            if use_feature_cache:
+                # only features actually computed by the backbone are cached, not those reused for near-duplicates
+                self.feature_cache.put(cache_key, new_frames, outputs[:len(new_frames)].numpy())
+                self.logger.info(f"Feature cache stats: {self.feature_cache.stats()}")
+            # near-duplicate frames reuse the probabilities (or backbone features, when the heads are applied 
+            # afterward) of the frame they duplicate
+            if duplicates:
+                skipped_count += len(duplicates)
+                frames_done += len(duplicates)
+                self.logger.info(f"Skipped {len(duplicates)} near-duplicate frames")
+                row_of = {framenum: i for i, framenum in enumerate(new_frames)}
+                outputs[len(new_frames):len(new_frames) + len(duplicates)] = outputs[
+                    [row_of[kept] for kept in duplicates.values()]]
+                new_frames = new_frames + list(duplicates)
+            # frames at the end of the video that couldn't be decoded have no results
+            outputs = outputs[:len(new_frames)]
+            if not extract_only:
+                order = sorted(range(len(new_frames)), key=new_frames.__getitem__)
+                return [new_frames[i] for i in order], [outputs[order]]
+            # classify cached and newly extracted features together, in frame order
+            frames = cached_frames + new_frames
+            order = sorted(range(len(frames)), key=frames.__getitem__)
+            features = torch.empty(len(frames), output_dim)
+            features[:len(cached_frames)] = torch.from_numpy(cached_features).reshape(-1, output_dim)
+            features[len(cached_frames):] = outputs
+            features = features[order]
+            frames = [frames[i] for i in order]
+            positions = [to_millisecond(framenum) for framenum in frames]
+            return frames, [head.classify_features(features, positions, total_ms, precision=precision,
+                                                   channels_last=parameters['tpChannelsLast'])
+                            for _, head in heads]
+
+        # results of the frames classified by a previous, interrupted, run with the same video and parameters
+        checkpointed = {}  # frame number -> probabilities of each head
+        if run_checkpoint is not None:
+            done_frames, done_outputs = run_checkpoint.load()
+            for i, framenum in enumerate(done_frames):
+                checkpointed[framenum] = [torch.from_numpy(head_outputs[i]) for head_outputs in done_outputs]
+            if checkpointed:
+                self.logger.info(f"Resuming from a checkpoint of {len(checkpointed)} classified frames")
+            frames_done = len(checkpointed)
+
+        def classify_with_checkpoint(framenums):
+            """
+            Same as `classify_frames`, but frames are classified in batches and the results of each finished batch 
+            are checkpointed, frames classified by an interrupted run are not classified again.
+            """
+            if run_checkpoint is None:
+                return classify_frames(framenums)
+            to_classify = [framenum for framenum in framenums if framenum not in checkpointed]
+            for batch in range(0, len(to_classify), checkpoint_interval):
+                frames, preds = classify_frames(to_classify[batch:batch + checkpoint_interval])
+                run_checkpoint.save(frames, [head_pred.numpy() for head_pred in preds])
+                for i, framenum in enumerate(frames):
+                    checkpointed[framenum] = [head_pred[i] for head_pred in preds]
+            frames = [framenum for framenum in framenums if framenum in checkpointed]
+            if not frames:
+                return frames, [torch.zeros(0, len(head.training_labels)) for _, head in heads]
+            return frames, [torch.stack([checkpointed[framenum][h] for framenum in frames]) for h in range(len(heads))]
+
+        adaptive_step = parameters['tpAdaptiveStride'] // parameters['tpSampleRate']
+        scene_step = parameters['tpSceneStride'] // parameters['tpSampleRate']
+        sampling_stats = {}
+        if adaptive_step > 1 or scene_step > 1:
+            # sparse sampling on the uniform grid of `sampled` frames, with the skipped frames interpolated
+            head_results = [{} for _ in heads]
+
+            def classify_indices(indices):
+                frames, preds = classify_with_checkpoint([sampled[i] for i in indices])
+                index_of = dict(zip((sampled[i] for i in indices), indices))
+                for results, head_pred in zip(head_results, preds):
+                    results.update((index_of[framenum], pred) for framenum, pred in zip(frames, head_pred))
+                return {index_of[framenum]: pred for framenum, pred in zip(frames, preds[0])}
+
+            initial = None
+            if scene_step > 1:
+                # dense around the scene cuts found in the packet metadata of the stream, sparse within shots
+                if cuts is None:
+                    cuts = self._detect_cuts(video)
+                window = round(parameters['tpSceneWindow'] / 1000 * video.get_property('fps'))
+                initial = sampling.scene_indices(sampled, cuts, scene_step, window)
+                sampling_stats['sceneCuts'] = sum(1 for cut in cuts if sampled[0] <= cut <= sampled[-1])
+            if adaptive_step > 1:
+                # coarse-to-fine refinement, the first head decides where to refine
+                sampling.refine(len(sampled), adaptive_step, classify_indices, parameters['tpAdaptiveMinConfidence'],
+                                initial=initial)
             else:
-                all_preds = torch.cat((all_preds, predictions), dim=0)
-            all_positions.extend(positions)
-            clss_time += time.perf_counter() - t
-        if self.logger.isEnabledFor(logging.DEBUG):
-            self.logger.debug(f"Image extraction took: {seek_time:.2f} seconds\n")
-            self.logger.debug(f"Classification took {clss_time:.2f} seconds")
+                classify_indices(initial)
+            self.logger.info(f"Sparse sampling classified {len(head_results[0])} of {len(sampled)} frames")
+            head_preds = []
+            for results in head_results:
+                indices, preds = sampling.interpolate(results)
+                head_preds.append(preds)
+            all_positions = [to_millisecond(sampled[i]) for i in indices]
+        else:
+            frames, head_preds = classify_with_checkpoint(sampled)
+            all_positions = [to_millisecond(framenum) for framenum in frames]
 
-        v = mmif.new_view()
-        self.sign_view(v, parameters)
-        v.new_contain(
-            AnnotationTypes.TimePoint,
-            document=video.id, timeUnit='milliseconds', labelset=classifier.training_labels)
-        # add classifier results to view
-        for position, prediction in zip(all_positions, all_preds):
-            timepoint_annotation = v.new_annotation(AnnotationTypes.TimePoint)
-            classification = {lbl: prob.item() for lbl, prob in zip(classifier.training_labels, prediction)}
-            label = max(classification, key=classification.get)
-            timepoint_annotation.add_property('timePoint', position)
-            timepoint_annotation.add_property('label', label)
-            timepoint_annotation.add_property('classification', classification)
+        return TimePointResults(
+            heads=[(use_pos_model, head.training_labels, head.model_stem.name) for use_pos_model, head in heads],
+            precision=precision, positions=all_positions, predictions=head_preds,
+            stats={'classifiedFrames': classified_count, 'skippedFrames': skipped_count, **sampling_stats})
+
+    def _classify_sharded(self, video: Document, sampled: List[int], run_checkpoint=None,
+                          **parameters) -> 'TimePointResults':
+        """
+        Same as `_classify_timepoints`, but the sampled frames are split into `tpShards` contiguous shards, 
+        classified in parallel by a pool of worker processes, each with its own decoder and classifier, and the 
+        results are merged in frame order.
+        """
+        import torch
+        from modeling import jobs
+        from modeling import sampling
+
+        shards = sampling.split(sampled, parameters['tpShards'])
+        t = time.perf_counter()
+        # scene cuts are detected once for the whole video, rather than by every shard worker
+        cuts = None
+        if parameters['tpSceneStride'] // parameters['tpSampleRate'] > 1:
+            cuts = self._detect_cuts(video)
+        video_json = video.serialize()
+        with self._shard_pool_lock:
+            pool = self._get_shard_pool(parameters['tpShards'])
+            futures = [pool.submit(_classify_shard, video_json, shard, run_checkpoint, cuts, parameters)
+                       for shard in shards]
+        shard_results = []
+        for future in futures:
+            results = TimePointResults(*future.result())
+            shard_results.append(results._replace(predictions=[torch.from_numpy(predictions)
+                                                               for predictions in results.predictions]))
+            jobs.report_progress(sum(len(shard) for shard in shards[:len(shard_results)]) / len(sampled))
+        self.logger.info(f"Classified {len(shards)} shards of {len(sampled)} frames "
+                         f"in {time.perf_counter() - t:.2f} seconds")
+        return TimePointResults(
+            heads=shard_results[0].heads, precision=shard_results[0].precision,
+            positions=[position for results in shard_results for position in results.positions],
+            predictions=[torch.cat(head_preds)
+                         for head_preds in zip(*(results.predictions for results in shard_results))],
+            stats={key: sum(results.stats[key] for results in shard_results) for key in shard_results[0].stats})
+
+    def _detect_cuts(self, video: Document) -> List[int]:
+        """
+        Returns frame numbers of likely scene cuts of the video, found in the packet metadata of its stream.
+        """
+        from modeling import video as video_frames
+
+        t = time.perf_counter()
+        cuts = video_frames.detect_cuts(video_frames.FrameReader(
+            video.location_path(nonexist_ok=False), video.get_property('fps')).scan_packets())
+        self.logger.info(f"Found {len(cuts)} likely scene cuts in {time.perf_counter() - t:.2f} seconds")
+        return cuts
+
+    def _get_shard_pool(self, workers: int):
+        """
+        Returns the pool of shard worker processes, which is kept across requests so that the workers keep their
+        classifiers in memory. Workers are spawned rather than forked (see `modeling.threads`), and share the 
+        intra-op threads of this process evenly. A pool of a different size is shut down once the shards already 
+        submitted to it are finished, hence callers must hold `_shard_pool_lock` until they have submitted theirs.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        import torch
+
+        if self._shard_pool is not None and self._shard_pool[0] != workers:
+            self._shard_pool[1].shutdown()
+            self._shard_pool = None
+        if self._shard_pool is None:
+            feature_cache_dir = self.feature_cache.cache_dir if self.feature_cache is not None else None
+            feature_cache_size = self.feature_cache.max_bytes if self.feature_cache is not None else None
+            self._shard_pool = (workers, ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_shard_worker,
+                initargs=(max(1, torch.get_num_threads() // workers), self.classifiers.max_models,
+                          feature_cache_dir, feature_cache_size)))
+            # workers are stopped before the interpreter starts tearing down modules
+            atexit.register(self._shard_pool[1].shutdown)
+        return self._shard_pool[1]
 
     def _annotate_timeframes(self, mmif: Mmif, **parameters) -> Mmif:
         
@@ -244,6 +699,19 @@ class SwtDetection(ClamsApp):
                              representatives=tf.representatives)
 
 
+def parse_model_spec(spec: str):
+    """
+    Parses a model specification for preloading. A spec is a model name as in `tpModelName` parameter, optionally
+    followed by `.posT` or `.posF` (following the model file naming convention) to select the model with or without
+    positional features. Without the suffix, the model with positional features is selected, same as the default 
+    value of `tpUsePosModel` parameter.
+    """
+    name, _, pos = spec.partition('.')
+    if pos not in ('', 'posT', 'posF'):
+        raise ValueError(f"Invalid model specification: {spec}")
+    return name, pos != 'posF'
+
+
 def get_app():
     """
     This function effectively creates an instance of the app class, without any arguments passed in, meaning, any
@@ -252,19 +720,205 @@ def get_app():
     """
     return SwtDetection(log_to_file=False)
 
+
+# app instance of a shard worker process, see `SwtDetection._classify_sharded`
+_shard_worker_app = None
+
+
+def _init_shard_worker(intra_op_threads: int, max_cached_models: int, feature_cache_dir, feature_cache_size):
+    global _shard_worker_app
+    import torch
+    torch.set_num_threads(intra_op_threads)
+    _shard_worker_app = get_app()
+    _shard_worker_app.classifiers.max_models = max_cached_models
+    if feature_cache_dir is not None:
+        from modeling.feature_cache import FeatureCache
+        _shard_worker_app.feature_cache = FeatureCache(feature_cache_dir, feature_cache_size,
+                                                       logger_name=_shard_worker_app.logger.name)
+
+
+def _classify_shard(video_json: str, framenums: List[int], run_checkpoint, cuts, parameters: dict) -> tuple:
+    from modeling import memory
+
+    video = Document(video_json)
+    # captured properties are not serialized with the document
+    vdh.capture(video)
+    memory.reset_peak_rss()
+    results = _shard_worker_app._classify_timepoints(video, framenums, run_checkpoint, cuts, **parameters)
+    results = results._replace(stats={**results.stats, 'peakRssBytes': memory.peak_rss()})
+    # arrays rather than tensors, so that the results are sent back through the pipe and not shared memory
+    return tuple(results._replace(predictions=[predictions.numpy() for predictions in results.predictions]))
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", action="store", default="5000", help="set port to listen")
     parser.add_argument("--production", action="store_true", help="run gunicorn server")
+    parser.add_argument("--max-cached-models", type=int, default=2,
+                        help="maximum number of classifier models to keep in memory across requests "
+                             "(least recently used models are evicted first, 0 to disable caching)")
+    parser.add_argument("--max-cached-memory", type=int, default=None,
+                        help="maximum total size (in MB) of classifier model weights to keep in memory across "
+                             "requests (no limit if not set)")
+    parser.add_argument("--preload-models", nargs='+', default=[], metavar='MODEL',
+                        help="names of the models (as in `tpModelName` parameter) to load and warm up before the "
+                             "server starts accepting requests. Add `.posF` suffix to a name to use the model "
+                             "without positional features (e.g. `convnext_small.posF`)")
+    parser.add_argument("--preload-backend", default='eager',
+                        choices=['eager', 'torchscript', 'compile', 'onnxruntime'],
+                        help="execution backend (as in `tpBackend` parameter) to warm up the preloaded models with")
+    parser.add_argument("--preload-precision", default='fp32',
+                        choices=['fp32', 'bf16', 'int8-dynamic', 'int8-static'],
+                        help="numerical precision (as in `tpPrecision` parameter) to warm up the preloaded models with")
+    parser.add_argument("--preload-channels-last", action='store_true',
+                        help="warm up the preloaded models with channels-last memory format (as in `tpChannelsLast` "
+                             "parameter)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of gunicorn worker processes in production mode (default: 2 x cores + 1)")
+    parser.add_argument("--intra-op-threads", default=None, metavar='{N,auto}',
+                        help="number of PyTorch threads used within an operation, per worker process. `auto` "
+                             "divides the available cores evenly among the workers. Defaults to all cores, which "
+                             "oversubscribes the cores when several workers classify videos at the same time")
+    parser.add_argument("--inter-op-threads", type=int, default=None,
+                        help="number of PyTorch threads used between independent operations, per worker process")
+    parser.add_argument("--pin-workers", action='store_true',
+                        help="pin each worker process to its own share of the available cores")
+    parser.add_argument("--feature-cache-dir", default=None,
+                        help="directory to cache backbone features of the processed frames in, so that re-processing "
+                             "a video (e.g. with another model head or stitcher parameters) skips decoding and "
+                             "featurizing the frames seen before. The directory can be shared by several servers. "
+                             "Caching is disabled if not set")
+    parser.add_argument("--feature-cache-size", type=int, default=None,
+                        help="maximum total size (in MB) of the feature cache, least recently used videos are "
+                             "evicted first (no limit if not set)")
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="directory to checkpoint the classification results of each finished batch of frames "
+                             "in, so that an interrupted run (e.g. a killed worker) on the same video with the same "
+                             "parameters resumes from the last finished batch. Checkpoints are removed when a run "
+                             "completes. Checkpointing is disabled if not set")
+    parser.add_argument("--jobs-dir", default=None,
+                        help="directory to keep a queue of asynchronous annotation jobs in, enables the `/jobs` API "
+                             "to submit a MMIF (POST `/jobs`, with parameters in the query string as for `/`) and poll "
+                             "for the status (GET `/jobs/<id>`) and output (GET `/jobs/<id>/result`) of the job. The "
+                             "directory can be shared by several servers. Jobs are disabled if not set")
+    parser.add_argument("--job-workers", type=int, default=1,
+                        help="number of jobs to run at the same time, per server process (default: 1)")
+    parser.add_argument("--max-queued-jobs", type=int, default=100,
+                        help="maximum number of jobs waiting to run, further submissions are rejected (default: 100)")
     parsed_args = parser.parse_args()
 
+    from modeling import threads
+    intra_op_threads = parsed_args.intra_op_threads
+    if intra_op_threads not in (None, 'auto'):
+        intra_op_threads = int(intra_op_threads)
+    thread_config = threads.ThreadConfig(intra_op_threads, parsed_args.inter_op_threads, parsed_args.pin_workers)
+    if parsed_args.production:
+        # workers are forked from this process after preloading, and OpenMP thread pools don't survive fork(), 
+        # hence this process stays single-threaded and each worker applies its own settings after the fork
+        threads.limit_to_single_thread()
+    else:
+        thread_config.apply()
+
     app = get_app()
+    app.classifiers.max_models = parsed_args.max_cached_models
+    if parsed_args.max_cached_memory is not None:
+        app.classifiers.max_bytes = parsed_args.max_cached_memory * 1024 * 1024
+    if parsed_args.feature_cache_dir is not None:
+        from modeling.feature_cache import FeatureCache
+        app.feature_cache = FeatureCache(parsed_args.feature_cache_dir,
+                                         None if parsed_args.feature_cache_size is None
+                                         else parsed_args.feature_cache_size * 1024 * 1024,
+                                         logger_name=app.logger.name)
+    app.checkpoint_dir = parsed_args.checkpoint_dir
+    preload_models = [parse_model_spec(spec) for spec in parsed_args.preload_models]
+    if len(preload_models) > app.classifiers.max_models:
+        app.logger.warning(f"Preloading {len(preload_models)} models, but only {app.classifiers.max_models} "
+                           f"can be kept in memory, increase `--max-cached-models` to keep all of them warm.")
+    for model_name, use_pos_model in preload_models:
+        t = time.perf_counter()
+        app.classifiers.preload(model_name, use_pos_model, backend=parsed_args.preload_backend,
+                                precision=parsed_args.preload_precision,
+                                channels_last=parsed_args.preload_channels_last)
+        app.logger.info(f"Preloaded {model_name} (positional model: {use_pos_model}) "
+                        f"in {time.perf_counter() - t:.2f} seconds")
 
     http_app = Restifier(app, port=int(parsed_args.port))
+
+    # readiness probe, the server only starts listening after all preloading is done, hence it's always ready
+    # when this responds, but the response also reports which models are currently warm
+    def readiness():
+        return jsonify(ready=True,
+                       warmModels=[f"{name}.pos{'T' if pos else 'F'}" for name, pos in app.classifiers.warm_models()],
+                       registry=app.classifiers.stats(),
+                       featureCache=app.feature_cache.stats() if app.feature_cache is not None else None)
+    http_app.flask_app.add_url_rule('/ready', 'ready', readiness)
+
+    # asynchronous jobs, for videos that take longer to annotate than clients and proxies keep a connection open
+    job_queue = None
+    if parsed_args.jobs_dir is not None:
+        from flask import Response, request
+        from modeling import jobs
+        job_queue = jobs.JobQueue(parsed_args.jobs_dir, parsed_args.max_queued_jobs, logger_name=app.logger.name)
+
+        def run_job(mmif, params):
+            try:
+                return app.annotate(mmif, **params)
+            except Exception as e:
+                app.logger.exception("Error in annotation")
+                raise jobs.JobError(f"{e.__class__.__name__}: {e}",
+                                    app.record_error(mmif, **params).serialize(pretty=True)) from e
+
+        def submit_job():
+            raw_data = request.get_data().decode('utf-8')
+            try:
+                Mmif(raw_data)
+            except Exception as e:
+                return Response(f"Invalid input data. See below for validation error.\n\n{e}", status=400,
+                                mimetype='text/plain')
+            try:
+                job_id = job_queue.submit(raw_data, request.args.to_dict(flat=False))
+            except jobs.QueueFull as e:
+                return jsonify(error=str(e)), 503
+            return (jsonify(jobId=job_id, status='queued', statusUrl=f'/jobs/{job_id}'), 202,
+                    {'Location': f'/jobs/{job_id}'})
+
+        def job_status(job_id):
+            try:
+                return jsonify(job_queue.status(job_id))
+            except KeyError:
+                return jsonify(error=f"Unknown job: {job_id}"), 404
+
+        def job_result(job_id):
+            try:
+                status = job_queue.status(job_id)
+            except KeyError:
+                return jsonify(error=f"Unknown job: {job_id}"), 404
+            output = job_queue.result(job_id)
+            if output is None:
+                # not finished yet, or failed without an output
+                return jsonify(status), 409 if status['status'] in ('queued', 'running') else 500
+            return Response(output, status=200 if status['status'] == 'done' else 500, mimetype='application/json')
+
+        http_app.flask_app.add_url_rule('/jobs', 'submit_job', submit_job, methods=['POST'])
+        http_app.flask_app.add_url_rule('/jobs/<job_id>', 'job_status', job_status)
+        http_app.flask_app.add_url_rule('/jobs/<job_id>/result', 'job_result', job_result)
+
     # for running the application in production mode
     if parsed_args.production:
-        http_app.serve_production()
+        options = thread_config.gunicorn_hooks()
+        if job_queue is not None:
+            # job worker threads don't survive the fork, hence each server process starts its own
+            apply_thread_config = options['post_fork']
+
+            def post_fork(server, worker):
+                apply_thread_config(server, worker)
+                job_queue.start_workers(parsed_args.job_workers, run_job)
+            options['post_fork'] = post_fork
+        if parsed_args.workers is not None:
+            options['workers'] = parsed_args.workers
+        http_app.serve_production(**options)
     # development mode
     else:
         app.logger.setLevel(logging.DEBUG)
+        if job_queue is not None:
+            job_queue.start_workers(parsed_args.job_workers, run_job)
         http_app.run()
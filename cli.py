@@ -6,13 +6,20 @@ DO NOT CHANGE the name of the file
 """
 
 import argparse
+import csv
+import multiprocessing
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Dict, List
 
 import app
 
 import clams.app
 from clams import AppMetadata
+from mmif import Mmif, DocumentTypes
 
 
 def metadata_to_argparser(app_metadata: AppMetadata) -> argparse.ArgumentParser:
@@ -61,26 +68,155 @@ def metadata_to_argparser(app_metadata: AppMetadata) -> argparse.ArgumentParser:
                         help='output MMIF file path, or STDOUT if `-` or not provided. NOTE: When this is set to '
                              'STDOUT, any print statements in the app code will be redirected to stderr.',
                         default=sys.stdout)
+    batch = parser.add_argument_group(
+        'batch mode', 'annotate many MMIF files with a single start-up and model load, instead of IN_MMIF_FILE and '
+                      'OUT_MMIF_FILE')
+    batch.add_argument('--batch-input', metavar='PATH',
+                       help='directory of input MMIF files (`*.mmif` and `*.json`), or a manifest file that lists '
+                            'the paths of input MMIF files, one per line (relative to the manifest directory)')
+    batch.add_argument('--batch-output', metavar='DIR',
+                       help='directory to write output MMIF files to, with the same names as the input files. '
+                            'Inputs whose output file already exists are skipped')
+    batch.add_argument('--batch-workers', type=int, default=1,
+                       help='number of worker processes to annotate files in parallel, sharing the CPU cores '
+                            'evenly. The model is loaded once before the workers are forked (default: 1)')
+    batch.add_argument('--batch-summary', metavar='FILE',
+                       help='CSV file to write the status and timing of each input file to '
+                            '(default: `batch-summary.csv` in the output directory)')
     return parser
 
 
+def batch_inputs(path: Path) -> List[Path]:
+    """
+    Lists input MMIF files from a directory or a manifest file.
+    """
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.suffix in ('.mmif', '.json'))
+    lines = (line.strip() for line in path.read_text().splitlines())
+    return [path.parent / line for line in lines if line and not line.startswith('#')]
+
+
+def video_seconds(in_path: Path) -> float:
+    """
+    Returns the duration of the first video document of a MMIF file, or 0 if it can't be read.
+    """
+    from modeling import video
+    try:
+        videos = Mmif(in_path.read_text()).get_documents_by_type(DocumentTypes.VideoDocument)
+        return video.duration(videos[0].location_path(nonexist_ok=False)) if videos else 0.0
+    except Exception:
+        return 0.0
+
+
+# the app instance that annotates batch mode inputs, inherited by forked worker processes
+_batch_app = None
+
+
+def _init_batch_worker(intra_op_threads: int):
+    import torch
+    torch.set_num_threads(intra_op_threads)
+
+
+def annotate_file(in_path: Path, out_path: Path, params: Dict[str, List[str]]) -> Dict:
+    """
+    Annotates a single input file in batch mode, returns a summary row. Failures are recorded in the summary 
+    instead of being raised, and no output file is written, so that the file is retried in the next batch run.
+    """
+    t = time.perf_counter()
+    try:
+        with redirect_stdout(sys.stderr):
+            out_mmif = _batch_app.annotate(in_path.read_text(), **params)
+        # written to a temporary file first, so that a killed run doesn't leave a partial output to be skipped
+        tmp_path = out_path.with_name(f'.{out_path.name}.tmp')
+        tmp_path.write_text(out_mmif)
+        tmp_path.replace(out_path)
+        status, error = 'done', ''
+    except Exception as e:
+        status, error = 'failed', f'{e.__class__.__name__}: {e}'
+    return {'input': str(in_path), 'output': str(out_path), 'status': status,
+            'seconds': round(time.perf_counter() - t, 3), 'error': error}
+
+
+def run_batch(clamsapp, params: Dict[str, List[str]], input_path: str, output_dir: str, workers: int = 1,
+              summary_path: str = None):
+    """
+    Annotates all input files of a batch, longest videos first, so that the longest ones don't end up running 
+    alone at the end of the batch.
+    """
+    global _batch_app
+    from modeling import threads
+
+    _batch_app = clamsapp
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    summary_path = Path(summary_path) if summary_path else output_dir / 'batch-summary.csv'
+    rows = []
+    jobs = []
+    for in_path in batch_inputs(Path(input_path)):
+        out_path = output_dir / in_path.name
+        if out_path.exists() and out_path.stat().st_size > 0:
+            rows.append({'input': str(in_path), 'output': str(out_path), 'status': 'skipped'})
+        else:
+            jobs.append((video_seconds(in_path), in_path, out_path))
+    jobs.sort(key=lambda job: job[0], reverse=True)
+    print(f'{len(jobs)} files to annotate, {len(rows)} skipped with existing outputs', file=sys.stderr)
+    durations = {str(in_path): seconds for seconds, in_path, _ in jobs}
+
+    t = time.perf_counter()
+    if workers > 1:
+        # the model is loaded (and warmed up) once, single-threaded so that it can be safely forked, and shared
+        # copy-on-write by the workers
+        threads.limit_to_single_thread()
+        refined = clamsapp._refine_params(**params)
+        if refined.get('useClassifier'):
+            clamsapp.classifiers.preload(refined['tpModelName'], refined['tpUsePosModel'],
+                                         backend=refined['tpBackend'], precision=refined['tpPrecision'],
+                                         channels_last=refined['tpChannelsLast'])
+        intra_op_threads = threads.ThreadConfig('auto').plan(0, workers)['intraOpThreads']
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_init_batch_worker, initargs=(intra_op_threads,)) as pool:
+            futures = [pool.submit(annotate_file, in_path, out_path, params) for _, in_path, out_path in jobs]
+            for future in futures:
+                rows.append(future.result())
+                print(f"{rows[-1]['status']}: {rows[-1]['input']} ({rows[-1]['seconds']:.1f} s)", file=sys.stderr)
+    else:
+        for _, in_path, out_path in jobs:
+            rows.append(annotate_file(in_path, out_path, params))
+            print(f"{rows[-1]['status']}: {rows[-1]['input']} ({rows[-1]['seconds']:.1f} s)", file=sys.stderr)
+
+    with open(summary_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['input', 'output', 'status', 'videoSeconds', 'seconds', 'error'])
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({'videoSeconds': durations.get(row['input'], ''), **row})
+    failed = sum(1 for row in rows if row['status'] == 'failed')
+    print(f'Annotated {len(jobs) - failed} files in {time.perf_counter() - t:.1f} seconds, {failed} failed, '
+          f'summary written to {summary_path}', file=sys.stderr)
+    return failed
+
+
 if __name__ == "__main__":
     clamsapp = app.get_app()
     arg_parser = metadata_to_argparser(app_metadata=clamsapp.metadata)
     args = arg_parser.parse_args()
-    if args.IN_MMIF_FILE:
+    # since flask webapp interface will pass parameters as "unflattened" dict to handle multivalued parameters
+    # (https://werkzeug.palletsprojects.com/en/latest/datastructures/#werkzeug.datastructures.MultiDict.to_dict)
+    # we need to convert arg_parsers results into a similar structure, which is the dict values are wrapped in lists
+    params = {}
+    for pname, pvalue in vars(args).items():
+        if pvalue is None or pname in ['IN_MMIF_FILE', 'OUT_MMIF_FILE'] or pname.startswith('batch_'):
+            continue
+        elif isinstance(pvalue, list):
+            params[pname] = pvalue
+        else:
+            params[pname] = [pvalue]
+    if args.batch_input:
+        if not args.batch_output:
+            arg_parser.error('--batch-output is required with --batch-input')
+        sys.exit(1 if run_batch(clamsapp, params, args.batch_input, args.batch_output, args.batch_workers,
+                                args.batch_summary) else 0)
+    elif args.IN_MMIF_FILE:
         in_data = args.IN_MMIF_FILE.read()
-        # since flask webapp interface will pass parameters as "unflattened" dict to handle multivalued parameters
-        # (https://werkzeug.palletsprojects.com/en/latest/datastructures/#werkzeug.datastructures.MultiDict.to_dict)
-        # we need to convert arg_parsers results into a similar structure, which is the dict values are wrapped in lists
-        params = {}
-        for pname, pvalue in vars(args).items():
-            if pvalue is None or pname in ['IN_MMIF_FILE', 'OUT_MMIF_FILE']:
-                continue
-            elif isinstance(pvalue, list):
-                params[pname] = pvalue
-            else:
-                params[pname] = [pvalue]
         if args.OUT_MMIF_FILE.name == '<stdout>':
             with redirect_stdout(sys.stderr):
                 out_mmif = clamsapp.annotate(in_data, **params)
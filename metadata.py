@@ -11,6 +11,7 @@ from mmif import DocumentTypes, AnnotationTypes
 
 from modeling import FRAME_TYPES
 import modeling.config.bins
+from modeling.registry import model_name_of
 
 default_model_storage = Path(__file__).parent / 'modeling/models'
 
@@ -25,7 +26,7 @@ def appmetadata() -> AppMetadata:
     :return: AppMetadata object holding all necessary information.
     """
 
-    available_models = default_model_storage.glob('*.pt')
+    available_models = sorted({model_name_of(m) for m in default_model_storage.glob('*.pt')})
 
     metadata = AppMetadata(
         name="Scenes-with-text Detection",
@@ -52,11 +53,43 @@ def appmetadata() -> AppMetadata:
     metadata.add_parameter(
         name='tpModelName', type='string',
         default='convnext_small',
-        choices=list(set(m.stem.split('.')[1] for m in available_models)),
+        choices=available_models,
         description='Model name to use for classification, only applies when `useClassifier=true`.')
     metadata.add_parameter(
         name='tpUsePosModel', type='boolean', default=True,
         description='Use the model trained with positional features, only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpMultiHead', type='string', default='single', choices=['single', 'views', 'ensemble'],
+        description='Apply the classification heads of both the models with and without positional features of '
+                    'the `tpModelName` backbone to the same backbone features, running the backbone only once per '
+                    'frame. `single` applies only the head of the model chosen by `tpUsePosModel`. `views` '
+                    'generates one TimePoint view per model, with the view of the model chosen by `tpUsePosModel` '
+                    'added last (hence used for stitching). `ensemble` generates a single view with the averaged '
+                    'probabilities of both models. Only the `eager` backend can run multiple heads, '
+                    'only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpCascade', type='boolean', default=False,
+        description='Classify all sampled frames with the cheaper `tpCascadeModelName` model first, and classify '
+                    'again with the `tpModelName` model only the frames whose top label probability is below '
+                    '`tpCascadeMinConfidence` or whose label entropy is above `tpCascadeMaxEntropy`. Each TimePoint '
+                    'records the name of the model that produced its scores in its `classifiedBy` property, and the '
+                    'model files of both stages (`cascadeModels`) and the number of escalated frames are recorded '
+                    'in the view metadata. Both models must be trained with the same labels, only applies when '
+                    '`useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpCascadeModelName', type='string', default='convnext_tiny',
+        choices=available_models,
+        description='Model name of the first (cheaper) stage of the cascade, see `tpCascade`, only applies when '
+                    '`useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpCascadeMinConfidence', type='number', default=0.9,
+        description='Top label probability below which a frame is escalated to the `tpModelName` model in the '
+                    'cascade, see `tpCascade`, only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpCascadeMaxEntropy', type='number', default=0.5,
+        description='Entropy of the label probabilities (normalized to 0 - 1, where 1 is a uniform distribution) '
+                    'above which a frame is escalated to the `tpModelName` model in the cascade, see `tpCascade`, '
+                    'only applies when `useClassifier=true`.')
     metadata.add_parameter(
         name='tpStartAt', type='integer', default=0,
         description='Number of milliseconds into the video to start processing, only applies when `useClassifier=true`.')
@@ -66,6 +99,110 @@ def appmetadata() -> AppMetadata:
     metadata.add_parameter(
         name='tpSampleRate', type='integer', default=1000,
         description='Milliseconds between sampled frames, only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpAdaptiveStride', type='integer', default=0,
+        description='When larger than `tpSampleRate`, enables coarse-to-fine adaptive sampling: frames are first '
+                    'classified every this many milliseconds, then intervals where the top label changes or the '
+                    'classifier is not confident are recursively bisected down to `tpSampleRate`. TimePoints are '
+                    'still generated every `tpSampleRate` milliseconds, with probabilities of frames that are not '
+                    'classified linearly interpolated from their classified neighbors. The number of actually '
+                    'classified frames is recorded in the view metadata, only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpAdaptiveMinConfidence', type='number', default=0.5,
+        description='Minimum top label probability of a frame to be considered confident in adaptive sampling '
+                    '(see `tpAdaptiveStride`), only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpSceneStride', type='integer', default=0,
+        description='When larger than `tpSampleRate`, enables scene-change sampling: likely scene cuts are found '
+                    'from the keyframe placement and packet sizes of the video stream (without decoding), frames '
+                    'within `tpSceneWindow` milliseconds of a cut are classified every `tpSampleRate` '
+                    'milliseconds, and frames within shots every this many milliseconds. As in adaptive sampling, '
+                    'TimePoints are still generated every `tpSampleRate` milliseconds with probabilities of frames '
+                    'that are not classified linearly interpolated. When `tpAdaptiveStride` is also set, the '
+                    'frames picked this way are the starting points of the adaptive refinement. The number of '
+                    'detected cuts is recorded in the view metadata, only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpSceneWindow', type='integer', default=2000,
+        description='Distance (in milliseconds) to a detected scene cut within which frames are densely sampled '
+                    '(see `tpSceneStride`), only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpDuplicateThreshold', type='number', default=0.0,
+        description='When larger than 0, a sampled frame is considered a near-duplicate of the last classified '
+                    'frame (e.g. a static slate, color bars or a black screen) when the mean absolute difference '
+                    'of their 16x16 grayscale thumbnails (0 to 1) is below this threshold. Near-duplicate frames '
+                    'are not passed to the backbone model and reuse the results of the frame they duplicate. The '
+                    'number of skipped frames is recorded in the view metadata, only applies when '
+                    '`useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpShards', type='integer', default=1,
+        description='Number of worker processes to split the sampled frames of a video among. The frames are '
+                    'split into this many contiguous shards in time, each classified by a process with its own '
+                    'decoder and model (sharing the CPU threads of the app evenly), and the results are merged in '
+                    'order. Worker processes are kept across requests, only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpMemoryBudget', type='integer', default=0,
+        description='Memory budget (in bytes, for each worker process with `tpShards`) for the frames being '
+                    'classified at a time, i.e., the decoded and preprocessed frames held by the decoding, '
+                    'preprocessing and classification stages, and the intermediate activations of the backbone '
+                    'model. The number of frames per mini-batch is reduced from `tpBatchSize` as needed to fit the '
+                    'budget, based on the size of the (decoded) video frames. The model weights are not part of the '
+                    'budget. 0 means no budget, with mini-batches of `tpBatchSize` frames. The peak memory usage '
+                    '(RSS) during the classification is recorded in the view metadata either way, only applies when '
+                    '`useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpDecodeMode', type='string', default='auto', choices=['auto', 'seek', 'sequential'],
+        description='Strategy to decode the sampled frames from the video. `seek` seeks to each sampled frame, '
+                    'which is faster for sparse sampling. `sequential` decodes the whole video in a single pass, '
+                    'which is faster for dense sampling (e.g. when the sampling rate is shorter than the distance '
+                    'between keyframes of the video). `auto` picks one based on the sampling rate and the keyframe '
+                    'interval of the video, only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpDecodeResize', type='boolean', default=False,
+        description='Scale frames down to the input size of the backbone model while decoding, instead of '
+                    'decoding them at full resolution and resizing them afterwards. Much faster for HD videos, '
+                    'but the scaling algorithm is slightly different from the one used in training, hence the '
+                    'scores slightly differ, only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpBatchSize', type='integer', default=32,
+        description='Number of sampled frames to feed to the backbone model in a single forward pass. Larger '
+                    'values make better use of the CPU/GPU at the cost of memory, only applies when '
+                    '`useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpBackend', type='string', default='eager',
+        choices=['eager', 'torchscript', 'compile', 'onnxruntime'],
+        description='Execution backend for the classification model. `eager` runs the PyTorch modules as they '
+                    'are. `torchscript` traces the backbone, the positional encoding and the classification head '
+                    'into a single optimized graph. `compile` uses `torch.compile` (requires a C++ compiler). '
+                    '`onnxruntime` runs an ONNX export of the same graph with ONNX Runtime on CPU. '
+                    'Traced/compiled/exported models are cached on disk, so only the first use of a model pays for it, '
+                    'only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpPrecision', type='string', default='fp32',
+        choices=['fp32', 'bf16', 'int8-dynamic', 'int8-static'],
+        description='Numerical precision of the classification model. `fp32` runs the original model. '
+                    '`bf16` runs it with bfloat16 autocast, which is much faster on CPUs with native bf16 '
+                    'instructions (e.g. recent Xeons with AVX512-BF16 or AMX), and falls back to `fp32` on '
+                    'other CPUs. The precision actually used is recorded in the view metadata. '
+                    '`int8-dynamic` quantizes the weights of all linear layers to 8-bit integers when the model is '
+                    'loaded. `int8-static` additionally runs the classification head in 8-bit integers, using '
+                    'a calibration file created with `modeling/quantize.py` that must be present next to the model '
+                    'file. int8 precisions run on CPU with the `eager` backend only, and trade a small accuracy loss '
+                    'for speed, only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpChannelsLast', type='boolean', default=False,
+        description='Run the backbone model with channels-last (NHWC) memory format, which is faster for '
+                    'convolutions on modern CPUs, especially combined with `tpPrecision=bf16`. Only works with '
+                    'the `eager` backend, only applies when `useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpQueueDepth', type='integer', default=2,
+        description='Number of mini-batches (of `tpBatchSize` frames) that can wait between the frame decoding, '
+                    'image preprocessing and classification stages, which run concurrently. Larger values let '
+                    'decoding run further ahead of classification at the cost of memory, only applies when '
+                    '`useClassifier=true`.')
+    metadata.add_parameter(
+        name='tpPreprocessWorkers', type='integer', default=2,
+        description='Number of threads for the image preprocessing stage (resizing, cropping, normalization), '
+                    'only applies when `useClassifier=true`.')
     metadata.add_parameter(
         name='useStitcher', type='boolean', default=True,
         description='Use the stitcher after classifying the TimePoints.')
@@ -1,3 +1,7 @@
+import os
+import sys
+from pathlib import Path
+
 negative_label = '-'
 positive_label = '+'
 
@@ -15,3 +19,12 @@ FRAME_TYPES_WITH_SUBTYPES.remove('S')
 # move around or change as with rolling credits). These are frame names after
 # the label mapping.
 static_frames = ['bars', 'slate', 'chyron']
+
+# where compiled artifacts are cached, so that restarts don't need to re-trace/re-compile (see `modeling.classify`)
+compiled_model_storage = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'swt-detection'
+# inductor (of the `compile` backend) has no config option for the location of its on-disk cache, but reads it from 
+# the environment, where torch._dynamo writes its (temporary) default as soon as it's imported, e.g. by torchvision.
+# Hence it's set here, before any module of this package imports torch. A directory set explicitly is kept.
+inductor_cache_dir = None
+if 'torch._dynamo' not in sys.modules:
+    inductor_cache_dir = os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', str(compiled_model_storage / 'inductor'))
@@ -4,6 +4,7 @@ import sys
 from typing import Callable
 
 import torch
+import torchvision.transforms.v2.functional as F
 # ConvNext Models
 from torchvision.models import convnext_base, ConvNeXt_Base_Weights  # ConvNeXt BASE
 from torchvision.models import convnext_large, ConvNeXt_Large_Weights  # ConvNeXt LARGE
@@ -41,6 +42,24 @@ class ExtractorModel:
     preprocess: Callable
 
 
+def preprocess_batch(images: torch.Tensor, transforms: Callable) -> torch.Tensor:
+    """
+    Batched version of the ImageNet preprocessing of a backbone model (``ExtractorModel.preprocess``, the 
+    ``transforms()`` of the pretrained weights), for a uint8 batch of N x 3 x H x W frames of the same size. 
+    Applying ``preprocess`` to one image tensor at a time resizes in float, which makes it the most expensive step.
+    This function resizes the whole batch in uint8 instead (like torchvision's v2 transforms), which is several
+    times faster and differs by at most one intensity level on a small fraction of pixels. Frames that are already
+    at the resized size (see ``tpDecodeResize``) get exactly the same result as from ``preprocess``.
+    """
+    images = F.resize(images, transforms.resize_size, interpolation=transforms.interpolation,
+                      antialias=transforms.antialias)
+    images = F.center_crop(images, transforms.crop_size)
+    # the float copy is made contiguous (frames usually come in as a channels-last view of N x H x W x 3 arrays),
+    # so that it can be normalized in place
+    images = images.contiguous().to(torch.float32).div_(255)
+    return F.normalize(images, mean=transforms.mean, std=transforms.std, inplace=True)
+
+
 # ===========================================================================|
 # Models
 # TODO/REVIEW - do we want to be able to change the weight versions (IMAGENET1K_V1 etc)
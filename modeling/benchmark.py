@@ -0,0 +1,93 @@
+"""
+Benchmarks inference throughput of the classification models with different execution backends, precisions and
+memory formats, and checks that the outputs of each match the eager fp32 PyTorch outputs within a tolerance.
+Precisions other than fp32 and the channels-last memory format are benchmarked with the eager backend.
+
+Usage example:
+
+    python -m modeling.benchmark -m convnext_small -b eager torchscript compile
+    python -m modeling.benchmark -m convnext_small -b eager -p bf16 --channels-last -t 0.05
+"""
+import argparse
+import logging
+import time
+from pathlib import Path
+
+import torch
+
+from modeling import classify
+from modeling.registry import ClassifierRegistry
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format="%(asctime)s %(name)s %(levelname)-8s %(thread)d %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+default_model_storage = Path(__file__).parent / 'models'
+
+
+def benchmark(classifier: classify.Classifier, backend: str, inputs: torch.Tensor, positions, final_pos,
+              batch_size: int, rounds: int, precision: str = 'fp32', channels_last: bool = False):
+    # first call pays for tracing/compilation/quantization and warm-up, and is not included in the measurement
+    t = time.perf_counter()
+    probs = classifier.classify_images(inputs, positions, final_pos, batch_size, preprocessed=True,
+                                       backend=backend, precision=precision, channels_last=channels_last)
+    first_call = time.perf_counter() - t
+    t = time.perf_counter()
+    for _ in range(rounds):
+        classifier.classify_images(inputs, positions, final_pos, batch_size, preprocessed=True,
+                                   backend=backend, precision=precision, channels_last=channels_last)
+    elapsed = time.perf_counter() - t
+    return probs, first_call, len(inputs) * rounds / elapsed
+
+
+def main(args):
+    torch.manual_seed(args.seed)
+    registry = ClassifierRegistry(args.model_dir)
+    classifier = registry.get(args.model, not args.no_pos)
+    inputs = torch.randn(args.frames, 3, 224, 224)
+    final_pos = 3600000
+    positions = [int(i * final_pos / args.frames) for i in range(args.frames)]
+    logger.info(f'Benchmarking {classifier.model_stem.name} on {args.frames} frames, batch size {args.batch_size}, '
+                f'{torch.get_num_threads()} threads')
+    reference = None
+    modes = [(backend, 'fp32', False) for backend in ['eager'] + [b for b in args.backends if b != 'eager']]
+    modes += [('eager', precision, False) for precision in args.precisions if precision != 'fp32']
+    if args.channels_last:
+        modes += [('eager', precision, True) for precision in ['fp32'] + [p for p in args.precisions if p != 'fp32']]
+    print(f'{"backend":<12} {"precision":<13} {"memory format":<14} {"first call (s)":>15} {"frames/sec":>12} '
+          f'{"speedup":>8} {"max abs diff":>13} {"ok":>4}')
+    eager_fps = None
+    for backend, precision, channels_last in modes:
+        probs, first_call, fps = benchmark(classifier, backend, inputs, positions, final_pos,
+                                           args.batch_size, args.rounds, precision, channels_last)
+        if reference is None:
+            reference, eager_fps = probs, fps
+        diff = (probs - reference).abs().max().item()
+        memory_format = 'channels_last' if channels_last else 'contiguous'
+        print(f'{backend:<12} {classifier.resolve_precision(precision):<13} {memory_format:<14} {first_call:>15.2f} '
+              f'{fps:>12.2f} {fps / eager_fps:>8.2f} {diff:>13.2e} {"yes" if diff <= args.tolerance else "NO":>4}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-m', '--model', default='convnext_small',
+                        help='model name (backbone name, as in `tpModelName` app parameter)')
+    parser.add_argument('--no-pos', action='store_true', help='use the model without positional features')
+    parser.add_argument('-d', '--model-dir', default=default_model_storage,
+                        help='directory where the model files are stored')
+    parser.add_argument('-b', '--backends', nargs='+', default=classify.BACKENDS, choices=classify.BACKENDS,
+                        help='execution backends to compare against eager PyTorch')
+    parser.add_argument('-p', '--precisions', nargs='+', default=['fp32'], choices=classify.PRECISIONS,
+                        help='numerical precisions to compare against fp32 (with the eager backend)')
+    parser.add_argument('--channels-last', action='store_true',
+                        help='also benchmark the channels-last memory format (with the eager backend)')
+    parser.add_argument('-n', '--frames', type=int, default=64, help='number of (random) frames to classify')
+    parser.add_argument('-s', '--batch-size', type=int, default=32, help='number of frames per forward pass')
+    parser.add_argument('-r', '--rounds', type=int, default=3, help='number of measured rounds per backend')
+    parser.add_argument('-t', '--tolerance', type=float, default=1e-4,
+                        help='maximum allowed absolute difference from eager outputs (probabilities)')
+    parser.add_argument('--seed', type=int, default=42)
+    main(parser.parse_args())
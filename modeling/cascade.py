@@ -0,0 +1,24 @@
+"""
+Cascade inference: all frames are classified by a cheap model first, and only the frames the cheap model is not
+certain about are classified again by a more expensive (and more accurate) model, whose scores replace the cheap
+ones.
+"""
+import math
+
+import torch
+
+
+def uncertain(probabilities: torch.Tensor, min_confidence: float, max_entropy: float) -> torch.Tensor:
+    """
+    Picks the frames to escalate to the expensive model.
+
+    :param probabilities: label probabilities of the frames, one row per frame
+    :param min_confidence: top label probability under which a frame is not certain
+    :param max_entropy: entropy of the label probabilities, normalized by the entropy of a uniform distribution
+                        (i.e., from 0 to 1), over which a frame is not certain
+    :return: a boolean mask of the frames that are not certain
+    """
+    if probabilities.shape[0] == 0:
+        return torch.zeros(0, dtype=torch.bool)
+    entropy = -(probabilities * probabilities.clamp_min(1e-12).log()).sum(dim=1) / math.log(probabilities.shape[1])
+    return (probabilities.max(dim=1).values < min_confidence) | (entropy > max_entropy)
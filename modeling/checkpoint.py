@@ -0,0 +1,87 @@
+"""
+Incremental checkpoints of classification results, so that a run on a long video that gets killed (e.g. on a
+preemptible node) can resume where it stopped instead of starting over from the first frame.
+
+A checkpoint holds the frame numbers and label probabilities (of each model head) of the frames classified so far
+in a run, keyed by the video content and the parameters that affect the results. Each finished batch is written
+to its own ``.npz`` file in the checkpoint's directory (named after its first frame, so that several processes
+classifying different frames of the same run can share a checkpoint), atomically, so that a kill during a write 
+loses at most that batch. A checkpoint is removed once the run it belongs to is complete.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+PART_SUFFIX = '.part.npz'
+
+
+def checkpoint_key(video_hash: str, parameters: Dict) -> str:
+    """
+    :param video_hash: content hash of the video file, see :func:`modeling.feature_cache.content_hash`
+    :param parameters: the parameters that affect the classification results
+    """
+    digest = hashlib.sha256(json.dumps(parameters, sort_keys=True, default=str).encode()).hexdigest()
+    return f'{video_hash}.{digest[:16]}'
+
+
+class Checkpoint:
+
+    def __init__(self, checkpoint_dir: Union[str, Path], key: str, logger_name: str = None):
+        """
+        :param checkpoint_dir: directory of all checkpoints, created if it doesn't exist
+        :param key: key of the run, see :func:`checkpoint_key`
+        :param logger_name: the name of the logger to use, defaults to the class name
+        """
+        self.path = Path(checkpoint_dir) / key
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.logger = logging.getLogger(logger_name if logger_name else self.__class__.__name__)
+
+    def _parts(self) -> List[Path]:
+        return sorted(self.path.glob(f'*{PART_SUFFIX}'))
+
+    def load(self) -> Tuple[List[int], List[np.ndarray]]:
+        """
+        Reads all batches saved so far.
+
+        :return: the frame numbers, and an array of probabilities for each head (in the order of the frame numbers)
+        """
+        framenums = []
+        outputs = []
+        for part in self._parts():
+            try:
+                with np.load(part) as saved:
+                    framenums.extend(saved['frames'].tolist())
+                    outputs.append([saved[f'head{i}'] for i in range(len(saved.files) - 1)])
+            except (OSError, ValueError, KeyError) as e:
+                self.logger.warning(f'Ignoring unreadable checkpoint file {part.name}: {e}')
+        if not outputs:
+            return [], []
+        return framenums, [np.concatenate(head_outputs) for head_outputs in zip(*outputs)]
+
+    def save(self, framenums: List[int], outputs: List[np.ndarray]):
+        """
+        Saves a finished batch of frames.
+
+        :param framenums: frame numbers of the batch
+        :param outputs: an array of probabilities for each head, in the order of the frame numbers
+        """
+        if len(framenums) == 0:
+            return
+        part = self.path / f'{min(framenums):012d}{PART_SUFFIX}'
+        tmp_file = part.with_name(f'.{part.name}.{os.getpid()}.tmp')
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, frames=np.asarray(framenums, dtype=np.int64),
+                     **{f'head{i}': np.asarray(head_outputs) for i, head_outputs in enumerate(outputs)})
+        os.replace(tmp_file, part)
+
+    def remove(self):
+        """
+        Deletes the checkpoint, once the run is complete.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -1,27 +1,162 @@
+import copy
+import inspect
 import logging
+import os
+import threading
 import time
-from typing import List
+from pathlib import Path
+from typing import Callable, List, Union
 
+import numpy as np
 import torch
 import yaml
 from PIL import Image
 
-from modeling import train, data_loader, FRAME_TYPES
+import modeling
+from modeling import train, data_loader, FRAME_TYPES, compiled_model_storage
+
+# execution backends for the full classification network (backbone + positional encoding + head)
+# `eager` runs the modules as they are, `torchscript` traces them into a single TorchScript graph, 
+# `compile` uses `torch.compile` (needs a C++ compiler at runtime), and `onnxruntime` runs an ONNX export 
+# of the network with ONNX Runtime's CPU execution provider
+BACKENDS = ['eager', 'torchscript', 'compile', 'onnxruntime']
+
+# numerical precisions of the classification network
+# `fp32` is the original model, `bf16` runs it under bfloat16 autocast (on CPUs with native bf16 instructions, 
+# e.g. AVX512-BF16 or AMX, and on GPUs that support it, otherwise falls back to fp32), `int8-dynamic` quantizes 
+# weights of all linear layers (including the pointwise convolutions in ConvNeXt blocks) to int8 and activations 
+# on the fly, and `int8-static` additionally runs the classification head fully in int8, with activation ranges 
+# calibrated in advance by `modeling/quantize.py`
+PRECISIONS = ['fp32', 'bf16', 'int8-dynamic', 'int8-static']
+
+
+class ClassifierNet(torch.nn.Module):
+    """
+    The backbone, the positional encoding and the classification head fused into a single module that maps a 
+    batch of preprocessed images and their positional encoding lookup indices to label probabilities. Used 
+    as the unit of tracing/compilation for non-eager backends. Shares parameters with the original modules.
+    """
+
+    def __init__(self, backbone: torch.nn.Module, head: torch.nn.Module, pos_vec_lookup: torch.Tensor,
+                 pos_vec_coeff: float):
+        super().__init__()
+        self.backbone = backbone
+        self.head = head
+        self.register_buffer('pos_vecs', pos_vec_lookup * pos_vec_coeff)
+
+    def forward(self, images: torch.Tensor, pos_cols: torch.Tensor) -> torch.Tensor:
+        return self.classify_features(self.backbone(images), pos_cols)
+
+    def classify_features(self, features: torch.Tensor, pos_cols: torch.Tensor) -> torch.Tensor:
+        return torch.softmax(self.head(features + self.pos_vecs[pos_cols]), dim=1)
+
+
+def save_atomically(path: Union[str, Path], save: Callable[[str], None]):
+    """
+    Writes a file through a temporary file in the same directory, which is then renamed to ``path``, so that other 
+    processes sharing the file (e.g. in the compiled model cache) never load a partially written one.
+
+    :param save: function that writes the file to the given path
+    """
+    path = Path(path)
+    tmp_file = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        save(str(tmp_file))
+        os.replace(tmp_file, path)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+
+
+def export_onnx(net: torch.nn.Module, path: Union[str, Path], example_inputs: torch.Tensor):
+    """
+    Exports a :class:`ClassifierNet` to an ONNX file, with dynamic batch size. The file is written atomically,
+    see :func:`save_atomically`.
+
+    :param net: the network to export
+    :param path: output file path
+    :param example_inputs: an example input batch (images, or backbone features when the backbone is 
+                           replaced with an identity module)
+    """
+    example_cols = torch.zeros(example_inputs.shape[0], dtype=torch.long)
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # newer torch versions default to the dynamo-based exporter, but the TorchScript-based one handles
+        # `dynamic_axes` reliably and writes a single self-contained file
+        kwargs['dynamo'] = False
+    save_atomically(path, lambda tmp_path: torch.onnx.export(
+        net.eval(), (example_inputs, example_cols), tmp_path,
+        input_names=['images', 'pos_cols'], output_names=['probabilities'],
+        dynamic_axes={'images': {0: 'batch'}, 'pos_cols': {0: 'batch'}, 'probabilities': {0: 'batch'}},
+        opset_version=17, **kwargs))
+
+
+def bf16_supported(device: str = 'cpu') -> bool:
+    """
+    Checks whether bfloat16 computation is natively supported on the device. On CPUs without native support, 
+    bf16 is emulated and much slower than fp32.
+    """
+    if device == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def quantize_dynamic(module: torch.nn.Module) -> torch.nn.Module:
+    """
+    Returns a copy of the module with all linear layers dynamically quantized to int8.
+    """
+    from torch.ao.quantization import quantize_dynamic as ao_quantize_dynamic
+    return ao_quantize_dynamic(copy.deepcopy(module).eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def prepare_static_head(head: torch.nn.Module, example_features: torch.Tensor) -> torch.nn.Module:
+    """
+    Returns a copy of the classification head with observers inserted for static quantization. Feed calibration
+    features through the returned module and then pass it to :func:`convert_static_head`.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx
+    return prepare_fx(copy.deepcopy(head).eval(), get_default_qconfig_mapping(), (example_features,))
+
+
+def convert_static_head(prepared_head: torch.nn.Module) -> torch.nn.Module:
+    from torch.ao.quantization.quantize_fx import convert_fx
+    return convert_fx(prepared_head)
+
+
+def onnx_session(path: Union[str, Path], threads: int = None):
+    """
+    Creates an ONNX Runtime inference session on CPU, with all graph optimizations enabled.
+
+    :param path: path to the ONNX file
+    :param threads: number of intra-op threads, defaults to the number of threads torch uses
+    """
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = threads if threads else torch.get_num_threads()
+    return onnxruntime.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
 
 
 class Classifier:
 
-    def __init__(self, model_stem, logger_name=None):
+    def __init__(self, model_stem, logger_name=None, batch_size=32, img_encoder=None):
         """
         :param model_stem: the stem of the model file, 
                            e.g. "modelpath/model" for "modelpath/model.pt" and "modelpath/model.yml"
         :param logger_name: the name of the logger to use, defaults to the class name
+        :param batch_size: default number of images to featurize in a single forward pass of the backbone model
+        :param img_encoder: backbone model to share with another classifier of the same backbone, as only the
+                            classification heads are trained and the (pretrained) backbone is the same for all
         """
+        self.model_stem = Path(model_stem)
         model_config_file = f"{model_stem}.yml"
         model_checkpoint = f"{model_stem}.pt"
         model_config = yaml.safe_load(open(model_config_file))
         self.training_labels = train.get_prebinned_labelset(model_config)
-        self.featurizer = data_loader.FeatureExtractor(**model_config)
+        self.featurizer = data_loader.FeatureExtractor(**model_config, img_encoder=img_encoder)
         label_count = len(FRAME_TYPES) + 1
         if 'bins' in model_config:
             label_count = len(model_config['bins'].keys()) + 1
@@ -31,27 +166,198 @@ class Classifier:
             num_layers=model_config["num_layers"],
             dropout=model_config["dropouts"])
         self.classifier.load_state_dict(torch.load(model_checkpoint, weights_only=True))
+        # both the backbone and the head are used only for inference, and stochastic layers (dropout, 
+        # stochastic depth) must be disabled so that predictions don't depend on the batch composition
+        self.featurizer.img_encoder.model.eval()
+        self.classifier.eval()
+        self.batch_size = batch_size
+        self._runners = {}
+        self._runners_lock = threading.Lock()
         self.debug = False
         self.logger = logging.getLogger(logger_name if logger_name else self.__class__.__name__)
 
-    def classify_images(self, images: List[Image.Image], positions: List[int], final_pos: int) -> torch.Tensor:
+    def warm_up(self, batch_size: int = None, frame_size=(640, 480), backend: str = 'eager', 
+                precision: str = 'fp32', channels_last: bool = False):
+        """
+        Runs a dummy batch of blank frames through the backbone and the head, so that one-time costs 
+        (memory allocation, kernel selection, lazy initialization, tracing/compilation) are paid before 
+        real requests come in.
+
+        :param batch_size: number of dummy frames, defaults to ``self.batch_size``
+        :param frame_size: (width, height) of the dummy frames
+        :param backend: execution backend to warm up, one of ``BACKENDS``
+        :param precision: numerical precision to warm up, one of ``PRECISIONS``
+        :param channels_last: whether to warm up the channels-last memory format
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        t = time.perf_counter()
+        dummies = [Image.new('RGB', frame_size) for _ in range(batch_size)]
+        self.classify_images(dummies, list(range(batch_size)), batch_size, batch_size, 
+                             backend=backend, precision=precision, channels_last=channels_last)
+        self.logger.debug(f'Warm-up time: {time.perf_counter() - t:.2f} seconds')
+
+    def input_size(self) -> int:
+        """
+        Returns the length of the shorter side images are resized to in the backbone model's preprocessing.
+        Images can be scaled down to this size in advance (e.g. during decoding) without changing the results.
+        """
+        return self.featurizer.img_encoder.preprocess.resize_size[0]
+
+    def preprocess_images(self, images: Union[List[Image.Image], np.ndarray]) -> torch.Tensor:
+        """
+        Applies the backbone model's preprocessing to a set of images (PIL images, or uint8 frames in a 
+        N x H x W x 3 array), returns a batch tensor that can be passed to :meth:`classify_images` with
+        ``preprocessed=True``. Useful to run the preprocessing in a separate thread from the model inference.
+        """
+        return self.featurizer.preprocess_images(images)
+
+    def static_head_file(self) -> Path:
+        """
+        Path of the calibrated int8 classification head for ``int8-static`` precision (see `modeling/quantize.py`).
+        """
+        return self.model_stem.with_name(f'{self.model_stem.name}.int8-static.pt')
+
+    def load_static_head(self) -> torch.nn.Module:
+        head_file = self.static_head_file()
+        if not head_file.exists():
+            raise FileNotFoundError(f'No calibrated int8 head found at {head_file}, '
+                                    f'run `python -m modeling.quantize` to create one.')
+        example_features = torch.zeros(2, self.featurizer.feature_vector_dim())
+        head = convert_static_head(prepare_static_head(self.classifier, example_features))
+        head.load_state_dict(torch.load(head_file, weights_only=True))
+        return head
+
+    def resolve_precision(self, precision: str) -> str:
+        """
+        Returns the precision that will actually be used for the requested one, i.e. ``fp32`` for ``bf16`` when 
+        the device has no native bf16 support.
+        """
+        if precision == 'bf16' and not bf16_supported(self._device(precision)):
+            self.logger.warning('bf16 is not natively supported on this device, falling back to fp32')
+            return 'fp32'
+        return precision
+
+    @staticmethod
+    def _device(precision: str) -> str:
+        # quantized kernels are CPU-only
+        return 'cuda' if torch.cuda.is_available() and not precision.startswith('int8') else 'cpu'
+
+    def get_runner(self, backend: str, precision: str = 'fp32', 
+                   channels_last: bool = False) -> Callable[[torch.Tensor, torch.Tensor], torch.Tensor]:
+        """
+        Returns a callable that runs the full classification network (see :class:`ClassifierNet`) with the 
+        given execution backend, precision and memory format. Traced/compiled networks are built once per 
+        classifier and cached on disk in ``compiled_model_storage``, keyed by the model stem and the torch version. 
+        Precisions other than fp32 and the channels-last memory format can only be used with the eager backend.
+        """
+        key = (backend, precision, channels_last)
+        with self._runners_lock:
+            if key not in self._runners:
+                t = time.perf_counter()
+                self._runners[key] = self._build_runner(backend, precision, channels_last)
+                self.logger.debug(f'Building {backend} ({precision}, channels_last={channels_last}) runner '
+                                  f'took {time.perf_counter() - t:.2f} seconds')
+            return self._runners[key]
+
+    def _build_runner(self, backend: str, precision: str = 'fp32', channels_last: bool = False):
+        if precision not in PRECISIONS:
+            raise ValueError(f'Unknown precision: {precision}, must be one of {PRECISIONS}')
+        if backend != 'eager' and (precision != 'fp32' or channels_last):
+            raise ValueError(f'{precision} precision and channels-last memory format are only supported '
+                             f'with the eager backend')
+        backbone = self.featurizer.img_encoder.model
+        head = self.classifier
+        if precision.startswith('int8'):
+            backbone = quantize_dynamic(backbone)
+            head = quantize_dynamic(head) if precision == 'int8-dynamic' else self.load_static_head()
+        elif channels_last:
+            # keep the shared backbone in the default memory format for the other runners
+            backbone = copy.deepcopy(backbone)
+        if channels_last:
+            backbone = backbone.to(memory_format=torch.channels_last)
+        device = self._device(precision)
+        net = ClassifierNet(backbone, head,
+                            self.featurizer.pos_vec_lookup, self.featurizer.pos_vec_coeff).eval().to(device)
+        if backend == 'eager':
+            return net
+        compiled_model_storage.mkdir(parents=True, exist_ok=True)
+        if backend == 'torchscript':
+            cache_file = compiled_model_storage / f'{self.model_stem.name}.torch-{torch.__version__}.{device}.ts'
+            if cache_file.exists():
+                self.logger.info(f'Loading TorchScript model from {cache_file}')
+                return torch.jit.load(str(cache_file), map_location=device)
+            self.logger.info(f'Tracing TorchScript model to {cache_file}')
+            example_images = torch.zeros(2, 3, 224, 224, device=device)
+            example_cols = torch.zeros(2, dtype=torch.long, device=device)
+            with torch.no_grad():
+                traced = torch.jit.freeze(torch.jit.trace(net, (example_images, example_cols)))
+            save_atomically(cache_file, traced.save)
+            return traced
+        if backend == 'compile':
+            # inductor caches compiled kernels and graphs on disk by itself (its cache keys already include the 
+            # torch version), in the directory set in `modeling`
+            if modeling.inductor_cache_dir is None:
+                self.logger.warning(f"torch was imported before the modeling package, inductor caches compiled "
+                                    f"kernels in {os.environ.get('TORCHINDUCTOR_CACHE_DIR')} rather than in "
+                                    f"{compiled_model_storage / 'inductor'}")
+            from torch._inductor import config as inductor_config
+            inductor_config.fx_graph_cache = True
+            return torch.compile(net)
+        if backend == 'onnxruntime':
+            # use the file from `modeling/export_onnx.py` if there is one next to the model, otherwise export one
+            onnx_file = self.model_stem.with_name(f'{self.model_stem.name}.onnx')
+            if not onnx_file.exists():
+                onnx_file = compiled_model_storage / f'{self.model_stem.name}.torch-{torch.__version__}.onnx'
+            if not onnx_file.exists():
+                self.logger.info(f'Exporting ONNX model to {onnx_file}')
+                export_onnx(net.cpu(), onnx_file, torch.zeros(2, 3, 224, 224))
+            self.logger.info(f'Loading ONNX model from {onnx_file}')
+            session = onnx_session(onnx_file)
+
+            def run_session(images: torch.Tensor, pos_cols: torch.Tensor) -> torch.Tensor:
+                return torch.from_numpy(session.run(None, {'images': images.cpu().numpy(),
+                                                           'pos_cols': pos_cols.cpu().numpy()})[0])
+            return run_session
+        raise ValueError(f'Unknown backend: {backend}, must be one of {BACKENDS}')
+
+    def classify_images(self, images: Union[List[Image.Image], torch.Tensor], positions: List[int], final_pos: int,
+                        batch_size: int = None, preprocessed: bool = False, backend: str = 'eager',
+                        precision: str = 'fp32', channels_last: bool = False) -> torch.Tensor:
         """
         Image classification for a set of extract images (in PIL.Image format). 
         Useful with using ``mmif.utils.video_document_handler.extract_frames_as_images()``
+
+        :param images: list of images to classify, or a batch tensor from :meth:`preprocess_images`
+        :param positions: list of positions (in milliseconds) of the images in the video
+        :param final_pos: the total length of the video (in milliseconds), used for positional encoding
+        :param batch_size: number of images to feed to the backbone model in a single forward pass,
+                           defaults to ``self.batch_size``
+        :param preprocessed: whether ``images`` is already preprocessed
+        :param backend: execution backend, one of ``BACKENDS``
+        :param precision: numerical precision, one of ``PRECISIONS``
+        :param channels_last: whether to run the backbone with channels-last (NHWC) memory format, which is 
+                              faster for convolutions on modern CPUs
         """
+        if batch_size is None:
+            batch_size = self.batch_size
+        if backend != 'eager' or precision != 'fp32' or channels_last:
+            return self._classify_with_runner(images, positions, final_pos, batch_size, preprocessed,
+                                              backend, precision, channels_last)
         featurizing_time = 0
         feat_list = []
-        for pos, img in zip(positions, images):
+        for i in range(0, len(images), batch_size):
             t = time.perf_counter()
-            features = self.featurizer.get_full_feature_vectors(img, pos, final_pos)
+            features = self.featurizer.get_full_feature_matrix(
+                images[i:i + batch_size], positions[i:i + batch_size], final_pos, preprocessed)
             if self.logger.isEnabledFor(logging.DEBUG):
                 featurizing_time += time.perf_counter() - t
             feat_list.append(features)
         self.logger.debug(f'Featurizing time: {featurizing_time:.2f} seconds\n')
-        self.logger.debug(f'Instances: {len(feat_list)}, Features: {feat_list[0].shape}')
         softmax = torch.nn.Softmax(dim=1)
         t = time.perf_counter()
-        feat_mat = torch.stack(feat_list, dim=0)
+        feat_mat = torch.cat(feat_list, dim=0)
+        self.logger.debug(f'Instances: {feat_mat.shape[0]}, Features: {feat_mat.shape[1:]}')
         predictions = self.classifier(feat_mat).detach()
         self.logger.debug(f'Predictions: {predictions.shape}, first: {predictions[0]}')
         probabilities = softmax(predictions)
@@ -59,3 +365,62 @@ class Classifier:
         self.logger.debug(f'Probabilities: {probabilities.shape}, first: {probabilities[0]} (sum to {sum(probabilities[0])})')
         self.logger.debug(f'Classifier time: {time.perf_counter() - t:.2f} seconds\n')
         return probabilities
+
+    def _batches(self, images, batch_size, preprocessed, device, channels_last):
+        memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        for i in range(0, len(images), batch_size):
+            inputs = images[i:i + batch_size]
+            if not preprocessed:
+                inputs = self.preprocess_images(inputs)
+            yield i, inputs.to(device, memory_format=memory_format)
+
+    def _pos_cols(self, positions: List[int], final_pos: int) -> torch.Tensor:
+        return torch.tensor([self.featurizer.convert_position(pos, final_pos) for pos in positions], dtype=torch.long)
+
+    def _classify_with_runner(self, images, positions, final_pos, batch_size, preprocessed, backend, precision,
+                              channels_last=False):
+        precision = self.resolve_precision(precision)
+        runner = self.get_runner(backend, precision, channels_last)
+        device = self._device(precision)
+        t = time.perf_counter()
+        prob_list = []
+        for i, inputs in self._batches(images, batch_size, preprocessed, device, channels_last):
+            pos_cols = self._pos_cols(positions[i:i + batch_size], final_pos)
+            with torch.inference_mode(), torch.autocast(device, dtype=torch.bfloat16, enabled=precision == 'bf16'):
+                prob_list.append(runner(inputs, pos_cols.to(device)).float().cpu())
+        probabilities = torch.cat(prob_list, dim=0)
+        self.logger.debug(f'Probabilities: {probabilities.shape}, first: {probabilities[0]}')
+        self.logger.debug(f'Classifier ({backend}, {precision}) time: {time.perf_counter() - t:.2f} seconds\n')
+        return probabilities
+
+    def extract_features(self, images: Union[List[Image.Image], torch.Tensor], batch_size: int = None,
+                         preprocessed: bool = False, precision: str = 'fp32', 
+                         channels_last: bool = False) -> torch.Tensor:
+        """
+        Runs only the backbone model (with the eager backend) and returns the image feature vectors, which can be 
+        cached and later passed to :meth:`classify_features`. Arguments are the same as in :meth:`classify_images`.
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        precision = self.resolve_precision(precision)
+        runner = self.get_runner('eager', precision, channels_last)
+        device = self._device(precision)
+        feature_list = []
+        for _, inputs in self._batches(images, batch_size, preprocessed, device, channels_last):
+            with torch.inference_mode(), torch.autocast(device, dtype=torch.bfloat16, enabled=precision == 'bf16'):
+                feature_list.append(runner.backbone(inputs).float().cpu())
+        return torch.cat(feature_list, dim=0)
+
+    def classify_features(self, features: torch.Tensor, positions: List[int], final_pos: int, 
+                          precision: str = 'fp32', channels_last: bool = False) -> torch.Tensor:
+        """
+        Applies the positional encoding and the classification head to backbone feature vectors from 
+        :meth:`extract_features`, returns label probabilities.
+        """
+        precision = self.resolve_precision(precision)
+        runner = self.get_runner('eager', precision, channels_last)
+        device = self._device(precision)
+        with torch.inference_mode(), torch.autocast(device, dtype=torch.bfloat16, enabled=precision == 'bf16'):
+            pos_cols = self._pos_cols(positions, final_pos).to(device)
+            probabilities = runner.classify_features(features.to(device), pos_cols)
+        return probabilities.float().cpu()
@@ -77,6 +77,7 @@ class FeatureExtractor(object):
                  pos_abs_th_front: int = 3,
                  pos_abs_th_end: int = 10,
                  pos_vec_coeff: float = 0.5, 
+                 img_encoder: backbones.ExtractorModel = None,
                  **kwargs):  # to catch unexpected arguments
         """
         Initializes the FeatureExtractor object.
@@ -88,9 +89,15 @@ class FeatureExtractor(object):
         :param pos_abs_th_front: the number of "units" to perform absolute lookup at the front of the video
         :param pos_abs_th_end: the number of "units" to perform absolute lookup at the end of the video
         :param pos_vec_coeff: a value used to regularize the impact of positional encoding
+        :param img_encoder: an already constructed backbone model of ``img_enc_name`` to share, instead of 
+                            constructing a new one
         """
         if img_enc_name is None:
             raise ValueError("A image vector model must be specified")
+        elif img_encoder is not None:
+            if img_encoder.name != img_enc_name:
+                raise ValueError(f"Given image vector model ({img_encoder.name}) is not {img_enc_name}")
+            self.img_encoder = img_encoder
         else:
             self.img_encoder: backbones.ExtractorModel = backbones.model_map[img_enc_name]()
         self.pos_unit = pos_unit
@@ -119,13 +126,41 @@ class FeatureExtractor(object):
         if torch.cuda.is_available():
             img_vec = img_vec.to('cuda')
             self.img_encoder.model.to('cuda')
-        with torch.no_grad():
+        with torch.inference_mode():
             feature_vec = self.img_encoder.model(img_vec)
         if as_numpy:
             return feature_vec.cpu().numpy()
         else:
             return feature_vec.cpu()
 
+    def preprocess_images(self, raw_imgs):
+        """
+        Applies the backbone model's preprocessing to each image and stacks the results into a single batch tensor.
+        Images can be a list of PIL images or a uint8 array of N x H x W x 3 (RGB) frames. Arrays are preprocessed
+        as a whole batch, see :func:`backbones.preprocess_batch`.
+        """
+        if isinstance(raw_imgs, np.ndarray):
+            return backbones.preprocess_batch(torch.from_numpy(raw_imgs).permute(0, 3, 1, 2),
+                                              self.img_encoder.preprocess)
+        return torch.stack([self.img_encoder.preprocess(raw_img) for raw_img in raw_imgs])
+
+    def get_img_vectors(self, raw_imgs, as_numpy=True, preprocessed=False):
+        """
+        Batched version of :meth:`get_img_vector`. All images are preprocessed, stacked into a single
+        input tensor and fed to the backbone model in one forward pass. When ``preprocessed`` is set, 
+        ``raw_imgs`` is expected to be the output of :meth:`preprocess_images`.
+        """
+        img_vecs = raw_imgs if preprocessed else self.preprocess_images(raw_imgs)
+        if torch.cuda.is_available():
+            img_vecs = img_vecs.to('cuda')
+            self.img_encoder.model.to('cuda')
+        with torch.inference_mode():
+            feature_vecs = self.img_encoder.model(img_vecs)
+        if as_numpy:
+            return feature_vecs.cpu().numpy()
+        else:
+            return feature_vecs.cpu()
+
     def convert_position(self, cur, tot):
         if cur < self.pos_abs_th_front or tot - cur < self.pos_abs_th_end:
             return cur
@@ -140,6 +175,17 @@ class FeatureExtractor(object):
         pos_vec = self.pos_vec_lookup[pos_lookup_col] * self.pos_vec_coeff
         return torch.add(img_vec, pos_vec)
 
+    def encode_positions(self, cur_times, tot_time, img_vecs):
+        """
+        Batched version of :meth:`encode_position`. ``img_vecs`` is a 2D matrix with one row per 
+        time point in ``cur_times``.
+        """
+        if isinstance(img_vecs, np.ndarray):
+            img_vecs = torch.from_numpy(img_vecs)
+        pos_lookup_cols = [self.convert_position(cur_time, tot_time) for cur_time in cur_times]
+        pos_vecs = self.pos_vec_lookup[pos_lookup_cols] * self.pos_vec_coeff
+        return torch.add(img_vecs, pos_vecs)
+
     def feature_vector_dim(self):
         return self.img_encoder.dim
 
@@ -147,6 +193,10 @@ class FeatureExtractor(object):
         img_vecs = self.get_img_vector(raw_img, as_numpy=False)
         return self.encode_position(cur_time, tot_time, img_vecs)
 
+    def get_full_feature_matrix(self, raw_imgs, cur_times, tot_time, preprocessed=False):
+        img_vecs = self.get_img_vectors(raw_imgs, as_numpy=False, preprocessed=preprocessed)
+        return self.encode_positions(cur_times, tot_time, img_vecs)
+
 
 class TrainingDataPreprocessor(object):
     """
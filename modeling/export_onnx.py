@@ -0,0 +1,117 @@
+"""
+Exports classification models (backbone + positional encoding + head) to ONNX, to be used with the `onnxruntime`
+execution backend, and checks the exported graphs against the PyTorch outputs.
+
+The check is done in two parts:
+
+1. the full graph is compared with the PyTorch model on a batch of random images
+2. when a directory of pre-computed backbone features is given (the output of `modeling/data_loader.py`), the
+   positional encoding + head part of the graph is exported separately and compared on the feature vectors of
+   the fixed validation set (`modeling.config.batches.guids_for_fixed_validation_set`)
+
+Usage example:
+
+    python -m modeling.export_onnx -f path/to/vectorized
+"""
+import argparse
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from modeling import classify
+from modeling.config.batches import guids_for_fixed_validation_set
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format="%(asctime)s %(name)s %(levelname)-8s %(thread)d %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+default_model_storage = Path(__file__).parent / 'models'
+
+
+def max_abs_diff(net: classify.ClassifierNet, onnx_file: Path, inputs: torch.Tensor, pos_cols: torch.Tensor) -> float:
+    session = classify.onnx_session(onnx_file)
+    onnx_out = session.run(None, {'images': inputs.numpy(), 'pos_cols': pos_cols.numpy()})[0]
+    with torch.no_grad():
+        torch_out = net(inputs, pos_cols).numpy()
+    return float(np.abs(onnx_out - torch_out).max())
+
+
+def load_validation_features(features_dir: Path, classifier: classify.Classifier):
+    """
+    Loads pre-computed backbone features of the validation set, and their positional encoding lookup indices.
+    """
+    backbone_name = classifier.featurizer.img_encoder.name
+    vectors = []
+    pos_cols = []
+    for guid in guids_for_fixed_validation_set:
+        vec_file = features_dir / f'{guid}.{backbone_name}.npy'
+        if not vec_file.exists():
+            continue
+        labels = json.load(open(features_dir / f'{guid}.json'))
+        vectors.append(np.load(vec_file))
+        pos_cols.extend(classifier.featurizer.convert_position(frame['curr_time'], labels['duration'])
+                        for frame in labels['frames'])
+    if not vectors:
+        return None, None
+    return torch.from_numpy(np.vstack(vectors)).float(), torch.tensor(pos_cols, dtype=torch.long)
+
+
+def export_and_check(model_stem: Path, outdir: Path, features_dir: Path = None, tolerance: float = 1e-4) -> bool:
+    classifier = classify.Classifier(model_stem)
+    featurizer = classifier.featurizer
+    net = classify.ClassifierNet(featurizer.img_encoder.model, classifier.classifier,
+                                 featurizer.pos_vec_lookup, featurizer.pos_vec_coeff).eval()
+    onnx_file = outdir / f'{model_stem.name}.onnx'
+    classify.export_onnx(net, onnx_file, torch.zeros(2, 3, 224, 224))
+    logger.info(f'Exported {onnx_file}')
+
+    ok = True
+    images = torch.randn(8, 3, 224, 224)
+    cols = torch.randint(0, featurizer.pos_vec_lookup.shape[0], (8,))
+    diff = max_abs_diff(net, onnx_file, images, cols)
+    logger.info(f'{model_stem.name}: full graph max abs diff on random images: {diff:.2e}')
+    ok &= diff <= tolerance
+
+    if features_dir is not None:
+        features, cols = load_validation_features(features_dir, classifier)
+        if features is None:
+            logger.warning(f'No validation features for {featurizer.img_encoder.name} found in {features_dir}')
+        else:
+            # same network with the backbone removed, to take the pre-computed features as input
+            head_net = classify.ClassifierNet(torch.nn.Identity(), classifier.classifier,
+                                              featurizer.pos_vec_lookup, featurizer.pos_vec_coeff).eval()
+            head_file = outdir / f'{model_stem.name}.head.onnx'
+            classify.export_onnx(head_net, head_file, features[:2])
+            diff = max_abs_diff(head_net, head_file, features, cols)
+            head_file.unlink()
+            logger.info(f'{model_stem.name}: head max abs diff on {len(features)} validation vectors: {diff:.2e}')
+            ok &= diff <= tolerance
+    if not ok:
+        logger.error(f'{model_stem.name}: ONNX outputs differ from PyTorch outputs by more than {tolerance}')
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-d', '--model-dir', type=Path, default=default_model_storage,
+                        help='directory where the model files (.pt + .yml) are stored')
+    parser.add_argument('-o', '--outdir', type=Path, default=None,
+                        help='directory to save the ONNX files, defaults to the model directory, where the '
+                             '`onnxruntime` backend of the app looks for them')
+    parser.add_argument('-f', '--features-dir', type=Path, default=None,
+                        help='directory with pre-computed backbone features and labels of the validation set')
+    parser.add_argument('-t', '--tolerance', type=float, default=1e-4,
+                        help='maximum allowed absolute difference from PyTorch outputs (probabilities)')
+    args = parser.parse_args()
+    outdir = args.outdir if args.outdir is not None else args.model_dir
+    outdir.mkdir(parents=True, exist_ok=True)
+    results = [export_and_check(pt.with_suffix(''), outdir, args.features_dir, args.tolerance)
+               for pt in sorted(args.model_dir.glob('*.pt')) if not pt.name.endswith('.int8-static.pt')]
+    if not all(results):
+        raise SystemExit(1)
@@ -0,0 +1,168 @@
+"""
+Persistent, content-addressed cache of backbone feature vectors.
+
+Backbone features of a frame depend only on the frame (i.e., the video content and the frame number) and on how
+the backbone is run (backbone name, precision and the frame size given to the backbone), but not on the
+classification head, the positional encoding or the stitcher. Hence re-running a video with a different head or
+different stitching parameters can skip decoding and featurizing the frames it has already seen.
+
+Each cache entry holds the features of one video for one way of running the backbone, in a single ``.npy`` file
+of (frame number, feature vector) records sorted by frame number, which is memory-mapped on reads. Files are
+replaced atomically, and writers of the same entry hold a lock on a ``<key>.lock`` file next to it while they
+merge their records into it, so that several processes (e.g. gunicorn workers, or the shard workers of a video)
+can share a cache directory. When the total size of the entries exceeds the cap, least recently used entries are
+deleted first.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+ENTRY_SUFFIX = '.features.npy'
+
+_content_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def content_hash(path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    """
+    Computes the SHA-256 hex digest of a file. Digests are memoized for the lifetime of the process, keyed by
+    the path, size and modification time of the file.
+    """
+    stat = os.stat(path)
+    memo_key = (str(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _content_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        _content_hashes[memo_key] = digest.hexdigest()
+    return _content_hashes[memo_key]
+
+
+class FeatureCache:
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int = None, logger_name: str = None):
+        """
+        :param cache_dir: directory to store the cache entries in, created if it doesn't exist
+        :param max_bytes: maximum total size (in bytes) of the cache entries, no limit if None
+        :param logger_name: the name of the logger to use, defaults to the class name
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(logger_name if logger_name else self.__class__.__name__)
+
+    @staticmethod
+    def key(video_hash: str, variant: str) -> str:
+        """
+        :param video_hash: content hash of the video file, see :func:`content_hash`
+        :param variant: how the backbone is run, e.g. ``convnext_small.fp32.resized``
+        """
+        return f'{video_hash}.{variant}'
+
+    def _entry_file(self, key: str) -> Path:
+        return self.cache_dir / f'{key}{ENTRY_SUFFIX}'
+
+    def _load(self, key: str):
+        try:
+            return np.load(self._entry_file(key), mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def get(self, key: str, framenums: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Looks up features of the given frames.
+
+        :return: a boolean mask of the frames found in the cache, and the features of the found frames (in the
+                 order of ``framenums``)
+        """
+        framenums = np.asarray(framenums, dtype=np.int64)
+        entry = self._load(key)
+        found = np.zeros(len(framenums), dtype=bool)
+        features = None
+        if entry is not None and len(entry) > 0:
+            cached_frames = np.asarray(entry['frame'])
+            idx = np.minimum(np.searchsorted(cached_frames, framenums), len(cached_frames) - 1)
+            found = cached_frames[idx] == framenums
+            features = np.asarray(entry['vector'][idx[found]], dtype=np.float32)
+            # mark as recently used, for the eviction
+            os.utime(self._entry_file(key))
+        if features is None:
+            features = np.zeros((0, 0), dtype=np.float32)
+        with self._lock:
+            self.hits += int(found.sum())
+            self.misses += int(len(framenums) - found.sum())
+        return found, features
+
+    def put(self, key: str, framenums: List[int], features: np.ndarray):
+        """
+        Adds features of the given frames to the cache entry, replacing the entry file. Blocks while another 
+        thread or process is writing the same entry.
+        """
+        if len(framenums) == 0:
+            return
+        features = np.asarray(features, dtype=np.float32)
+        records = np.empty(len(framenums), dtype=[('frame', np.int64), ('vector', np.float32, features.shape[1:])])
+        records['frame'] = framenums
+        records['vector'] = features
+        entry_file = self._entry_file(key)
+        # the records of the entry are read and replaced under the lock, so that concurrent writers don't drop 
+        # each other's records
+        with open(self.cache_dir / f'{key}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entry = self._load(key)
+            if entry is not None and entry.dtype == records.dtype:
+                records = np.concatenate([np.asarray(entry), records])
+            # keep one record per frame, the newest one
+            _, last = np.unique(records['frame'][::-1], return_index=True)
+            records = records[len(records) - 1 - last]
+            tmp_file = entry_file.with_name(f'.{entry_file.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+            with open(tmp_file, 'wb') as f:
+                np.save(f, records)
+            os.replace(tmp_file, entry_file)
+        self._evict(keep=entry_file)
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        entries = []
+        for entry_file in self.cache_dir.glob(f'*{ENTRY_SUFFIX}'):
+            try:
+                stat = entry_file.stat()
+            except FileNotFoundError:  # deleted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_file))
+        return sorted(entries)
+
+    def _evict(self, keep: Path = None):
+        if self.max_bytes is None:
+            return
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_file in entries:
+            if total <= self.max_bytes:
+                break
+            if entry_file == keep:
+                continue
+            entry_file.unlink(missing_ok=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+            self.logger.info(f'Evicted {entry_file.name} from the feature cache')
+
+    def cached_bytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+        entries = self._entries()
+        stats.update(entries=len(entries), cachedBytes=sum(size for _, size, _ in entries))
+        return stats
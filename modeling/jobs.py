@@ -0,0 +1,226 @@
+"""
+A file-based queue of asynchronous annotation jobs, so that a long video doesn't tie up an HTTP connection (and a
+web server worker) for the whole run: a client submits a MMIF with parameters, gets a job id back, and polls for
+the status, progress and result of the job.
+
+All state lives in a directory, so that several server processes (e.g. gunicorn workers) can share a queue::
+
+    jobs_dir/
+        queue/<job id>          marker of a queued job
+        running/<job id>        marker of a running job, holding the host and pid of the process running it
+        <job id>/input.mmif     submitted MMIF
+        <job id>/params.json    submitted parameters
+        <job id>/status.json    status, progress and timestamps
+        <job id>/output.mmif    result, once the job is finished
+
+Job ids sort by submission time, and jobs are run first come, first served. A worker claims a job by renaming its
+marker from ``queue/`` to ``running/``, which only one process can do. Jobs left running by a process that no
+longer exists (e.g. a killed server) are queued again when workers start.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+STATUSES = ['queued', 'running', 'done', 'failed']
+
+# the job run by the current worker thread, see `report_progress`
+_current = threading.local()
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobError(Exception):
+    """
+    Raised by a job handler when a job fails, with the output to keep as the result of the failed job (e.g. a
+    MMIF with an error view).
+    """
+
+    def __init__(self, message: str, output: str = None):
+        super().__init__(message)
+        self.output = output
+
+
+def report_progress(progress: float):
+    """
+    Reports the progress (from 0 to 1) of the job run by the current thread, does nothing outside of job workers.
+    """
+    job = getattr(_current, 'job', None)
+    if job is None:
+        return
+    job_queue, job_id = job
+    # status files are only rewritten for visible changes
+    if progress >= 1 or progress - getattr(_current, 'reported', 0) >= 0.01:
+        _current.reported = progress
+        job_queue._update(job_id, progress=round(min(progress, 1.0), 4))
+
+
+def _write_atomically(path: Path, text: str):
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+
+    def __init__(self, jobs_dir: Union[str, Path], max_queued: int = 100, logger_name: str = None):
+        """
+        :param jobs_dir: directory to keep the jobs in, created if it doesn't exist
+        :param max_queued: maximum number of jobs waiting to run, submissions are rejected beyond that
+        :param logger_name: the name of the logger to use, defaults to the class name
+        """
+        self.jobs_dir = Path(jobs_dir)
+        self.queue_dir = self.jobs_dir / 'queue'
+        self.running_dir = self.jobs_dir / 'running'
+        self.queue_dir.mkdir(parents=True, exist_ok=True)
+        self.running_dir.mkdir(parents=True, exist_ok=True)
+        self.max_queued = max_queued
+        self.logger = logging.getLogger(logger_name if logger_name else self.__class__.__name__)
+
+    def _job_dir(self, job_id: str) -> Path:
+        # job ids are only ever generated here, anything else (e.g. a path from a URL) is not a job
+        if not job_id.isalnum():
+            raise KeyError(job_id)
+        return self.jobs_dir / job_id
+
+    def _update(self, job_id: str, **fields):
+        status_file = self._job_dir(job_id) / 'status.json'
+        status = json.loads(status_file.read_text()) if status_file.exists() else {}
+        status.update(fields)
+        _write_atomically(status_file, json.dumps(status))
+
+    def queued(self) -> List[str]:
+        return sorted(p.name for p in self.queue_dir.iterdir() if not p.name.startswith('.'))
+
+    def submit(self, mmif: str, parameters: Dict[str, List[str]]) -> str:
+        """
+        Adds a job to the queue.
+
+        :return: the id of the job
+        :raises QueueFull: when ``max_queued`` jobs are already waiting
+        """
+        if len(self.queued()) >= self.max_queued:
+            raise QueueFull(f'{self.max_queued} jobs are already queued')
+        job_id = f'{time.time_ns():016x}{uuid.uuid4().hex[:8]}'
+        job_dir = self._job_dir(job_id)
+        job_dir.mkdir()
+        (job_dir / 'input.mmif').write_text(mmif)
+        (job_dir / 'params.json').write_text(json.dumps(parameters))
+        self._update(job_id, jobId=job_id, status='queued', progress=0.0, submitted=time.time())
+        # the marker is created last, so that a worker never claims a job that is not completely written
+        (self.queue_dir / job_id).touch()
+        return job_id
+
+    def status(self, job_id: str) -> Dict:
+        """
+        :raises KeyError: for an unknown job
+        """
+        status_file = self._job_dir(job_id) / 'status.json'
+        if not status_file.exists():
+            raise KeyError(job_id)
+        status = json.loads(status_file.read_text())
+        if status['status'] == 'queued':
+            queued = self.queued()
+            status['position'] = queued.index(job_id) + 1 if job_id in queued else 0
+        return status
+
+    def result(self, job_id: str) -> Optional[str]:
+        """
+        :return: the output of a finished job, None if the job is not finished or has no output
+        """
+        output_file = self._job_dir(job_id) / 'output.mmif'
+        return output_file.read_text() if output_file.exists() else None
+
+    def claim(self) -> Optional[str]:
+        """
+        Takes the oldest queued job, returns its id, or None if there are no queued jobs.
+        """
+        for job_id in self.queued():
+            try:
+                os.rename(self.queue_dir / job_id, self.running_dir / job_id)
+            except FileNotFoundError:  # claimed by another worker
+                continue
+            (self.running_dir / job_id).write_text(f'{socket.gethostname()} {os.getpid()}')
+            return job_id
+        return None
+
+    def requeue_orphans(self):
+        """
+        Queues again the jobs left running by processes of this host that no longer exist.
+        """
+        for marker in self.running_dir.iterdir():
+            try:
+                host, pid = marker.read_text().split()
+            except (FileNotFoundError, ValueError):  # finished meanwhile, or just claimed
+                continue
+            if host == socket.gethostname() and not _process_exists(int(pid)):
+                self.logger.info(f'Re-queueing job {marker.name} of process {pid}, which no longer exists')
+                self._update(marker.name, status='queued')
+                os.replace(marker, self.queue_dir / marker.name)
+
+    def run_next(self, handler: Callable[[str, Dict[str, List[str]]], str]) -> bool:
+        """
+        Claims and runs the oldest queued job.
+
+        :param handler: function that annotates the input MMIF with the parameters, returns the output MMIF, and
+                        raises `JobError` (or any other exception) when the job fails
+        :return: whether a job was run
+        """
+        job_id = self.claim()
+        if job_id is None:
+            return False
+        job_dir = self._job_dir(job_id)
+        self._update(job_id, status='running', started=time.time())
+        self.logger.info(f'Running job {job_id}')
+        _current.job, _current.reported = (self, job_id), 0
+        output, fields = None, {}
+        try:
+            output = handler((job_dir / 'input.mmif').read_text(), json.loads((job_dir / 'params.json').read_text()))
+            fields = {'status': 'done', 'progress': 1.0}
+        except JobError as e:
+            output, fields = e.output, {'status': 'failed', 'error': str(e)}
+        except Exception as e:
+            self.logger.exception(f'Job {job_id} failed')
+            fields = {'status': 'failed', 'error': f'{e.__class__.__name__}: {e}'}
+        finally:
+            _current.job = None
+        if output is not None:
+            _write_atomically(job_dir / 'output.mmif', output)
+        self._update(job_id, finished=time.time(), **fields)
+        (self.running_dir / job_id).unlink(missing_ok=True)
+        self.logger.info(f"Job {job_id} {fields['status']}")
+        return True
+
+    def start_workers(self, workers: int, handler: Callable[[str, Dict[str, List[str]]], str],
+                      poll_interval: float = 1.0) -> List[threading.Thread]:
+        """
+        Starts daemon threads that run queued jobs, polling the queue when it is empty.
+        """
+        self.requeue_orphans()
+
+        def work():
+            while True:
+                if not self.run_next(handler):
+                    time.sleep(poll_interval)
+
+        threads = [threading.Thread(target=work, name=f'job-worker-{i}', daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        return threads
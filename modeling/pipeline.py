@@ -0,0 +1,182 @@
+"""
+A small streaming pipeline of bounded-queue stages to overlap frame decoding, image preprocessing and model
+inference.
+
+The pipeline has three stages:
+
+1. a decoder thread that pulls items (e.g. mini-batches of decoded frames) from a source iterator,
+2. a preprocessing thread pool that transforms each item (e.g. PIL images to an input tensor), and
+3. a consumer that runs on the calling thread (e.g. model inference).
+
+Stages are connected with bounded queues, so the decoder can run at most ``queue_depth`` items ahead of the
+consumer, keeping the memory usage bounded while the stages keep different CPU cores busy at the same time.
+Items are consumed in the order they are produced by the source.
+
+Batch buffers can be recycled through a :class:`BufferPool`: the source fills a buffer taken from the pool, and the
+preprocessing stage returns it to the pool once it is done with it, so that decoding doesn't allocate a new batch
+array for every item.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List
+
+_END = object()
+
+
+class StageStats:
+    """
+    Accumulates busy time and number of processed items of a pipeline stage.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.busy_time = 0.0
+        self.items = 0
+        self._lock = threading.Lock()
+
+    def add(self, elapsed: float):
+        with self._lock:
+            self.busy_time += elapsed
+            self.items += 1
+
+    def utilisation(self, wall_time: float, workers: int = 1) -> float:
+        """
+        Fraction of the wall time the stage (with ``workers`` parallel workers) spent on actual work.
+        """
+        if wall_time <= 0:
+            return 0.0
+        return self.busy_time / (wall_time * workers)
+
+
+class BufferPool:
+    """
+    A free list of reusable buffers (e.g. preallocated batch arrays). Buffers are created on demand when none are 
+    free, instead of waiting for one to be released, hence taking a buffer never blocks a pipeline stage. As the 
+    pipeline queues bound the number of items in flight, the pool stops growing after the first few items.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        """
+        :param factory: function that creates a new buffer
+        """
+        self.factory = factory
+        self.created = 0
+        self._free: List[Any] = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.created += 1
+        return self.factory()
+
+    def release(self, buffer):
+        with self._lock:
+            self._free.append(buffer)
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+def _put(q: queue.Queue, item, stop: threading.Event):
+    # blocking put that gives up when the pipeline is being torn down
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def run(source: Iterable, preprocess: Callable[[Any], Any], consume: Callable[[Any], None],
+        queue_depth: int = 2, preprocess_workers: int = 2) -> Dict[str, Any]:
+    """
+    Runs the pipeline until the source is exhausted.
+
+    :param source: an iterable of items, iterated on a dedicated decoder thread
+    :param preprocess: function applied to each item in the preprocessing pool
+    :param consume: function applied to each preprocessed item, in source order, on the calling thread
+    :param queue_depth: maximum number of items waiting between two consecutive stages
+    :param preprocess_workers: number of threads in the preprocessing pool
+    :return: timing stats with per-stage busy time (seconds), item counts and utilisation (0-1) and the
+             total wall time of the pipeline
+    """
+    queue_depth = max(1, queue_depth)
+    decoded = queue.Queue(maxsize=queue_depth)
+    # holds futures of the preprocessing pool, in source order
+    preprocessed = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+    stats = {name: StageStats(name) for name in ('decode', 'preprocess', 'inference')}
+
+    def decode_worker():
+        iterator = iter(source)
+        try:
+            while not stop.is_set():
+                t = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                stats['decode'].add(time.perf_counter() - t)
+                if not _put(decoded, item, stop):
+                    return
+        except BaseException as e:
+            _put(decoded, _Failure(e), stop)
+            return
+        _put(decoded, _END, stop)
+
+    def timed_preprocess(item):
+        t = time.perf_counter()
+        result = preprocess(item)
+        stats['preprocess'].add(time.perf_counter() - t)
+        return result
+
+    def dispatch_worker(pool: ThreadPoolExecutor):
+        while not stop.is_set():
+            try:
+                item = decoded.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _END or isinstance(item, _Failure):
+                _put(preprocessed, item, stop)
+                return
+            if not _put(preprocessed, pool.submit(timed_preprocess, item), stop):
+                return
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, preprocess_workers)) as pool:
+        threads = [threading.Thread(target=decode_worker, name='pipeline-decoder', daemon=True),
+                   threading.Thread(target=dispatch_worker, args=(pool,), name='pipeline-dispatcher', daemon=True)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                future = preprocessed.get()
+                if future is _END:
+                    break
+                if isinstance(future, _Failure):
+                    raise future.exc
+                item = future.result()
+                t = time.perf_counter()
+                consume(item)
+                stats['inference'].add(time.perf_counter() - t)
+                # consumed items are released right away, rather than when the next item is ready
+                future = item = None
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+    wall_time = time.perf_counter() - wall_start
+
+    workers = {'decode': 1, 'preprocess': max(1, preprocess_workers), 'inference': 1}
+    report = {'wallTime': wall_time}
+    for name, stage in stats.items():
+        report[name] = {'busyTime': stage.busy_time, 'items': stage.items,
+                        'utilisation': stage.utilisation(wall_time, workers[name])}
+    return report
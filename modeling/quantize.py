@@ -0,0 +1,125 @@
+"""
+Post-training quantization of classification models, for the `int8-dynamic` and `int8-static` precisions of the app
+(`tpPrecision` parameter), and a report of the accuracy and throughput differences from the original fp32 models.
+
+* `int8-dynamic` needs no preparation: weights of all linear layers of the backbone and the head are quantized
+  when the model is loaded, and activations are quantized on the fly.
+* `int8-static` runs the classification head fully in int8, using activation ranges calibrated in advance on
+  pre-computed feature vectors (the output of `modeling/data_loader.py`). This script calibrates the head and saves
+  it next to the model file as `<model_stem>.int8-static.pt`. The backbone is quantized dynamically as above, since
+  the normalization and activation layers of the ConvNeXt blocks have no static int8 kernels.
+
+Accuracy is compared on the fixed validation set (`modeling.config.batches.guids_for_fixed_validation_set`), using
+the same pre-computed features, hence it measures the effect of quantizing the head. Per-label results are exported
+with `modeling.validate.export_validation_results`. Throughput is measured for the full network on random images.
+
+Usage example:
+
+    python -m modeling.quantize -f path/to/vectorized
+"""
+import argparse
+import logging
+from pathlib import Path
+
+import torch
+import yaml
+
+from modeling import classify, train
+from modeling.benchmark import benchmark
+from modeling.config.batches import guids_for_fixed_validation_set
+from modeling.validate import export_validation_results
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format="%(asctime)s %(name)s %(levelname)-8s %(thread)d %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+default_model_storage = Path(__file__).parent / 'models'
+
+
+def load_datasets(features_dir: Path, model_config: dict):
+    """
+    Loads calibration and validation feature vectors (positional encoding applied) from the pre-computed features.
+    Videos not in the validation set are used for calibration, and when there are none, the validation set is used.
+    """
+    guids = train.get_guids(features_dir)
+    validation_guids = [guid for guid in guids if guid in guids_for_fixed_validation_set]
+    calibration_guids = [guid for guid in guids if guid not in guids_for_fixed_validation_set]
+    if not calibration_guids:
+        logger.warning('No videos outside the validation set found, calibrating on the validation set')
+        calibration_guids = validation_guids
+    return train.prepare_datasets(features_dir, calibration_guids, validation_guids, model_config)
+
+
+def calibrate_static_head(classifier: classify.Classifier, calibration: train.SWTDataset, batch_size: int = 256):
+    features = torch.stack(calibration.vectors)
+    prepared = classify.prepare_static_head(classifier.classifier, features[:2])
+    with torch.no_grad():
+        for i in range(0, len(features), batch_size):
+            prepared(features[i:i + batch_size])
+    return classify.convert_static_head(prepared)
+
+
+def evaluate(head: torch.nn.Module, validation: train.SWTDataset, labelset, export_fname: Path) -> float:
+    features = torch.stack(validation.vectors)
+    golds = torch.tensor(validation.labels)
+    with torch.no_grad():
+        preds = torch.argmax(head(features), dim=1)
+    with open(export_fname, 'w', encoding='utf8') as out:
+        export_validation_results(out=out, preds=preds, golds=golds, labelset=labelset,
+                                  img_enc_name=validation.img_enc_name)
+    return (preds == golds).float().mean().item()
+
+
+def quantize_and_report(model_stem: Path, features_dir: Path, outdir: Path, frames: int, batch_size: int, rounds: int):
+    classifier = classify.Classifier(model_stem)
+    model_config = yaml.safe_load(open(f'{model_stem}.yml'))
+    calibration, validation = load_datasets(features_dir, model_config)
+    if not calibration.has_data():
+        logger.error(f'No features for {classifier.featurizer.img_encoder.name} found in {features_dir}')
+        return
+    static_head = calibrate_static_head(classifier, calibration)
+    torch.save(static_head.state_dict(), classifier.static_head_file())
+    logger.info(f'Calibrated on {len(calibration)} vectors, saved {classifier.static_head_file()}')
+
+    print(f'{model_stem.name}')
+    print(f'{"precision":<14} {"accuracy":>9} {"delta":>8} {"frames/sec":>11} {"speedup":>8}')
+    heads = {'fp32': classifier.classifier,
+             'int8-dynamic': classify.quantize_dynamic(classifier.classifier),
+             'int8-static': static_head}
+    inputs = torch.randn(frames, 3, 224, 224)
+    final_pos = 3600000
+    positions = [int(i * final_pos / frames) for i in range(frames)]
+    fp32_acc = fp32_fps = None
+    for precision in heads:
+        if validation.has_data():
+            acc = evaluate(heads[precision], validation, classifier.training_labels,
+                           outdir / f'{model_stem.name}.{precision}.csv')
+        else:
+            acc = float('nan')
+        _, _, fps = benchmark(classifier, 'eager', inputs, positions, final_pos, batch_size, rounds, precision)
+        if fp32_acc is None:
+            fp32_acc, fp32_fps = acc, fps
+        print(f'{precision:<14} {acc:>9.4f} {acc - fp32_acc:>+8.4f} {fps:>11.2f} {fps / fp32_fps:>8.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-d', '--model-dir', type=Path, default=default_model_storage,
+                        help='directory where the model files (.pt + .yml) are stored')
+    parser.add_argument('-f', '--features-dir', type=Path, required=True,
+                        help='directory with pre-computed backbone features and labels')
+    parser.add_argument('-o', '--outdir', type=Path, default=Path('quantization-results'),
+                        help='directory to export per-label validation results')
+    parser.add_argument('-n', '--frames', type=int, default=64, help='number of (random) frames to benchmark')
+    parser.add_argument('-s', '--batch-size', type=int, default=32, help='number of frames per forward pass')
+    parser.add_argument('-r', '--rounds', type=int, default=3, help='number of measured rounds per precision')
+    args = parser.parse_args()
+    args.outdir.mkdir(parents=True, exist_ok=True)
+    for pt in sorted(args.model_dir.glob('*.pt')):
+        if pt.name.endswith('.int8-static.pt'):
+            continue
+        quantize_and_report(pt.with_suffix(''), args.features_dir, args.outdir,
+                            args.frames, args.batch_size, args.rounds)
@@ -0,0 +1,154 @@
+"""
+Process-wide registry of constructed :class:`~modeling.classify.Classifier` instances.
+
+Constructing a classifier involves parsing the model config, building the torchvision backbone and loading the
+checkpoint, which takes seconds. The registry keeps recently used classifiers in memory so that consecutive
+requests for the same model (e.g. a stream of short videos sent to a long-running HTTP server) don't pay the
+construction cost every time. Least recently used classifiers are evicted when the number of cached models or
+their total memory footprint exceeds the configured caps. Classifiers of the same backbone (e.g. the models with
+and without positional features) share a single backbone model.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Tuple, Union
+
+# suffix of the model names of students trained by knowledge distillation (``train.py --teacher``), so that a 
+# student is requested separately from the model of the same backbone trained on the gold labels only
+DISTILLED_SUFFIX = '-distilled'
+
+
+def model_name_of(model_file: Path) -> str:
+    """
+    Returns the model name (as in the ``tpModelName`` parameter) of a model file, i.e. the backbone name, with 
+    ``DISTILLED_SUFFIX`` appended for distilled students, whose file names have a ``distilled`` part.
+    """
+    parts = model_file.name.split('.')
+    return parts[1] + (DISTILLED_SUFFIX if 'distilled' in parts[2:] else '')
+
+
+class ClassifierRegistry:
+
+    def __init__(self, model_storage: Union[str, Path], max_models: int = 2, max_bytes: int = None,
+                 logger_name: str = None):
+        """
+        :param model_storage: directory where the model files (``.pt`` + ``.yml`` pairs) are stored
+        :param max_models: maximum number of classifiers to keep in memory, 0 disables caching
+        :param max_bytes: maximum total size (in bytes) of model weights to keep in memory, no limit if None
+        :param logger_name: the name of the logger to use, defaults to the class name
+        """
+        self.model_storage = Path(model_storage)
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._cache: OrderedDict = OrderedDict()  # key -> classifier
+        self._warm = set()
+        self._lock = threading.RLock()
+        self.logger = logging.getLogger(logger_name if logger_name else self.__class__.__name__)
+
+    def find_model_stem(self, model_name: str, use_pos_model: bool) -> Path:
+        # in the following, there should always be only one candidate, otherwise we have a problem
+        ## naming convention from train.py + gridsearch.py = {timestamp}.{backbonename}.{prebinname}.pos{T/F}.pt
+        ## (distilled students have a `distilled` part before `pos{T/F}`)
+        ## right now, `prebinname` is fixed to `nomap` as we don't use prebinning
+        candidates = sorted(model_file for model_file in
+                            self.model_storage.glob(f"*.*.pos{'T' if use_pos_model else 'F'}.pt")
+                            if model_name_of(model_file) == model_name)
+        # if there are more, the file names start with the training timestamp, so the latest model is used
+        model_file = candidates[-1] if candidates else None
+        if model_file is None:
+            raise ValueError(f"No model file found for {model_name} (positional model: {use_pos_model}) "
+                             f"in {self.model_storage}")
+        return self.model_storage / model_file.stem
+
+    @staticmethod
+    def memory_footprint(*classifiers) -> int:
+        """
+        Estimates the memory used by classifiers as the total size of the parameters and buffers of their
+        backbones and classification heads. Shared backbones are counted once.
+        """
+        size = 0
+        seen = set()
+        for classifier in classifiers:
+            for module in (classifier.featurizer.img_encoder.model, classifier.classifier):
+                for tensor in list(module.parameters()) + list(module.buffers()):
+                    if id(tensor) not in seen:
+                        seen.add(id(tensor))
+                        size += tensor.numel() * tensor.element_size()
+        return size
+
+    def get(self, model_name: str, use_pos_model: bool, logger_name: str = None):
+        """
+        Returns a classifier for the given model name and positional encoding flag (as in ``tpModelName`` and
+        ``tpUsePosModel`` parameters), constructing it if it's not in the registry yet.
+        """
+        key = (model_name, use_pos_model)
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            self.misses += 1
+            # isolate this import so that the registry can be created without importing torch
+            from modeling import classify
+            model_stem = self.find_model_stem(model_name, use_pos_model)
+            self.logger.info(f"Initiating classifier with {model_stem.name}")
+            # the other model of the same backbone, if cached, provides the backbone
+            sibling = self._cache.get((model_name, not use_pos_model))
+            classifier = classify.Classifier(model_stem, logger_name,
+                                             img_encoder=sibling.featurizer.img_encoder if sibling else None)
+            self._cache[key] = classifier
+            self._evict()
+            return classifier
+
+    def preload(self, model_name: str, use_pos_model: bool, batch_size: int = None, backend: str = 'eager',
+                precision: str = 'fp32', channels_last: bool = False):
+        """
+        Constructs a classifier (if not cached already) and runs a dummy batch through it with the given 
+        execution backend, precision and memory format, so that the first request for the model doesn't pay for 
+        the model loading and the warm-up.
+        """
+        classifier = self.get(model_name, use_pos_model)
+        classifier.warm_up(batch_size, backend=backend, precision=precision, channels_last=channels_last)
+        with self._lock:
+            self._warm.add((model_name, use_pos_model))
+        return classifier
+
+    def warm_models(self) -> Tuple[Tuple[str, bool], ...]:
+        """
+        Returns keys of classifiers that are in the registry and have been warmed up.
+        """
+        with self._lock:
+            return tuple(key for key in self._cache if key in self._warm)
+
+    def _evict(self):
+        # the most recently added classifier is always kept, even if it alone exceeds the caps
+        while len(self._cache) > 1 and (
+                len(self._cache) > self.max_models
+                or (self.max_bytes is not None and self.cached_bytes() > self.max_bytes)):
+            (name, pos), _ = self._cache.popitem(last=False)
+            self._warm.discard((name, pos))
+            self.evictions += 1
+            self.logger.info(f"Evicted classifier {name} (positional model: {pos}) from the registry")
+        if self.max_models < 1:
+            self.clear()
+
+    def cached_bytes(self) -> int:
+        return self.memory_footprint(*self._cache.values())
+
+    def cached_models(self) -> Tuple[Tuple[str, bool], ...]:
+        with self._lock:
+            return tuple(self._cache.keys())
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._warm.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'cached': len(self._cache), 'cachedBytes': self.cached_bytes()}
@@ -0,0 +1,130 @@
+"""
+Coarse-to-fine adaptive sampling of frames to classify.
+
+Frames of a uniform sampling grid (e.g. one frame per second) are first classified at a coarse stride (e.g. every
+10th frame of the grid). Then, wherever the two classified ends of an interval disagree on the top label or one of
+them is not confident, the middle frame of the interval is classified, and the two halves are checked again,
+until the intervals can't be split any further. Frames of the grid that are not classified get probabilities
+linearly interpolated from the classified frames around them, so that the output still covers the full uniform
+grid (as expected by the stitcher), while the backbone only runs on frames around label transitions.
+
+Alternatively (or in addition, as the starting points of the refinement), frames can be picked from scene cuts 
+detected in the codec metadata (see :func:`scene_indices`): densely around the cuts, and sparsely within shots.
+
+Note that a segment shorter than the coarse stride can be missed when the classified frames on both sides of it
+agree, hence the coarse stride should be shorter than the shortest segment of interest.
+"""
+import bisect
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+
+
+def coarse_indices(n: int, step: int) -> List[int]:
+    """
+    Returns every ``step``-th index of a grid of ``n`` points, always including the last one.
+    """
+    indices = list(range(0, n, max(1, step)))
+    if indices and indices[-1] != n - 1:
+        indices.append(n - 1)
+    return indices
+
+
+def scene_indices(framenums: List[int], cuts: List[int], step: int, window: int) -> List[int]:
+    """
+    Picks points of a grid of frames to classify around scene cuts: every point within ``window`` frames of a cut, 
+    and every ``step``-th point elsewhere (see :func:`coarse_indices`).
+
+    :param framenums: sorted frame numbers of the grid points
+    :param cuts: frame numbers of the scene cuts
+    :param step: stride within shots, in grid points
+    :param window: distance to a cut (in frames) within which all grid points are picked
+    """
+    indices = set(coarse_indices(len(framenums), step))
+    for cut in cuts:
+        indices.update(range(bisect.bisect_left(framenums, cut - window), bisect.bisect_right(framenums, cut + window)))
+    return sorted(indices)
+
+
+def split(framenums: List[int], shards: int) -> List[List[int]]:
+    """
+    Splits the grid into (at most) ``shards`` contiguous, non-empty parts of (almost) equal size.
+    """
+    size, remainder = divmod(len(framenums), shards)
+    parts = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < remainder else 0)
+        if end > start:
+            parts.append(framenums[start:end])
+        start = end
+    return parts
+
+
+def needs_refinement(left: torch.Tensor, right: torch.Tensor, min_confidence: float) -> bool:
+    """
+    Checks whether the interval between two classified points must be sampled more densely, i.e., when the top
+    labels of the ends differ, or the top probability of either end is below ``min_confidence``.
+    """
+    return bool(left.argmax() != right.argmax()) or min(left.max(), right.max()).item() < min_confidence
+
+
+def refine(n: int, step: int, classify: Callable[[List[int]], Dict[int, torch.Tensor]],
+           min_confidence: float, initial: Optional[List[int]] = None) -> Dict[int, torch.Tensor]:
+    """
+    Classifies points of a grid of ``n`` points coarse to fine.
+
+    :param n: number of points in the grid
+    :param step: initial (coarse) stride, in grid points
+    :param classify: function that classifies the points of the given indices and returns their label probabilities
+                     by index, called once per refinement round. Points that can't be classified (e.g. frames that
+                     can't be decoded) can be left out of the result.
+    :param min_confidence: top label probability under which a point is considered not confident
+    :param initial: sorted indices of the points to classify first, instead of every ``step``-th point
+    :return: probabilities of all classified points, by index
+    """
+    coarse = coarse_indices(n, step) if initial is None else initial
+    probabilities = dict(classify(coarse))
+    if not probabilities:
+        return probabilities
+    known = sorted(probabilities)
+    intervals = list(zip(known, known[1:]))
+    # when the last points can't be classified (e.g. the last frames of a video can't be decoded), the last
+    # classifiable point is searched by bisection between the last classified and the first failed point
+    tail = (known[-1], min(i for i in coarse if i > known[-1])) if known[-1] < coarse[-1] else None
+    while True:
+        to_split = [(left, right) for left, right in intervals
+                    if right - left > 1 and needs_refinement(probabilities[left], probabilities[right], min_confidence)]
+        middles = [(left + right) // 2 for left, right in to_split]
+        tail_middle = (tail[0] + tail[1]) // 2 if tail is not None and tail[1] - tail[0] > 1 else None
+        if not middles and tail_middle is None:
+            break
+        probabilities.update(classify(sorted(middles + ([tail_middle] if tail_middle is not None else []))))
+        intervals = []
+        for (left, right), middle in zip(to_split, middles):
+            if middle in probabilities:
+                intervals.extend([(left, middle), (middle, right)])
+        if tail_middle is not None:
+            if tail_middle in probabilities:
+                intervals.append((tail[0], tail_middle))
+                tail = (tail_middle, tail[1])
+            else:
+                tail = (tail[0], tail_middle)
+    return probabilities
+
+
+def interpolate(probabilities: Dict[int, torch.Tensor]) -> Tuple[List[int], torch.Tensor]:
+    """
+    Fills in probabilities of all grid points between the first and the last classified points by linear
+    interpolation between the nearest classified points on both sides.
+
+    :return: the indices of the filled grid, and their probabilities
+    """
+    known = sorted(probabilities)
+    if not known:
+        return [], torch.zeros(0)
+    filled = [probabilities[known[0]].unsqueeze(0)]
+    for left, right in zip(known, known[1:]):
+        weights = torch.arange(1, right - left + 1, dtype=torch.float32).unsqueeze(1) / (right - left)
+        filled.append(probabilities[left] * (1 - weights) + probabilities[right] * weights)
+    return list(range(known[0], known[-1] + 1)), torch.cat(filled)
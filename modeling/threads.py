@@ -0,0 +1,143 @@
+"""
+CPU thread and core partitioning for running several inference processes (e.g. gunicorn workers) on one machine.
+
+By default, PyTorch in every process uses as many intra-op threads as there are cores, hence N workers classifying
+videos at the same time run N times more threads than cores. A :class:`ThreadConfig` sets intra-op/inter-op thread
+counts per process and optionally pins each process to its own, disjoint, set of cores. In ``auto`` mode, the
+available cores are divided evenly among the workers.
+
+Note that a process must not run multi-threaded PyTorch operations before it is forked, as the OpenMP thread pool
+doesn't survive ``fork()`` and the first parallel operation in the child process hangs. Use
+:func:`limit_to_single_thread` in the parent process before any warm-up.
+"""
+import logging
+import os
+from typing import Dict, List, Optional, Union
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def available_cpus() -> List[int]:
+    """
+    Returns the ids of the cores the current process is allowed to run on.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cpus(cpus: List[int], parts: int, index: int) -> List[int]:
+    """
+    Splits the cores into ``parts`` contiguous chunks of (almost) equal size and returns the ``index``-th chunk.
+    When there are more parts than cores, each part gets a single core and cores are shared round-robin.
+    """
+    if parts >= len(cpus):
+        return [cpus[index % len(cpus)]]
+    size, remainder = divmod(len(cpus), parts)
+    start = index * size + min(index, remainder)
+    return cpus[start:start + size + (1 if index < remainder else 0)]
+
+
+def format_cpu_list(cpus: List[int]) -> str:
+    """
+    Formats core ids in the same compact way as ``taskset -c`` (e.g. ``0-3,8-11``).
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(a) if a == b else f'{a}-{b}' for a, b in ranges)
+
+
+def current_settings() -> Dict[str, Union[int, str]]:
+    """
+    Returns the thread settings in effect in the current process, with the keys used in the view metadata.
+    """
+    return {'intraOpThreads': torch.get_num_threads(),
+            'interOpThreads': torch.get_num_interop_threads(),
+            'cpuAffinity': format_cpu_list(available_cpus())}
+
+
+def limit_to_single_thread():
+    """
+    Makes PyTorch run single-threaded in the current process, so that it can be safely forked afterward.
+    """
+    torch.set_num_threads(1)
+
+
+class ThreadConfig:
+    """
+    Thread settings for one of several worker processes sharing the machine.
+    """
+
+    def __init__(self, intra_op_threads: Union[int, str, None] = None, inter_op_threads: Optional[int] = None,
+                 pin: bool = False):
+        """
+        :param intra_op_threads: number of threads for parallelism within an operation, ``'auto'`` to divide
+                                 the available cores evenly among the workers, or ``None`` to use all cores
+                                 (PyTorch default)
+        :param inter_op_threads: number of threads for parallelism between operations, ``None`` for PyTorch default
+        :param pin: whether to pin each worker to its own share of the cores
+        """
+        if intra_op_threads not in (None, 'auto') and int(intra_op_threads) < 1:
+            raise ValueError(f'Invalid number of intra-op threads: {intra_op_threads}')
+        if inter_op_threads is not None and inter_op_threads < 1:
+            raise ValueError(f'Invalid number of inter-op threads: {inter_op_threads}')
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.pin = pin
+
+    def plan(self, index: int = 0, workers: int = 1, cpus: List[int] = None) -> Dict[str, Union[int, List[int], None]]:
+        """
+        Computes the settings of the ``index``-th of ``workers`` processes.
+
+        :return: a dict with ``intraOpThreads``, ``interOpThreads`` and ``cpuAffinity`` (core ids, or ``None``
+                 when the process is not pinned)
+        """
+        cpus = available_cpus() if cpus is None else cpus
+        share = partition_cpus(cpus, max(1, workers), index)
+        if self.intra_op_threads == 'auto':
+            intra_op = len(share)
+        elif self.intra_op_threads is None:
+            intra_op = len(cpus)
+        else:
+            intra_op = int(self.intra_op_threads)
+        return {'intraOpThreads': intra_op,
+                'interOpThreads': self.inter_op_threads,
+                'cpuAffinity': share if self.pin else None}
+
+    def apply(self, index: int = 0, workers: int = 1):
+        """
+        Applies the settings of the ``index``-th of ``workers`` processes to the current process.
+        """
+        settings = self.plan(index, workers)
+        if settings['cpuAffinity'] is not None and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, settings['cpuAffinity'])
+        torch.set_num_threads(settings['intraOpThreads'])
+        if settings['interOpThreads'] is not None:
+            try:
+                torch.set_num_interop_threads(settings['interOpThreads'])
+            except RuntimeError as e:
+                # can only be set once, and before any inter-op parallel work has started
+                logger.warning(f'Could not set the number of inter-op threads: {e}')
+        logger.info(f'Worker {index + 1}/{workers} thread settings: {current_settings()}')
+
+    def gunicorn_hooks(self) -> Dict:
+        """
+        Returns ``pre_fork`` and ``post_fork`` server hooks that apply the settings to each gunicorn worker.
+        Each worker takes the lowest free slot, so that a restarted worker gets the cores of the one it replaces.
+        """
+        def pre_fork(server, worker):
+            # runs in the arbiter process, before the new worker is added to `server.WORKERS`
+            taken = {getattr(w, 'thread_slot', None) for w in server.WORKERS.values()}
+            worker.thread_slot = next(i for i in range(len(taken) + 1) if i not in taken)
+            worker.thread_slots = server.num_workers
+
+        def post_fork(server, worker):
+            self.apply(worker.thread_slot, worker.thread_slots)
+
+        return {'pre_fork': pre_fork, 'post_fork': post_fork}
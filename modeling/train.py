@@ -12,6 +12,7 @@ from typing import Union, List
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import yaml
 from torch import Tensor
 from torch.utils.data import Dataset, DataLoader
@@ -34,16 +35,24 @@ RESULTS_DIR = Path(__file__).parent / f"results-{platform.node().split('.')[0]}"
 
 
 class SWTDataset(Dataset):
-    def __init__(self, backbone_model_name: str, labels: List[int], vectors: List[Tensor]):
+    def __init__(self, backbone_model_name: str, labels: List[int], vectors: List[Tensor],
+                 soft_labels: List[Tensor] = None):
+        """
+        :param soft_labels: label probabilities from a teacher model, for distillation. When given, items are
+                            (vector, label, soft label) triples instead of (vector, label) pairs
+        """
         self.img_enc_name = backbone_model_name
         self.feat_dim = vectors[0].shape[0] if len(vectors) > 0 else None
         self.labels = labels
         self.vectors = vectors
+        self.soft_labels = soft_labels
 
     def __len__(self):
         return len(self.labels)
 
     def __getitem__(self, i):
+        if self.soft_labels is not None:
+            return self.vectors[i], self.labels[i], self.soft_labels[i]
         return self.vectors[i], self.labels[i]
     
     def has_data(self):
@@ -104,28 +113,91 @@ def get_net(in_dim, n_labels, num_layers, dropout=0.0):
     return net
 
 
-def prepare_datasets(indir, train_guids, validation_guids, configs):
+class DistillationLoss(nn.Module):
+    """
+    Knowledge distillation loss (Hinton et al., 2015): a weighted sum of the KL divergence between the
+    temperature-softened student and teacher label distributions (scaled by the squared temperature, to keep its
+    gradients on the scale of the hard label loss), and the usual cross entropy against the gold labels. Like the
+    plain ``CrossEntropyLoss(reduction="none")``, returns a loss per example.
+    """
+
+    def __init__(self, temperature: float = 2.0, alpha: float = 0.5):
+        """
+        :param temperature: temperature of the softmax, also applied to the teacher logits when computing the
+                            soft labels (see :func:`teacher_soft_labels`)
+        :param alpha: weight of the soft label loss, the hard label loss gets ``1 - alpha``
+        """
+        super().__init__()
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def forward(self, outputs: Tensor, labels: Tensor, soft_labels: Tensor) -> Tensor:
+        soft_loss = F.kl_div(F.log_softmax(outputs / self.temperature, dim=1), soft_labels,
+                             reduction="none").sum(dim=1) * self.temperature ** 2
+        hard_loss = F.cross_entropy(outputs, labels, reduction="none")
+        return self.alpha * soft_loss + (1 - self.alpha) * hard_loss
+
+
+def load_teacher(model_stem, configs):
+    """
+    Loads a trained model to distill a student model from. The teacher must be trained on the same labels as the
+    student, and its backbone features must be pre-computed in the training data directory, along with the
+    student's.
+
+    :param model_stem: the stem of the teacher model files, e.g. "modelpath/model" for "modelpath/model.pt" and
+                       "modelpath/model.yml"
+    :param configs: the student training configuration
+    """
+    from modeling.classify import Classifier
+    teacher = Classifier(model_stem, logger_name=logger.name)
+    if teacher.training_labels != get_prebinned_labelset(configs):
+        raise ValueError(f"Teacher labels {teacher.training_labels} are not the student labels "
+                         f"{get_prebinned_labelset(configs)}")
+    return teacher
+
+
+def teacher_soft_labels(teacher, feature_vecs: np.ndarray, positions: List[int], total_video_len: int,
+                        temperature: float) -> Tensor:
+    """
+    Computes the temperature-softened label probabilities of the teacher model for the frames of a video.
+
+    :param feature_vecs: the teacher backbone features of the frames
+    :param positions: the time points of the frames
+    :param total_video_len: the duration of the video
+    """
+    with torch.inference_mode():
+        logits = teacher.classifier(teacher.featurizer.encode_positions(positions, total_video_len, feature_vecs))
+    return torch.softmax(logits / temperature, dim=1)
+
+
+def prepare_datasets(indir, train_guids, validation_guids, configs, teacher=None):
     """
     Given a directory of pre-computed dense feature vectors, 
     prepare the training and validation datasets. The preparation includes
     1. positional encodings are applied.
     2. 'gold' labels are attached to each vector.
     3. split of vectors into training and validation sets (at video-level, meaning all frames from a video are either in training or validation set).
+    4. when a teacher model is given, its (softened) label probabilities are attached to each training vector.
     returns training dataset, validation dataset
     """
     train_vectors = []
     train_labels = []
+    train_soft_labels = []
     valid_vectors = []
     valid_labels = []
     train_vimg = valid_vimg = 0
 
-    extractor = data_loader.FeatureExtractor(**config)
+    extractor = data_loader.FeatureExtractor(**configs)
 
     for j in Path(indir).glob('*.json'):
         guid = j.with_suffix("").name
         feature_vecs = np.load(Path(indir) / f"{guid}.{configs['img_enc_name']}.npy")
         labels = json.load(open(Path(indir) / f"{guid}.json"))
         total_video_len = labels['duration']
+        if teacher is not None and guid in train_guids:
+            soft_labels = teacher_soft_labels(
+                teacher, np.load(Path(indir) / f"{guid}.{teacher.featurizer.img_encoder.name}.npy"),
+                [frame['curr_time'] for frame in labels['frames']], total_video_len, configs['distill_temperature'])
         for i, vec in enumerate(feature_vecs):
             if not labels['frames'][i]['mod']:  # "transitional" frames
                 pre_binned_label = pretraining_bin(labels['frames'][i]['label'], configs)
@@ -140,8 +212,11 @@ def prepare_datasets(indir, train_guids, validation_guids, configs):
                     train_vimg += 1
                     train_vectors.append(vector)
                     train_labels.append(pre_binned_label)
+                    if teacher is not None:
+                        train_soft_labels.append(soft_labels[i])
     logger.info(f'train: {len(train_guids)} videos, {train_vimg} images, valid: {len(validation_guids)} videos, {valid_vimg} images')
-    train = SWTDataset(configs['img_enc_name'], train_labels, train_vectors)
+    train = SWTDataset(configs['img_enc_name'], train_labels, train_vectors,
+                       train_soft_labels if teacher is not None else None)
     valid = SWTDataset(configs['img_enc_name'], valid_labels, valid_vectors)
     return train, valid
 
@@ -163,6 +238,12 @@ def train(indir, outdir, config_file, configs, train_id=time.strftime("%Y%m%d-%H
     r_scores = []
     f_scores = []
     loss = nn.CrossEntropyLoss(reduction="none")
+    teacher = None
+    if configs.get('teacher'):
+        # distillation: the student is trained against the soft labels of the teacher, in addition to gold labels
+        teacher = load_teacher(configs['teacher'], configs)
+        loss = DistillationLoss(configs['distill_temperature'], configs['distill_alpha'])
+        logger.info(f"Distilling from {configs['teacher']}")
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     
     # the number of labels (after "pre"-binning)
@@ -178,7 +259,7 @@ def train(indir, outdir, config_file, configs, train_id=time.strftime("%Y%m%d-%H
         valid_guids = modeling.config.batches.guids_for_fixed_validation_set
         train_all_guids = train_all_guids - set(valid_guids)
         # prepare_datasets seems to work fine with empty validation set
-        train, valid = prepare_datasets(indir, train_all_guids, valid_guids, configs)
+        train, valid = prepare_datasets(indir, train_all_guids, valid_guids, configs, teacher)
         train_loader = DataLoader(train, batch_size=len(train_all_guids), shuffle=True)
         valid_loader = DataLoader(valid, batch_size=len(valid), shuffle=False)   
         base_fname = f"{outdir}/{train_id}"
@@ -199,7 +280,7 @@ def train(indir, outdir, config_file, configs, train_id=time.strftime("%Y%m%d-%H
         logger.debug(f'After applied block lists:')
         logger.debug(f'train set: {train_guids}')
         logger.debug(f'dev set: {validation_guids}')
-        train, valid = prepare_datasets(indir, train_guids, validation_guids, configs)
+        train, valid = prepare_datasets(indir, train_guids, validation_guids, configs, teacher)
         # `train` and `valid` vectors DO contain positional encoding after `split_dataset`
         if not train.has_data() or not valid.has_data():
             logger.info(f"Skipping fold {j} due to lack of data")
@@ -269,7 +350,8 @@ def train_model(model, loss_fn, device, train_loader, configs):
         running_loss = 0.0
 
         model.train()
-        for num_batch, (feats, labels) in enumerate(train_loader):
+        # batches of a distillation dataset additionally hold the soft labels, which are passed on to the loss
+        for num_batch, (feats, labels, *soft_labels) in enumerate(train_loader):
             feats.to(device)
             labels.to(device)
 
@@ -277,7 +359,7 @@ def train_model(model, loss_fn, device, train_loader, configs):
                 optimizer.zero_grad()
                 outputs = model(feats)
                 _, preds = torch.max(outputs, 1)
-                loss = loss_fn(outputs, labels)
+                loss = loss_fn(outputs, labels, *soft_labels)
                 loss.sum().backward()
                 optimizer.step()
 
@@ -302,6 +384,17 @@ if __name__ == "__main__":
     parser.add_argument("indir", help="root directory containing the vectors and labels to train on")
     parser.add_argument("-c", "--config", metavar='FILE', help="the YAML model config file", default=None)
     parser.add_argument("-o", "--outdir", metavar='DIR', help="the results directory", default=RESULTS_DIR)
+    parser.add_argument("-t", "--teacher", metavar='STEM', default=None,
+                        help="the stem of a trained model (e.g. modeling/models/20241130-145339.convnext_lg.noprebin"
+                             ".posT) to distill into the trained models, which then learn from the label "
+                             "probabilities of the teacher as well as from the gold labels. The backbone features of "
+                             "the teacher must be in the training data directory too. The app serves the distilled "
+                             "models under the backbone name with a `-distilled` suffix (e.g. convnext_tiny-distilled).")
+    parser.add_argument("--temperature", type=float, default=2.0,
+                        help="softmax temperature for distillation, higher values soften the teacher probabilities")
+    parser.add_argument("--alpha", type=float, default=0.5,
+                        help="weight of the teacher probabilities in the distillation loss, the gold labels get the "
+                             "rest")
     args = parser.parse_args()
 
     if args.config:
@@ -327,7 +420,11 @@ if __name__ == "__main__":
             # "regular" fully-custom binning config via a proper dict - can't set a name for this
             prebin_name = 'custom'
         positionalencoding = "pos" + ("F" if config["pos_vec_coeff"] == 0 else "T")
+        distilled = None
+        if args.teacher:
+            config.update(teacher=args.teacher, distill_temperature=args.temperature, distill_alpha=args.alpha)
+            distilled = 'distilled'
         train(
             indir=args.indir, outdir=args.outdir, config_file=args.config, configs=config,
-            train_id='.'.join(filter(None, [timestamp, backbonename, prebin_name, positionalencoding]))
+            train_id='.'.join(filter(None, [timestamp, backbonename, prebin_name, distilled, positionalencoding]))
         )
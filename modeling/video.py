@@ -0,0 +1,285 @@
+"""
+Frame extraction from video files using PyAV.
+
+Two decoding strategies are available to extract a set of sampled frames:
+
+* ``seek``: seeks to the keyframe before each sampled frame and decodes forward from there. Cheap when samples are
+  far apart (e.g. every 10 seconds), since most of the video is never decoded.
+* ``sequential``: decodes the whole stream in a single linear pass and keeps the sampled frames. Cheap when samples
+  are dense (e.g. every 500 milliseconds), since seeking would repeatedly decode the same group of pictures (GOP).
+
+With ``auto`` mode, the strategy is chosen by comparing the sampling step to the GOP length of the stream.
+
+Frames are decoded with the codec's own threading, optionally scaled down during the pixel format conversion 
+(so that no full-resolution RGB copy is ever made), and returned as uint8 arrays in H x W x 3 (RGB) layout.
+
+Likely scene cuts can be located without decoding at all, from the packet metadata of the stream (see 
+:func:`detect_cuts`): encoders insert keyframes at scene changes ahead of their regular keyframe interval, and the 
+first inter-coded frame after a cut is mostly intra-coded, hence much larger than the frames around it.
+
+Tiny grayscale thumbnails of decoded frames (see :func:`thumbnail`) can be compared to detect near-duplicate 
+frames (e.g. consecutive samples of a static slate or a black screen) before they reach the backbone model.
+"""
+import logging
+import warnings
+from collections import Counter
+from typing import Iterator, List, NamedTuple, Tuple
+
+import av
+import numpy as np
+
+DECODE_MODES = ['auto', 'seek', 'sequential']
+
+logger = logging.getLogger(__name__)
+
+
+class PacketInfo(NamedTuple):
+    frame: int
+    size: int
+    keyframe: bool
+
+
+class FrameReader:
+    """
+    Reads frames by their frame numbers from a video file. Frame numbers are computed from the presentation
+    timestamps of the decoded frames and the given frame rate, so that they are consistent with the frame
+    numbers used in the MMIF video document helpers.
+    """
+
+    def __init__(self, video_path: str, fps: float, short_side: int = None, threads: int = 0):
+        """
+        :param video_path: path to the video file
+        :param fps: frame rate to convert timestamps to frame numbers
+        :param short_side: when set, frames are scaled down during decoding so that their shorter side has this
+                           length (aspect ratio is kept, frames already smaller than this are not scaled)
+        :param threads: number of decoding threads, 0 to let the codec decide
+        """
+        self.video_path = video_path
+        self.fps = fps
+        self.short_side = short_side
+        self.threads = threads
+
+    def _open(self):
+        container = av.open(self.video_path)
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO'
+        stream.thread_count = self.threads
+        start = float(stream.start_time * stream.time_base) if stream.start_time is not None else 0.0
+        return container, stream, start
+
+    def _scaled_size(self, width: int, height: int) -> Tuple[int, int]:
+        # same computation of the output size as in `torchvision.transforms.functional.resize` with a single int
+        if self.short_side is None or min(width, height) <= self.short_side:
+            return width, height
+        if width <= height:
+            return self.short_side, int(self.short_side * height / width)
+        return int(self.short_side * width / height), self.short_side
+
+    def frame_shape(self) -> Tuple[int, int, int]:
+        """
+        Returns the shape of the frame arrays returned by the reader (H x W x 3), from the stream header.
+        """
+        with av.open(self.video_path) as container:
+            stream = container.streams.video[0]
+            width, height = self._scaled_size(stream.codec_context.width, stream.codec_context.height)
+        return height, width, 3
+
+    def _to_array(self, frame) -> np.ndarray:
+        width, height = self._scaled_size(frame.width, frame.height)
+        return frame.reformat(width=width, height=height, format='rgb24', interpolation='BILINEAR').to_ndarray()
+
+    def _frame_index(self, frame, start: float) -> int:
+        return round((frame.time - start) * self.fps)
+
+    def estimate_gop_length(self, max_packets: int = 1000) -> float:
+        """
+        Estimates the average distance (in frames) between two consecutive keyframes by demuxing (no decoding)
+        the beginning of the stream.
+
+        :param max_packets: maximum number of packets to look at
+        :return: the average GOP length, or the number of packets read if there's only one keyframe in them
+        """
+        container, stream, _ = self._open()
+        keyframes = []
+        count = 0
+        try:
+            for packet in container.demux(stream):
+                if packet.size == 0:  # flushing packet
+                    continue
+                if packet.is_keyframe:
+                    keyframes.append(count)
+                count += 1
+                if count >= max_packets:
+                    break
+        finally:
+            container.close()
+        if len(keyframes) < 2:
+            return float(count)
+        return (keyframes[-1] - keyframes[0]) / (len(keyframes) - 1)
+
+    def scan_packets(self) -> List[PacketInfo]:
+        """
+        Demuxes (without decoding) the whole stream and returns the frame number, size and keyframe flag of every 
+        packet, in presentation order.
+        """
+        container, stream, start = self._open()
+        packets = []
+        try:
+            for packet in container.demux(stream):
+                if packet.size == 0 or packet.pts is None:  # flushing packet, or no timestamp to place it
+                    continue
+                frame = round((float(packet.pts * stream.time_base) - start) * self.fps)
+                packets.append(PacketInfo(frame, packet.size, packet.is_keyframe))
+        finally:
+            container.close()
+        return sorted(packets)
+
+    def choose_mode(self, step: float) -> str:
+        """
+        Picks a decoding strategy for the given sampling step (in frames). When samples are closer to each other
+        than the GOP length, seeking to each sample decodes (on average) half of a GOP plus the seek overhead per
+        sample, which is more than decoding everything in between, hence a linear pass is preferred.
+        """
+        gop_length = self.estimate_gop_length()
+        mode = 'sequential' if step <= gop_length else 'seek'
+        logger.debug(f'Sampling step: {step:.1f} frames, estimated GOP length: {gop_length:.1f} frames, '
+                     f'using {mode} decoding')
+        return mode
+
+    def read_frames(self, framenums: List[int], mode: str = 'auto') -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Generates (frame number, RGB array) pairs for the requested frame numbers, in increasing order. When the
+        exact frame is not found in the stream (e.g. a gap in a variable frame rate video), the first frame after
+        it is used. Frame numbers beyond the end of the stream are skipped with a warning.
+
+        :param framenums: sorted frame numbers to read
+        :param mode: one of ``DECODE_MODES``
+        """
+        if not framenums:
+            return
+        if mode == 'auto':
+            step = (framenums[-1] - framenums[0]) / (len(framenums) - 1) if len(framenums) > 1 else float('inf')
+            mode = self.choose_mode(step)
+        if mode == 'seek':
+            frames = self._read_by_seeking(framenums)
+        elif mode == 'sequential':
+            frames = self._read_sequentially(framenums)
+        else:
+            raise ValueError(f'Unknown decoding mode: {mode}, must be one of {DECODE_MODES}')
+        yield from frames
+
+    def _read_sequentially(self, framenums: List[int]):
+        container, stream, start = self._open()
+        i = 0
+        try:
+            if framenums[0] > 0:
+                # the linear pass starts from the keyframe at or before the first requested frame, rather than
+                # from the beginning of the stream (e.g. for a later shard or checkpoint batch of a long video)
+                target_pts = int((framenums[0] / self.fps + start) / stream.time_base)
+                container.seek(target_pts, stream=stream, backward=True, any_frame=False)
+            for frame in container.decode(stream):
+                idx = self._frame_index(frame, start)
+                if idx < framenums[i]:
+                    continue
+                image = self._to_array(frame)
+                while i < len(framenums) and framenums[i] <= idx:
+                    yield framenums[i], image
+                    i += 1
+                if i == len(framenums):
+                    break
+        finally:
+            container.close()
+        self._warn_missing(framenums[i:])
+
+    def _read_by_seeking(self, framenums: List[int]):
+        container, stream, start = self._open()
+        i = 0
+        try:
+            while i < len(framenums):
+                target_pts = int((framenums[i] / self.fps + start) / stream.time_base)
+                container.seek(target_pts, stream=stream, backward=True, any_frame=False)
+                found = False
+                for frame in container.decode(stream):
+                    idx = self._frame_index(frame, start)
+                    if idx < framenums[i]:
+                        continue
+                    found = True
+                    image = self._to_array(frame)
+                    while i < len(framenums) and framenums[i] <= idx:
+                        yield framenums[i], image
+                        i += 1
+                    break
+                if not found:
+                    break
+        finally:
+            container.close()
+        self._warn_missing(framenums[i:])
+
+    def _warn_missing(self, framenums: List[int]):
+        if framenums:
+            warnings.warn(f'{len(framenums)} frames from #{framenums[0]} could not be read from {self.video_path}.')
+
+
+def duration(video_path: str) -> float:
+    """
+    Reads the duration (in seconds) of a video file from its container header, without decoding.
+    """
+    with av.open(video_path) as container:
+        if container.duration is not None:
+            return container.duration / av.time_base
+        stream = container.streams.video[0]
+        return float(stream.duration * stream.time_base) if stream.duration is not None else 0.0
+
+
+def thumbnail(image: np.ndarray, size: int = 16) -> np.ndarray:
+    """
+    Downscales an RGB frame to a ``size`` x ``size`` grayscale thumbnail by area averaging, with values in [0, 1].
+    """
+    gray = image.mean(axis=2, dtype=np.float32)
+    rows = np.linspace(0, gray.shape[0], size + 1).astype(int)[:-1]
+    cols = np.linspace(0, gray.shape[1], size + 1).astype(int)[:-1]
+    sums = np.add.reduceat(np.add.reduceat(gray, rows, axis=0), cols, axis=1)
+    counts = np.outer(np.diff(np.append(rows, gray.shape[0])), np.diff(np.append(cols, gray.shape[1])))
+    return sums / counts / 255
+
+
+def thumbnail_distance(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Mean absolute difference between two thumbnails, from 0 (identical) to 1 (black vs. white).
+    """
+    return float(np.abs(a - b).mean())
+
+
+def detect_cuts(packets: List[PacketInfo], spike_ratio: float = 4.0, window: int = 30) -> List[int]:
+    """
+    Finds frame numbers of likely scene cuts from packet metadata (see :meth:`FrameReader.scan_packets`). A frame
+    is a likely cut when
+
+    * it is a keyframe that is neither the most common keyframe interval away from the previous keyframe, nor on 
+      the grid of that interval from the previous regular keyframe, i.e., inserted by the encoder's scene change 
+      detection rather than by its regular keyframe interval (encoders either restart the interval after an 
+      inserted keyframe, or keep it), or
+    * it is not a keyframe, but more than ``spike_ratio`` times larger than the median of the ``window`` packets 
+      before it, and at least half as large as the last keyframe.
+
+    The first frame of the stream is not a cut.
+    """
+    # frame numbers are rounded from timestamps, and may repeat (e.g. with variable frame rates or odd time bases)
+    keyframes = sorted(set(p.frame for p in packets if p.keyframe))
+    intervals = [b - a for a, b in zip(keyframes, keyframes[1:])]
+    regular = Counter(intervals).most_common(1)[0][0] if intervals else None
+    cuts = []
+    last_regular = keyframes[0] if keyframes else None
+    for a, b in zip(keyframes, keyframes[1:]):
+        if b - a == regular or (b - last_regular) % regular == 0:
+            last_regular = b
+        else:
+            cuts.append(b)
+    last_keyframe_size = None
+    for i, packet in enumerate(packets):
+        if packet.keyframe:
+            last_keyframe_size = packet.size
+        elif i > 0 and last_keyframe_size is not None and packet.size * 2 >= last_keyframe_size and \
+                packet.size > spike_ratio * np.median([p.size for p in packets[max(0, i - window):i]]):
+            cuts.append(packet.frame)
+    return sorted(set(cuts))
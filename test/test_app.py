@@ -0,0 +1,85 @@
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+import av
+import numpy as np
+import torch
+from mmif import Document, DocumentTypes
+from mmif.utils import video_document_helper as vdh
+
+import app
+import metadata
+
+
+class FakeClassifier:
+    """
+    A classifier that scores frames by their brightness, without a backbone.
+    """
+    training_labels = ['dark', 'bright']
+    model_stem = Path('20240101-000000.fake.noprebin.posT')
+
+    def __init__(self):
+        self.featurizer = SimpleNamespace(img_encoder=SimpleNamespace(name='fake', dim=2))
+        self.classified = 0
+
+    def resolve_precision(self, precision):
+        return precision
+
+    def preprocess_images(self, images):
+        return torch.from_numpy(np.asarray(images)).float().mean(dim=(1, 2, 3)) / 255
+
+    def classify_images(self, images, positions, final_pos, **kwargs):
+        self.classified += len(images)
+        return torch.stack([1 - images, images], dim=1)
+
+
+def make_video(path, n_frames=90, fps=30, size=(64, 48)):
+    container = av.open(str(path), 'w')
+    stream = container.add_stream('mpeg4', rate=fps)
+    stream.width, stream.height = size
+    stream.pix_fmt = 'yuv420p'
+    for i in range(n_frames):
+        # two shots of still frames, black then white
+        img = np.full((size[1], size[0], 3), 0 if i < n_frames // 2 else 255, np.uint8)
+        for packet in stream.encode(av.VideoFrame.from_ndarray(img, format='rgb24')):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+
+
+class TestClassifyTimepoints(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        video_path = Path(self.tmpdir.name) / 'test.mp4'
+        make_video(video_path)
+        self.video = Document()
+        self.video.at_type = DocumentTypes.VideoDocument
+        self.video.id = 'd1'
+        self.video.location = f'file://{video_path}'
+        self.video.add_property('fps', 30)
+        self.video.add_property(vdh.FRAMECOUNT_DOCPROP_KEY, 90)
+        self.classifier = FakeClassifier()
+        self.app = app.SwtDetection()
+        self.app.classifiers = SimpleNamespace(get=lambda *args: self.classifier, stats=lambda: {})
+        self.parameters = {parameter.name: parameter.default for parameter in metadata.appmetadata().parameters}
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_frame_counts(self):
+        sampled = list(range(0, 90, 3))
+        results = self.app._classify_timepoints(self.video, sampled, **{**self.parameters,
+                                                                         'tpDuplicateThreshold': 0.1})
+        self.assertEqual(len(results.positions), len(sampled))
+        # only the first frame of each shot goes through the backbone
+        self.assertEqual(results.stats['classifiedFrames'], 2)
+        self.assertEqual(results.stats['classifiedFrames'], self.classifier.classified)
+        self.assertEqual(results.stats['classifiedFrames'] + results.stats['skippedFrames'], len(sampled))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision.models import ConvNeXt_Large_Weights, ConvNeXt_Tiny_Weights, EfficientNet_V2_S_Weights, \
+    ResNet50_Weights
+
+from modeling import backbones
+
+
+class TestPreprocessBatch(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # smooth frames, as resizing noise would exaggerate rounding differences
+        gradient = np.linspace(0, 255, 640)[None, :, None] * np.linspace(0.2, 1, 360)[:, None, None]
+        self.frames = np.stack([(gradient * rng.uniform(0.5, 1, 3)).astype(np.uint8) for _ in range(4)])
+        self.noisy_frames = rng.integers(0, 256, (2, 360, 640, 3), dtype=np.uint8)
+
+    def assertParity(self, frames, transforms, exact=False):
+        expected = torch.stack([transforms(frame) for frame in torch.from_numpy(frames).permute(0, 3, 1, 2)])
+        actual = backbones.preprocess_batch(torch.from_numpy(frames).permute(0, 3, 1, 2), transforms)
+        self.assertEqual(actual.shape, expected.shape)
+        self.assertTrue(actual.is_contiguous())
+        if exact:
+            self.assertTrue(torch.equal(actual, expected))
+        else:
+            # at most one intensity level apart
+            self.assertLessEqual((actual - expected).abs().max().item(), 1 / 255 / min(transforms.std) + 1e-5)
+
+    def assertPilParity(self, frames, transforms):
+        # the baseline: frames extracted as PIL images, preprocessed one at a time
+        expected = torch.stack([transforms(Image.fromarray(frame)) for frame in frames])
+        actual = backbones.preprocess_batch(torch.from_numpy(frames).permute(0, 3, 1, 2), transforms)
+        self.assertEqual(actual.shape, expected.shape)
+        levels = (actual - expected).abs() * torch.tensor(transforms.std)[:, None, None] * 255
+        # at most one intensity level apart, on at most 1% of the values
+        self.assertLessEqual(levels.max().item(), 1 + 1e-3)
+        self.assertLessEqual((levels > 0.5).float().mean().item(), 0.01)
+
+    def test_pil_parity(self):
+        for weights in [ConvNeXt_Tiny_Weights.IMAGENET1K_V1, ConvNeXt_Large_Weights.IMAGENET1K_V1,
+                        EfficientNet_V2_S_Weights.IMAGENET1K_V1, ResNet50_Weights.IMAGENET1K_V1]:
+            with self.subTest(weights=weights):
+                self.assertPilParity(self.frames, weights.transforms())
+                self.assertPilParity(self.noisy_frames, weights.transforms())
+
+    def test_parity(self):
+        for weights in [ConvNeXt_Tiny_Weights.IMAGENET1K_V1, ConvNeXt_Large_Weights.IMAGENET1K_V1,
+                        EfficientNet_V2_S_Weights.IMAGENET1K_V1, ResNet50_Weights.IMAGENET1K_V1]:
+            with self.subTest(weights=weights):
+                self.assertParity(self.frames, weights.transforms())
+
+    def test_parity_resized(self):
+        transforms = ConvNeXt_Tiny_Weights.IMAGENET1K_V1.transforms()
+        short_side = transforms.resize_size[0]
+        frames = self.frames[:, :short_side, :short_side * 4 // 3]
+        self.assertParity(frames, transforms, exact=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+
+import torch
+
+from modeling import cascade
+
+
+class TestCascade(unittest.TestCase):
+
+    def test_uncertain(self):
+        probabilities = torch.tensor([
+            [0.98, 0.01, 0.01],  # certain
+            [0.6, 0.3, 0.1],  # top label probability too low
+            [0.95, 0.05, 0.0],  # certain
+            [1 / 3, 1 / 3, 1 / 3],  # uniform
+        ])
+        self.assertEqual(cascade.uncertain(probabilities, 0.9, 0.5).tolist(), [False, True, False, True])
+        # entropy alone
+        self.assertEqual(cascade.uncertain(probabilities, 0.0, 0.5).tolist(), [False, True, False, True])
+        self.assertEqual(cascade.uncertain(probabilities, 0.0, 1.0).tolist(), [False, False, False, False])
+        self.assertEqual(cascade.uncertain(torch.zeros(0, 3), 0.9, 0.5).tolist(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from modeling import checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_key(self):
+        key = checkpoint.checkpoint_key('abc', {'tpSampleRate': 1000, 'tpModelName': 'convnext_small'})
+        self.assertEqual(key, checkpoint.checkpoint_key('abc', {'tpModelName': 'convnext_small', 'tpSampleRate': 1000}))
+        self.assertNotEqual(key, checkpoint.checkpoint_key('abc', {'tpModelName': 'convnext_small', 'tpSampleRate': 500}))
+
+    def test_resume(self):
+        batches = [([0, 30, 60], [np.random.rand(3, 4), np.random.rand(3, 4)]),
+                   ([90, 120], [np.random.rand(2, 4), np.random.rand(2, 4)])]
+        run = checkpoint.Checkpoint(self.tmpdir.name, 'video.params')
+        self.assertEqual(run.load(), ([], []))
+        for framenums, outputs in batches:
+            run.save(framenums, outputs)
+        # a restarted run reads all finished batches, with results of each head in frame order
+        framenums, outputs = checkpoint.Checkpoint(self.tmpdir.name, 'video.params').load()
+        self.assertEqual(framenums, [0, 30, 60, 90, 120])
+        self.assertEqual(len(outputs), 2)
+        for head in range(2):
+            self.assertTrue(np.array_equal(outputs[head], np.concatenate([o[head] for _, o in batches])))
+        run.remove()
+        self.assertEqual(checkpoint.Checkpoint(self.tmpdir.name, 'video.params').load(), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import torch
+
+from modeling import classify, train
+
+
+def mock_classifier(model_dir: Path) -> classify.Classifier:
+    """
+    A classifier with a tiny random backbone and head, without loading model files.
+    """
+    torch.manual_seed(0)
+    classifier = classify.Classifier.__new__(classify.Classifier)
+    backbone = torch.nn.Sequential(torch.nn.Conv2d(3, 8, 16, stride=16), torch.nn.AdaptiveAvgPool2d(1),
+                                   torch.nn.Flatten()).eval()
+    classifier.model_stem = model_dir / '20240101-000000.mock.noprebin.posT'
+    classifier.featurizer = SimpleNamespace(img_encoder=SimpleNamespace(model=backbone),
+                                            pos_vec_lookup=torch.randn(100, 8), pos_vec_coeff=0.5)
+    classifier.classifier = train.get_net(8, 4, 2).eval()
+    classifier.logger = logging.getLogger('test')
+    return classifier
+
+
+class TestBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.storage = Path(self.tmpdir.name) / 'compiled'
+        patcher = mock.patch.object(classify, 'compiled_model_storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.classifier = mock_classifier(Path(self.tmpdir.name))
+        self.images = torch.rand(3, 3, 224, 224)
+        self.cols = torch.tensor([0, 5, 99])
+        with torch.no_grad():
+            self.expected = self.classifier._build_runner('eager')(self.images, self.cols)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def assertCached(self, suffix):
+        files = [f.name for f in self.storage.iterdir()]
+        self.assertEqual(len([f for f in files if f.endswith(suffix)]), 1)
+        # no temporary files are left behind
+        self.assertFalse([f for f in files if f.endswith('.tmp')])
+
+    def test_torchscript(self):
+        for _ in range(2):  # traced, then loaded from the cache
+            with torch.no_grad():
+                actual = self.classifier._build_runner('torchscript')(self.images, self.cols)
+            self.assertTrue(torch.allclose(actual, self.expected, atol=1e-6))
+            self.assertCached('.ts')
+
+    def test_onnxruntime(self):
+        for _ in range(2):  # exported, then loaded from the cache
+            actual = self.classifier._build_runner('onnxruntime')(self.images, self.cols)
+            self.assertTrue(torch.allclose(actual, self.expected, atol=1e-5))
+            self.assertCached('.onnx')
+
+    def test_save_atomically(self):
+        path = Path(self.tmpdir.name) / 'model.ts'
+
+        def failing_save(tmp_path):
+            Path(tmp_path).write_bytes(b'partial')
+            raise OSError('disk full')
+
+        with self.assertRaises(OSError):
+            classify.save_atomically(path, failing_save)
+        self.assertEqual(list(Path(self.tmpdir.name).glob('*.ts*')), [])
+        classify.save_atomically(path, lambda tmp_path: Path(tmp_path).write_bytes(b'complete'))
+        self.assertEqual(path.read_bytes(), b'complete')
+
+
+    def test_inductor_cache_dir(self):
+        # torchvision imports torch._dynamo, which writes the default cache directory to the environment
+        env = {k: v for k, v in os.environ.items() if k != 'TORCHINDUCTOR_CACHE_DIR'}
+        env['XDG_CACHE_HOME'] = self.tmpdir.name
+        out = subprocess.run([sys.executable, '-c', 'import os, modeling, torchvision; '
+                                                    'print(os.environ["TORCHINDUCTOR_CACHE_DIR"])'],
+                             env=env, capture_output=True, text=True, check=True,
+                             cwd=Path(__file__).parent.parent).stdout
+        self.assertEqual(out.strip(), str(Path(self.tmpdir.name) / 'swt-detection' / 'inductor'))
+
+
+if __name__ == '__main__':
+    unittest.main()
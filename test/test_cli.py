@@ -0,0 +1,22 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import cli
+
+
+class TestBatchInputs(unittest.TestCase):
+
+    def test_directory_and_manifest(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = Path(tmpdir)
+            for name in ['b.mmif', 'a.json', 'notes.txt']:
+                (tmpdir / name).write_text('{}')
+            self.assertEqual(cli.batch_inputs(tmpdir), [tmpdir / 'a.json', tmpdir / 'b.mmif'])
+            manifest = tmpdir / 'manifest.txt'
+            manifest.write_text('# nightly batch\nb.mmif\n\n/data/c.mmif\n')
+            self.assertEqual(cli.batch_inputs(manifest), [tmpdir / 'b.mmif', Path('/data/c.mmif')])
+
+
+if __name__ == '__main__':
+    unittest.main()
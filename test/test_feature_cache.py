@@ -0,0 +1,83 @@
+import hashlib
+import multiprocessing
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from modeling import feature_cache
+
+
+def put_frames(cache_dir, first_frame, batches):
+    cache = feature_cache.FeatureCache(cache_dir)
+    for batch in range(batches):
+        framenums = [first_frame + batch * 5 + i for i in range(5)]
+        cache.put('shared', framenums, np.full((5, 8), first_frame, np.float32))
+
+
+class TestFeatureCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = feature_cache.FeatureCache(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_put(self):
+        key = self.cache.key('abc', 'mock.fp32.resized')
+        found, _ = self.cache.get(key, [0, 30, 60])
+        self.assertFalse(found.any())
+        vectors = np.random.rand(3, 8).astype(np.float32)
+        self.cache.put(key, [60, 0, 90], vectors)
+        found, features = self.cache.get(key, [0, 30, 60, 90])
+        self.assertEqual(found.tolist(), [True, False, True, True])
+        self.assertTrue(np.array_equal(features, vectors[[1, 0, 2]]))
+        # newer features replace older ones of the same frame
+        self.cache.put(key, [30, 60], np.ones((2, 8), np.float32))
+        found, features = self.cache.get(key, [30, 60, 90])
+        self.assertTrue(found.all())
+        self.assertTrue(np.array_equal(features[:2], np.ones((2, 8), np.float32)))
+        self.assertEqual(self.cache.stats()['hits'], 3 + 3)
+        self.assertEqual(self.cache.stats()['misses'], 3 + 1)
+
+    def test_eviction(self):
+        vectors = np.zeros((100, 8), np.float32)
+        self.cache.put('old', range(100), vectors)
+        entry_size = self.cache.cached_bytes()
+        time.sleep(0.01)
+        self.cache.put('new', range(100), vectors)
+        time.sleep(0.01)
+        # reading an entry makes it recently used
+        self.cache.get('old', [0])
+        self.cache.max_bytes = entry_size * 2
+        self.cache.put('newest', range(100), vectors)
+        self.assertEqual(self.cache.stats()['entries'], 2)
+        self.assertTrue(self.cache.get('old', [0])[0].all())
+        self.assertFalse(self.cache.get('new', [0])[0].any())
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_concurrent_writers(self):
+        # like the shard workers of a video, several processes add records to the same entry at the same time
+        context = multiprocessing.get_context('spawn')
+        writers = [context.Process(target=put_frames, args=(self.tmpdir.name, first_frame, 20))
+                   for first_frame in range(0, 400, 100)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+            self.assertEqual(writer.exitcode, 0)
+        found, features = self.cache.get('shared', range(400))
+        self.assertTrue(found.all())
+        self.assertTrue(np.array_equal(features[:, 0], np.repeat(np.arange(0, 400, 100), 100)))
+
+    def test_content_hash(self):
+        path = Path(self.tmpdir.name) / 'video.bin'
+        path.write_bytes(b'frames')
+        self.assertEqual(feature_cache.content_hash(path, chunk_size=4), hashlib.sha256(b'frames').hexdigest())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import json
+import socket
+import tempfile
+import unittest
+
+from modeling import jobs
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.queue = jobs.JobQueue(self.tmpdir.name, max_queued=2)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_run_in_order(self):
+        first = self.queue.submit('{"first": 1}', {'tpSampleRate': ['500']})
+        second = self.queue.submit('{"second": 2}', {})
+        self.assertEqual(self.queue.status(second)['position'], 2)
+        with self.assertRaises(jobs.QueueFull):
+            self.queue.submit('{}', {})
+        seen = []
+
+        def handler(mmif, params):
+            seen.append((mmif, params))
+            jobs.report_progress(0.5)
+            self.assertEqual(self.queue.status(first)['progress'], 0.5)
+            return mmif.upper()
+
+        self.assertTrue(self.queue.run_next(handler))
+        self.assertEqual(seen, [('{"first": 1}', {'tpSampleRate': ['500']})])
+        self.assertEqual(self.queue.status(first)['status'], 'done')
+        self.assertEqual(self.queue.result(first), '{"FIRST": 1}')
+        self.assertEqual(self.queue.status(second)['position'], 1)
+        self.assertIsNone(self.queue.result(second))
+
+    def test_failure(self):
+        job_id = self.queue.submit('{}', {})
+
+        def handler(mmif, params):
+            raise jobs.JobError('no video', output='{"error": true}')
+
+        self.queue.run_next(handler)
+        status = self.queue.status(job_id)
+        self.assertEqual((status['status'], status['error']), ('failed', 'no video'))
+        self.assertEqual(self.queue.result(job_id), '{"error": true}')
+        self.assertFalse(self.queue.run_next(handler))
+        with self.assertRaises(KeyError):
+            self.queue.status('../queue')
+
+    def test_requeue_orphans(self):
+        job_id = self.queue.submit('{}', {})
+        self.assertEqual(self.queue.claim(), job_id)
+        self.assertEqual(self.queue.queued(), [])
+        # the process that claimed the job is gone
+        (self.queue.running_dir / job_id).write_text(f'{socket.gethostname()} {2 ** 22 + 1}')
+        self.queue.requeue_orphans()
+        self.assertEqual(self.queue.queued(), [job_id])
+        self.assertEqual(json.loads((self.queue.jobs_dir / job_id / 'status.json').read_text())['status'], 'queued')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+
+from modeling import memory
+
+
+class TestMemory(unittest.TestCase):
+
+    def test_batch_size_for_budget(self):
+        hd = memory.frame_bytes((1080, 1920, 3), 224, 768, items_in_flight=8)
+        resized = memory.frame_bytes((236, 314, 3), 224, 768, items_in_flight=8)
+        self.assertGreater(hd, resized)
+        # larger backbones need more memory per frame
+        self.assertGreater(memory.frame_bytes((236, 314, 3), 224, 1536, 8), resized)
+        budget = 16 * hd
+        self.assertEqual(memory.batch_size_for_budget(budget, hd, 32), 16)
+        self.assertEqual(memory.batch_size_for_budget(budget, resized, 32), 32)
+        with self.assertLogs(memory.logger, 'WARNING'):
+            self.assertEqual(memory.batch_size_for_budget(hd // 2, hd, 32), 1)
+
+    def test_peak_rss(self):
+        memory.reset_peak_rss()
+        before = memory.peak_rss()
+        self.assertGreater(before, 0)
+        data = b'x' * (64 * 2 ** 20)
+        self.assertGreaterEqual(memory.peak_rss(), before + len(data) // 2)
+        del data
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,16 @@
+import unittest
+
+import metadata
+
+
+class TestAppMetadata(unittest.TestCase):
+
+    def test_model_name_choices(self):
+        parameters = {parameter.name: parameter for parameter in metadata.appmetadata().parameters}
+        self.assertTrue(parameters['tpModelName'].choices)
+        self.assertEqual(parameters['tpModelName'].choices, parameters['tpCascadeModelName'].choices)
+        self.assertIn(parameters['tpCascadeModelName'].default, parameters['tpCascadeModelName'].choices)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import time
+import unittest
+
+from modeling import pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_order_and_stats(self):
+        consumed = []
+
+        def preprocess(x):
+            # later items finish preprocessing earlier, but must be consumed in source order
+            time.sleep(0.01 * (10 - x))
+            return x * 2
+
+        stats = pipeline.run(range(10), preprocess, consumed.append, queue_depth=2, preprocess_workers=3)
+        self.assertEqual(consumed, [x * 2 for x in range(10)])
+        for stage in ('decode', 'preprocess', 'inference'):
+            self.assertEqual(stats[stage]['items'], 10)
+            self.assertLessEqual(stats[stage]['utilisation'], 1.0)
+
+    def test_source_failure(self):
+        def source():
+            yield 1
+            raise RuntimeError('decoder failed')
+
+        with self.assertRaises(RuntimeError):
+            pipeline.run(source(), lambda x: x, lambda x: None)
+
+    def test_consumer_failure(self):
+        def consume(x):
+            raise ValueError('inference failed')
+
+        with self.assertRaises(ValueError):
+            pipeline.run(range(100), lambda x: x, consume, queue_depth=1)
+
+    def test_buffer_pool(self):
+        pool = pipeline.BufferPool(list)
+
+        def source():
+            for i in range(20):
+                buffer = pool.acquire()
+                buffer[:] = [i]
+                yield buffer
+
+        def preprocess(buffer):
+            x = buffer[0]
+            pool.release(buffer)
+            return x
+
+        consumed = []
+        pipeline.run(source(), preprocess, consumed.append, queue_depth=1, preprocess_workers=1)
+        self.assertEqual(consumed, list(range(20)))
+        # buffers are reused once released, at most one per item in flight is created
+        self.assertLess(pool.created, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
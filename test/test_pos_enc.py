@@ -1,6 +1,8 @@
 import collections
 import unittest
 
+import torch
+
 from modeling import data_loader
 
 # set up some mock, to avoid loading the full torch-vision model 
@@ -54,6 +56,15 @@ class TestPosAbsTh(unittest.TestCase):
         tot_time = 200
         self.assertEqual(extractor.convert_position(cur_time, tot_time), cur_time)
 
+    def test_encode_positions(self):
+        extractor = self.prep_extractor(10, 10, 100)
+        tot_time = 30
+        cur_times = [0, 5, 15, 20, 25, 29]
+        img_vecs = torch.rand(len(cur_times), extractor.img_encoder.dim)
+        batched = extractor.encode_positions(cur_times, tot_time, img_vecs)
+        for i, cur_time in enumerate(cur_times):
+            self.assertTrue(torch.equal(batched[i], extractor.encode_position(cur_time, tot_time, img_vecs[i])))
+
     @unittest.skip("Some extreme edge cases")
     def test_convert_position_edgecases(self):
         # full matrix is covered just by thresholds
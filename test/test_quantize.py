@@ -0,0 +1,51 @@
+import io
+import unittest
+import warnings
+
+import torch
+
+from modeling import classify, train
+
+
+class TestQuantization(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.head = train.get_net(in_dim=64, n_labels=5, num_layers=3).eval()
+        self.features = torch.randn(200, 64)
+        # torch.ao.quantization is deprecated in favor of torchao, but still the only built-in option
+        warnings.simplefilter('ignore', DeprecationWarning)
+
+    def calibrated_head(self):
+        prepared = classify.prepare_static_head(self.head, self.features[:2])
+        with torch.no_grad():
+            prepared(self.features)
+        return classify.convert_static_head(prepared)
+
+    def test_dynamic(self):
+        quantized = classify.quantize_dynamic(self.head)
+        # the original module is not modified
+        self.assertIsInstance(self.head.fc1, torch.nn.Linear)
+        with torch.no_grad():
+            expected = self.head(self.features).argmax(dim=1)
+            actual = quantized(self.features).argmax(dim=1)
+        self.assertGreater((expected == actual).float().mean().item(), 0.9)
+
+    def test_static_roundtrip(self):
+        head = self.calibrated_head()
+        with torch.no_grad():
+            expected = self.head(self.features).argmax(dim=1)
+            actual = head(self.features).argmax(dim=1)
+        self.assertGreater((expected == actual).float().mean().item(), 0.9)
+        # a saved calibrated head can be loaded into a freshly converted (uncalibrated) one
+        buffer = io.BytesIO()
+        torch.save(head.state_dict(), buffer)
+        buffer.seek(0)
+        reloaded = classify.convert_static_head(classify.prepare_static_head(self.head, self.features[:2]))
+        reloaded.load_state_dict(torch.load(buffer, weights_only=True))
+        with torch.no_grad():
+            self.assertTrue(torch.equal(head(self.features), reloaded(self.features)))
+
+
+if __name__ == '__main__':
+    unittest.main()
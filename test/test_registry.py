@@ -0,0 +1,97 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from modeling import classify
+from modeling.registry import ClassifierRegistry, DISTILLED_SUFFIX
+
+
+class DummyClassifier:
+    def __init__(self, model_stem, logger_name=None, img_encoder=None):
+        self.model_stem = model_stem
+        self.featurizer = mock.Mock(img_encoder=img_encoder if img_encoder is not None else object())
+
+
+class TestClassifierRegistry(unittest.TestCase):
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(classify, 'Classifier', DummyClassifier),
+            mock.patch.object(ClassifierRegistry, 'find_model_stem', lambda self, name, pos: Path(f'{name}.pos{pos}')),
+            mock.patch.object(ClassifierRegistry, 'memory_footprint', staticmethod(lambda *classifiers: 100 * len(classifiers))),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_hits_and_misses(self):
+        registry = ClassifierRegistry('.', max_models=2)
+        c1 = registry.get('tiny', True)
+        self.assertIs(registry.get('tiny', True), c1)
+        self.assertIsNot(registry.get('tiny', False), c1)
+        stats = registry.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['cached'], 2)
+
+    def test_lru_eviction_by_count(self):
+        registry = ClassifierRegistry('.', max_models=2)
+        registry.get('tiny', True)
+        registry.get('small', True)
+        registry.get('tiny', True)  # now `small` is the least recently used
+        registry.get('lg', True)
+        self.assertEqual(registry.cached_models(), (('tiny', True), ('lg', True)))
+        self.assertEqual(registry.stats()['evictions'], 1)
+
+    def test_lru_eviction_by_memory(self):
+        registry = ClassifierRegistry('.', max_models=10, max_bytes=250)
+        for name in ['tiny', 'small', 'lg']:
+            registry.get(name, True)
+        self.assertEqual(registry.cached_models(), (('small', True), ('lg', True)))
+
+    def test_no_caching(self):
+        registry = ClassifierRegistry('.', max_models=0)
+        registry.get('tiny', True)
+        registry.get('tiny', True)
+        self.assertEqual(registry.stats()['misses'], 2)
+
+    def test_shared_backbone(self):
+        registry = ClassifierRegistry('.', max_models=3)
+        pos = registry.get('tiny', True)
+        no_pos = registry.get('tiny', False)
+        other = registry.get('small', True)
+        self.assertIs(pos.featurizer.img_encoder, no_pos.featurizer.img_encoder)
+        self.assertIsNot(pos.featurizer.img_encoder, other.featurizer.img_encoder)
+
+
+class TestFindModelStem(unittest.TestCase):
+
+    def test_distilled_student(self):
+        with tempfile.TemporaryDirectory() as model_dir:
+            for stem in ['20241130-145637.convnext_tiny.noprebin.posT',
+                         '20250101-000000.convnext_tiny.noprebin.distilled.posT',
+                         '20250101-000000.convnext_tiny.noprebin.distilled.posF',
+                         '20241130-145637.convnext_tiny.noprebin.posF']:
+                Path(model_dir, f'{stem}.pt').touch()
+            registry = ClassifierRegistry(model_dir)
+            self.assertEqual(registry.find_model_stem('convnext_tiny', True).name,
+                             '20241130-145637.convnext_tiny.noprebin.posT')
+            self.assertEqual(registry.find_model_stem(f'convnext_tiny{DISTILLED_SUFFIX}', True).name,
+                             '20250101-000000.convnext_tiny.noprebin.distilled.posT')
+            self.assertEqual(registry.find_model_stem(f'convnext_tiny{DISTILLED_SUFFIX}', False).name,
+                             '20250101-000000.convnext_tiny.noprebin.distilled.posF')
+            with self.assertRaises(ValueError):
+                registry.find_model_stem('convnext_small', True)
+
+    def test_latest_model(self):
+        with tempfile.TemporaryDirectory() as model_dir:
+            for stem in ['20241130-145637.convnext_tiny.noprebin.posT', '20250101-000000.convnext_tiny.noprebin.posT',
+                         '20240101-000000.convnext_tiny.noprebin.posT']:
+                Path(model_dir, f'{stem}.pt').touch()
+            self.assertEqual(ClassifierRegistry(model_dir).find_model_stem('convnext_tiny', True).name,
+                             '20250101-000000.convnext_tiny.noprebin.posT')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+import torch
+
+from modeling import sampling
+
+
+def one_hot(label, confidence=1.0, labels=3):
+    probs = torch.full((labels,), (1 - confidence) / (labels - 1))
+    probs[label] = confidence
+    return probs
+
+
+class TestAdaptiveSampling(unittest.TestCase):
+
+    def test_coarse_indices(self):
+        self.assertEqual(sampling.coarse_indices(10, 4), [0, 4, 8, 9])
+        self.assertEqual(sampling.coarse_indices(9, 4), [0, 4, 8])
+
+    def test_refine_around_transitions(self):
+        # label 1 only in frames 35-52 of 100, everything else is confidently label 0
+        truth = [one_hot(1) if 35 <= i <= 52 else one_hot(0) for i in range(100)]
+        calls = []
+
+        def classify(indices):
+            calls.append(indices)
+            return {i: truth[i] for i in indices}
+
+        probs = sampling.refine(100, 10, classify, 0.5)
+        # the transition frames are found, and far fewer frames than the full grid are classified
+        self.assertTrue({34, 35, 52, 53}.issubset(probs))
+        self.assertLess(len(probs), 30)
+        indices, filled = sampling.interpolate(probs)
+        self.assertEqual(indices, list(range(100)))
+        self.assertEqual(filled.argmax(dim=1).tolist(), [t.argmax().item() for t in truth])
+
+    def test_refine_low_confidence(self):
+        probs = sampling.refine(9, 8, lambda indices: {i: one_hot(0, 0.4) for i in indices}, 0.5)
+        self.assertEqual(sorted(probs), list(range(9)))
+
+    def test_unreadable_frames(self):
+        # frames from 50 on can't be decoded
+        probs = sampling.refine(60, 10, lambda indices: {i: one_hot(i // 25) for i in indices if i < 50}, 0.5)
+        self.assertEqual(max(probs), 49)
+        indices, filled = sampling.interpolate(probs)
+        self.assertEqual(len(indices), 50)
+        self.assertEqual(filled.shape, (50, 3))
+
+
+class TestSceneSampling(unittest.TestCase):
+
+    def test_scene_indices(self):
+        # grid of every 30th frame, cuts at frames 310 and 905
+        framenums = list(range(0, 1200, 30))
+        indices = sampling.scene_indices(framenums, [310, 905], step=10, window=60)
+        self.assertEqual(indices, [0, 9, 10, 11, 12, 20, 29, 30, 31, 32, 39])
+
+
+class TestSharding(unittest.TestCase):
+
+    def test_split(self):
+        self.assertEqual(sampling.split(list(range(10)), 3), [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        # no empty shards
+        self.assertEqual(sampling.split([0, 30], 4), [[0], [30]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from modeling import threads
+
+
+class TestThreadConfig(unittest.TestCase):
+
+    def test_partition_cpus(self):
+        cpus = list(range(10))
+        parts = [threads.partition_cpus(cpus, 3, i) for i in range(3)]
+        self.assertEqual(parts, [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        # more workers than cores, cores are shared
+        self.assertEqual([threads.partition_cpus([0, 1], 3, i) for i in range(3)], [[0], [1], [0]])
+
+    def test_format_cpu_list(self):
+        self.assertEqual(threads.format_cpu_list([0, 1, 2, 3, 8, 10, 11]), '0-3,8,10-11')
+
+    def test_plan(self):
+        cpus = list(range(8))
+        auto = threads.ThreadConfig('auto', pin=True)
+        self.assertEqual(auto.plan(1, 4, cpus), {'intraOpThreads': 2, 'interOpThreads': None, 'cpuAffinity': [2, 3]})
+        fixed = threads.ThreadConfig(3, 1)
+        self.assertEqual(fixed.plan(1, 4, cpus), {'intraOpThreads': 3, 'interOpThreads': 1, 'cpuAffinity': None})
+        default = threads.ThreadConfig()
+        self.assertEqual(default.plan(0, 4, cpus)['intraOpThreads'], 8)
+        with self.assertRaises(ValueError):
+            threads.ThreadConfig(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+
+from modeling import train
+
+
+class TestDistillation(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.outputs = torch.randn(8, 5)
+        self.labels = torch.randint(0, 5, (8,))
+
+    def test_loss(self):
+        soft_labels = torch.softmax(torch.randn(8, 5), dim=1)
+        # without the teacher, it is the plain cross entropy
+        hard_only = train.DistillationLoss(temperature=2.0, alpha=0.0)(self.outputs, self.labels, soft_labels)
+        self.assertTrue(torch.allclose(hard_only, F.cross_entropy(self.outputs, self.labels, reduction='none')))
+        # the soft label loss vanishes when the student matches the teacher
+        matching = torch.softmax(self.outputs / 2.0, dim=1)
+        soft_only = train.DistillationLoss(temperature=2.0, alpha=1.0)(self.outputs, self.labels, matching)
+        self.assertTrue(torch.allclose(soft_only, torch.zeros(8), atol=1e-6))
+        self.assertTrue((train.DistillationLoss(alpha=1.0)(self.outputs, self.labels, soft_labels) > 0).all())
+
+    def test_train_student(self):
+        features = torch.randn(200, 16)
+        teacher = torch.nn.Linear(16, 4)
+        with torch.no_grad():
+            soft_labels = torch.softmax(teacher(features) / 2.0, dim=1)
+        labels = soft_labels.argmax(dim=1)
+        dataset = train.SWTDataset('mock', labels, features, soft_labels)
+        self.assertEqual(len(dataset[0]), 3)
+        student = train.train_model(train.get_net(16, 4, 2), train.DistillationLoss(temperature=2.0, alpha=1.0),
+                                    torch.device('cpu'), DataLoader(dataset, batch_size=20, shuffle=True),
+                                    {'num_epochs': 30})
+        with torch.no_grad():
+            agreement = (student(features).argmax(dim=1) == labels).float().mean().item()
+        self.assertGreater(agreement, 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import av
+import numpy as np
+
+from modeling import video
+
+
+def make_video(path, n_frames=90, fps=30, gop_size=10, size=(64, 48)):
+    container = av.open(str(path), 'w')
+    stream = container.add_stream('mpeg4', rate=fps)
+    stream.width, stream.height = size
+    stream.pix_fmt = 'yuv420p'
+    stream.gop_size = gop_size
+    for i in range(n_frames):
+        # every frame has a distinct brightness, so that frames can be told apart after decoding
+        img = np.full((size[1], size[0], 3), i * 2, np.uint8)
+        for packet in stream.encode(av.VideoFrame.from_ndarray(img, format='rgb24')):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+
+
+class TestFrameReader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.video_path = Path(cls.tmpdir.name) / 'test.mp4'
+        make_video(cls.video_path)
+        cls.reader = video.FrameReader(str(cls.video_path), 30)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def test_modes_agree(self):
+        framenums = [0, 7, 15, 44, 45, 89]
+        seek = list(self.reader.read_frames(framenums, 'seek'))
+        sequential = list(self.reader.read_frames(framenums, 'sequential'))
+        self.assertEqual([f for f, _ in seek], framenums)
+        self.assertEqual([f for f, _ in sequential], framenums)
+        for (_, img1), (_, img2) in zip(seek, sequential):
+            self.assertTrue(np.array_equal(np.asarray(img1), np.asarray(img2)))
+        # brightness increases with frame number
+        brightness = [np.asarray(img).mean() for _, img in sequential]
+        self.assertEqual(brightness, sorted(brightness))
+
+    def test_frames_beyond_end(self):
+        with self.assertWarns(UserWarning):
+            frames = list(self.reader.read_frames([80, 90, 100], 'sequential'))
+        self.assertEqual([f for f, _ in frames], [80])
+
+    def test_sequential_starts_near_window(self):
+        decoded = []
+        frame_index = self.reader._frame_index
+
+        def counting_frame_index(frame, start):
+            decoded.append(frame_index(frame, start))
+            return decoded[-1]
+
+        self.reader._frame_index = counting_frame_index
+        try:
+            frames = list(self.reader.read_frames([80, 82, 85], 'sequential'))
+        finally:
+            del self.reader._frame_index
+        self.assertEqual([f for f, _ in frames], [80, 82, 85])
+        # decoding starts from the keyframe before frame 80, not from frame 0
+        self.assertGreaterEqual(min(decoded), 80 - 10)
+        expected = list(self.reader.read_frames([80, 82, 85], 'seek'))
+        for (_, img1), (_, img2) in zip(frames, expected):
+            self.assertTrue(np.array_equal(img1, img2))
+
+    def test_choose_mode(self):
+        # the encoder may insert extra keyframes, but never leaves more than `gop_size` frames between them
+        self.assertTrue(1 < self.reader.estimate_gop_length() <= 10)
+        self.assertEqual(self.reader.choose_mode(3), 'sequential')
+        self.assertEqual(self.reader.choose_mode(30), 'seek')
+
+
+class TestCutDetection(unittest.TestCase):
+
+    def test_detect_cuts(self):
+        # regular keyframes every 100 frames, one inserted at frame 250, and a large inter-coded frame at 420
+        packets = [video.PacketInfo(i, 5000 if i % 100 == 0 or i == 250 else 3000 if i == 420 else 100 + i % 7,
+                                    i % 100 == 0 or i == 250) for i in range(600)]
+        self.assertEqual(video.detect_cuts(packets), [250, 420])
+
+    def test_detect_cuts_repeated_keyframes(self):
+        # most keyframes appear twice, as rounded timestamps of a variable frame rate stream can collide
+        packets = []
+        for i in range(600):
+            keyframe = i % 100 == 0 or i == 250
+            packets.append(video.PacketInfo(i, 5000 if keyframe else 100 + i % 7, keyframe))
+            if keyframe and i != 250:
+                packets.append(video.PacketInfo(i, 5000, True))
+        self.assertEqual(video.detect_cuts(packets), [250])
+
+    def test_scan_packets(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / 'test.mp4'
+            make_video(video_path, n_frames=30)
+            packets = video.FrameReader(str(video_path), 30).scan_packets()
+        self.assertEqual([p.frame for p in packets], list(range(30)))
+        self.assertTrue(packets[0].keyframe)
+
+
+class TestThumbnail(unittest.TestCase):
+
+    def test_thumbnail(self):
+        image = np.zeros((48, 64, 3), np.uint8)
+        image[:, 32:] = 255
+        thumbnail = video.thumbnail(image, size=4)
+        self.assertEqual(thumbnail.shape, (4, 4))
+        self.assertTrue(np.allclose(thumbnail, [[0, 0, 1, 1]] * 4))
+
+    def test_thumbnail_distance(self):
+        black = video.thumbnail(np.zeros((48, 64, 3), np.uint8))
+        noisy = video.thumbnail(np.random.randint(0, 4, (48, 64, 3), np.uint8))
+        white = video.thumbnail(np.full((48, 64, 3), 255, np.uint8))
+        self.assertLess(video.thumbnail_distance(black, noisy), 0.02)
+        self.assertAlmostEqual(video.thumbnail_distance(black, white), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()